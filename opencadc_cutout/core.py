@@ -139,7 +139,7 @@ class OpenCADCCutout(object):
         self.helper_factory = helper_factory
         self.input_range_parser = input_range_parser
 
-    def cutout(self, input_reader, output_writer, cutout_dimensions_str, file_type):
+    def cutout(self, input_reader, output_writer, cutout_dimensions_str, file_type, **kwargs):
         """
         Perform a Cutout of the given data at the given position and size.
 
@@ -152,14 +152,121 @@ class OpenCADCCutout(object):
             The writer to push the cutout array to.
 
         cutout_dimensions_str: string of WCS coordinates, or extension and pixel coordinates.
-            The requested dimensions expressed as PixelCutoutHDU objects.
+            The requested dimensions, either in cfitsio pixel format (e.g. [SCI,2][80:220,100:150]), or as a SODA
+            sky region in ICRS degrees (e.g. CIRCLE 210.8 54.35 0.05, or POLYGON followed by vertex coordinates),
+            and/or a spectral BAND of wavelengths in metres (e.g. BAND 0.211 0.212, or BAND 1.42e9 1.43e9 Hz).
 
         file_type: string
             The file type, in upper case.  Will usually be 'FITS'.
+
+        kwargs: dict
+            Options passed through to the file helper (e.g. read_gap_threshold for FITS).
         """
         file_helper = self._get_file_helper(
-            file_type, input_reader, output_writer)
+            file_type, input_reader, output_writer, **kwargs)
         file_helper.cutout(cutout_dimensions_str)
 
-    def _get_file_helper(self, file_type, input_reader, output_writer):
-        return self.helper_factory.get_instance(file_type, input_reader, output_writer, self.input_range_parser)
+    def cutout_batch(self, input_reader, cutout_requests, file_type, sink=None, **kwargs):
+        """
+        Perform many cutouts from the same input in one pass.  The input is opened and indexed once, and headers are
+        read once for all of the regions on the same HDU.
+
+        Parameters
+        ----------
+        input_reader: File-like object, Reader stream
+            The file location.
+
+        cutout_requests: list of (cutout_dimensions_str, output_writer) tuples
+            The regions to cut out, each with the writer to push its cutout to.  When a sink is given, plain
+            cutout_dimensions_str values may be used instead.
+
+        file_type: string
+            The file type, in upper case.  Will usually be 'FITS'.
+
+        sink: callable
+            Optional callback, called as sink(request_idx, header, data) with every cutout HDU instead of writing it.
+
+        kwargs: dict
+            Options passed through to the file helper (e.g. read_gap_threshold for FITS).
+
+        Returns
+        -------
+        list of the number of cutout HDUs made for each request.
+        """
+        file_helper = self._get_file_helper(
+            file_type, input_reader, None, **kwargs)
+        return file_helper.cutout_batch(cutout_requests, sink=sink)
+
+    def postage_stamps(self, input_reader, output_writer, x, y, shape, file_type, extension='0', layout='cube',
+                       **kwargs):
+        """
+        Cut out stamps of one shape around many positions (e.g. from a catalog) on one image, all in one pass.
+
+        Parameters
+        ----------
+        input_reader: File-like object, Reader stream
+            The file location.
+
+        output_writer: File-like object, Writer stream
+            The writer to push the stamps to.
+
+        x, y: arrays of numbers
+            The stamp centres, in 1-based pixel coordinates along the first and second axes.
+
+        shape: tuple of int
+            The stamp shape, in numpy (rows, columns) order.
+
+        file_type: string
+            The file type, in upper case.  Will usually be 'FITS'.
+
+        extension: int or string
+            The extension with the image, as in a cutout string (e.g. 1, or 'SCI,2').
+
+        layout: string
+            'cube' to write the stamps as a single stacked cube, or 'mef' to write one extension per stamp.
+
+        kwargs: dict
+            Options passed through to the file helper (e.g. read_gap_threshold for FITS).
+
+        Returns
+        -------
+        The number of stamps that overlap the image.
+        """
+        file_helper = self._get_file_helper(
+            file_type, input_reader, output_writer, **kwargs)
+        return file_helper.postage_stamps(x, y, shape, extension=extension, layout=layout)
+
+    def mosaic(self, input_readers, output_writer, cutout_dimensions_str, file_type, **kwargs):
+        """
+        Cut a sky region out of several tiles of a survey (e.g. found through `.sky_index.SkyIndex`), and assemble
+        the pieces into one image, on the pixel grid of the first tile.  The tiles must share a projection, and only
+        differ in their reference pixels.
+
+        Parameters
+        ----------
+        input_readers: list of File-like objects, Reader streams
+            The tiles.  They must be seekable.
+
+        output_writer: File-like object, Writer stream
+            The writer to push the mosaic to.
+
+        cutout_dimensions_str: string of WCS coordinates
+            The SODA sky region (and/or spectral band) to cut out.
+
+        file_type: string
+            The file type, in upper case.  Will usually be 'FITS'.
+
+        kwargs: dict
+            Options passed through to the file helper (e.g. read_gap_threshold for FITS).
+
+        Returns
+        -------
+        The number of pieces in the mosaic.
+        """
+        file_helper = self._get_file_helper(
+            file_type, input_readers[0], output_writer, **kwargs)
+        return file_helper.mosaic(cutout_dimensions_str, input_readers[1:])
+
+    def _get_file_helper(self, file_type, input_reader, output_writer, **kwargs):
+        return self.helper_factory.get_instance(file_type, input_reader, output_writer, self.input_range_parser,
+                                                **kwargs)
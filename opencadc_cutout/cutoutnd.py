@@ -72,25 +72,426 @@ from __future__ import (absolute_import, division, print_function,
 
 import logging
 import numpy as np
+import re
+import warnings
 
 from copy import deepcopy
 
 from astropy.wcs import Sip
-from astropy.nddata.utils import extract_array
+from astropy.nddata.utils import overlap_slices, NoOverlapError
 from .no_content_error import NoContentError
 
-__all__ = ['CutoutResult', 'CutoutND']
+__all__ = ['CutoutResult', 'StampsResult', 'StreamedCutout', 'BinnedCutout', 'WCSOffset', 'CutoutND', 'PADDING_FILL',
+           'PADDING_CLIP', 'BIN_MEAN', 'BIN_SUM', 'BIN_MEDIAN', 'COLLAPSE_SUM', 'COLLAPSE_MEAN', 'COLLAPSE_MAX',
+           'COLLAPSE_MOMENT0']
+
+
+# How cutouts hanging off the edge of the data are handled: padded (with NaN for floating point data, and the BLANK
+# value for integer data), or clipped to the data.
+PADDING_FILL = 'fill'
+PADDING_CLIP = 'clip'
+PADDING_POLICIES = (PADDING_FILL, PADDING_CLIP)
+
+# Keywords of the WCS of one axis (e.g. CRPIX3), of two axes (e.g. PC1_3), or of an axis and a parameter (e.g. PV2_1),
+# with an optional alternate WCS letter.
+WCS_AXIS_KEYWORD_PATTERN = re.compile(
+    r'^(?P<prefix>CTYPE|CRVAL|CRPIX|CDELT|CUNIT|CROTA|CNAME|CRDER|CSYER|PC|CD|PV|PS)(?P<axis>\d+)'
+    r'(?:_(?P<index>\d+))?(?P<alt>[A-Z]?)$')
+TWO_AXIS_PREFIXES = ('PC', 'CD')
+PARAMETER_PREFIXES = ('PV', 'PS')
+
+# How the pixels of each block of a binned cutout are combined.  Blank (NaN, or BLANK for integer data) pixels are left
+# out, and blocks of nothing but blank pixels are blank.
+BIN_MEAN = 'mean'
+BIN_SUM = 'sum'
+BIN_MEDIAN = 'median'
+BIN_REDUCERS = {BIN_MEAN: np.nanmean, BIN_SUM: np.nansum, BIN_MEDIAN: np.nanmedian}
+
+# How a cube is collapsed along an axis (usually the spectral one).  The zeroth moment is the sum multiplied by the
+# width of a channel.  Blank pixels are left out, as when binning.
+COLLAPSE_SUM = 'sum'
+COLLAPSE_MEAN = 'mean'
+COLLAPSE_MAX = 'max'
+COLLAPSE_MOMENT0 = 'moment0'
+COLLAPSE_METHODS = (COLLAPSE_SUM, COLLAPSE_MEAN, COLLAPSE_MAX, COLLAPSE_MOMENT0)
+
+
+def _get_bin_dtype(dtype):
+    """
+    Binned data is floating point, so that blank pixels can be NaN.
+    """
+    return np.result_type(dtype, np.float32)
+
+
+def _to_float(data, blank=None):
+    """
+    Convert data to the floating point type it is reduced in, with NaN for the blank pixels of integer data.
+    """
+    data = np.asarray(data)
+    float_data = data.astype(_get_bin_dtype(data.dtype), copy=False)
+
+    if blank is not None and not np.issubdtype(data.dtype, np.floating):
+        float_data = np.where(data == blank, np.nan, float_data)
+
+    return float_data
+
+
+def _block_reduce(data, factors, method, blank=None):
+    """
+    Combine the pixels of blocks of the given size, leaving out any partial blocks at the end of each axis.
+    :param data: Array to bin.
+    :param factors: The block size along each axis, in numpy order.
+    :param method: One of BIN_MEAN, BIN_SUM or BIN_MEDIAN.
+    :param blank: The value of blank pixels of integer data.
+    :return: Floating point array, of the shape of the data divided by the factors.
+    """
+    data = np.asarray(data)
+    binned_shape = tuple(length // factor for length, factor in zip(data.shape, factors))
+    blocks = _to_float(data[tuple(slice(0, length * factor) for length, factor in zip(binned_shape, factors))], blank)
+    blocks = blocks.reshape(tuple(x for length, factor in zip(binned_shape, factors) for x in (length, factor)))
+    block_axes = tuple(range(1, blocks.ndim, 2))
+
+    with warnings.catch_warnings():
+        # All blank blocks.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        binned = BIN_REDUCERS[method](blocks, axis=block_axes)
+
+    if method == BIN_SUM:
+        binned[np.all(np.isnan(blocks), axis=block_axes)] = np.nan
+
+    return binned
+
+
+class WCSOffset(object):
+    """
+    How a cutout moves the WCS of the data it is cut from.  A pixel cutout only moves the reference pixel (and
+    changes NAXISn), so this is applied straight to the CRPIXn cards of a header, rather than through a copy of the
+    full WCS.  A cutout keeping only every k-th pixel along an axis also scales the pixel size along it (the CDi_j
+    column, or CDELTn) and any SIP distortion coefficients by k.  A collapsed cutout removes the collapsed axis from
+    the WCS, numbering the axes after it down by one.
+
+    Parameters
+    ----------
+    shift : list of float
+        The number of pixels the reference pixel moves back by along each FITS axis (i.e. subtracted from CRPIXn).
+    naxis : list of int
+        The shape of the cutout, in FITS axis order.
+    wcs : `~astropy.wcs.WCS` or `None`
+        The WCS of the data cut from, if one was parsed, to build the WCS of the cutout from on demand.
+    steps : list of int or `None`
+        The step along each FITS axis, for cutouts keeping only every step-th pixel.  Defaults to 1 for every axis.
+    removed_axis : int or `None`
+        The 0-based FITS axis collapsed, if any.  Shift and steps still cover it.
+    """
+
+    def __init__(self, shift, naxis, wcs=None, steps=None, removed_axis=None):
+        self.shift = shift
+        self.naxis = naxis
+        self.wcs = wcs
+        self.steps = [1] * len(shift) if steps is None else list(steps)
+        self.removed_axis = removed_axis
+
+    def _remove_axis(self, header):
+        """
+        Remove the cards of the removed axis, and number the cards of the axes after it down by one.  Cards
+        referring to two axes (e.g. PCi_j) go if either is the removed axis.
+        """
+        removed = self.removed_axis + 1
+        renames = []
+
+        for keyword in list(header.keys()):
+            match = WCS_AXIS_KEYWORD_PATTERN.match(keyword)
+            if match is None or ((match.group('index') is None) != (match.group('prefix') not in
+                                                                     TWO_AXIS_PREFIXES + PARAMETER_PREFIXES)):
+                continue
+
+            prefix = match.group('prefix')
+            axes = [int(match.group('axis'))]
+            if prefix in TWO_AXIS_PREFIXES:
+                axes.append(int(match.group('index')))
+
+            if removed in axes:
+                header.remove(keyword, ignore_missing=True)
+            elif any(axis > removed for axis in axes):
+                renames.append((max(axes), keyword, match, axes))
+
+        # The cards taking the new names are either gone, or renamed first (as they refer to lower axes).
+        for _, keyword, match, axes in sorted(renames, key=lambda rename: rename[0]):
+            numbers = [str(axis - 1 if axis > removed else axis) for axis in axes]
+            if match.group('prefix') in PARAMETER_PREFIXES:
+                numbers.append(match.group('index'))
+            header.rename_keyword(keyword, '{}{}{}'.format(match.group('prefix'), '_'.join(numbers),
+                                                           match.group('alt')))
+
+    def _get_sip_scale(self, order):
+        """
+        Scale of the SIP coefficients (indexed [p, q]) for the x and y axes.  Pixel offsets along each axis shrink
+        by its step, so u^p v^q scales by 1 / (k1^p * k2^q), and the distortion itself (in pixels) by 1 / k.
+        """
+        k1, k2 = (list(self.steps) + [1, 1])[:2]
+        p, q = np.mgrid[0:order + 1, 0:order + 1]
+        scale = (float(k1) ** p) * (float(k2) ** q)
+        return scale / k1, scale / k2
+
+    def _apply_sip(self, header):
+        for prefix, scale_axis in (('A', 0), ('B', 1), ('AP', 0), ('BP', 1)):
+            order = header.get('{}_ORDER'.format(prefix))
+            if order is None:
+                continue
+            scale = self._get_sip_scale(int(order))[scale_axis]
+            for p in range(int(order) + 1):
+                for q in range(int(order) + 1 - p):
+                    keyword = '{}_{}_{}'.format(prefix, p, q)
+                    if keyword in header:
+                        header.set(keyword, header[keyword] * scale[p, q])
+
+    def apply(self, header):
+        """
+        Move the reference pixel of the given header.  A missing CRPIXn defaults to 0, as in WCSLIB.  Stepped axes
+        also have their pixel size scaled, through the CDi_j cards if the header has any, or CDELTn otherwise.  A
+        missing CDELTn defaults to 1, as in WCSLIB.
+        """
+        naxis = len(self.shift)
+
+        for idx, (shift, step) in enumerate(zip(self.shift, self.steps)):
+            keyword = 'CRPIX{}'.format(idx + 1)
+            if step != 1:
+                # Pixel p of the data is pixel (p - shift - 1) / step + 1 of the cutout.
+                header.set(keyword, ((header.get(keyword, 0.0) - shift - 1.0) / step) + 1.0)
+
+                cd_keywords = ['CD{}_{}'.format(i + 1, idx + 1) for i in range(naxis)]
+                pc_keywords = ['PC{}_{}'.format(i + 1, idx + 1) for i in range(naxis) if i != idx]
+
+                if any(cd_keyword in header for cd_keyword in cd_keywords):
+                    for cd_keyword in cd_keywords:
+                        if cd_keyword in header:
+                            header.set(cd_keyword, header[cd_keyword] * step)
+                elif any(header.get(pc_keyword, 0.0) for pc_keyword in pc_keywords):
+                    # CDELTn scales a row of a rotated PC matrix, so the step goes into its column instead.
+                    diagonal_keyword = 'PC{0}_{0}'.format(idx + 1)
+                    header.set(diagonal_keyword, header.get(diagonal_keyword, 1.0) * step)
+                    for pc_keyword in pc_keywords:
+                        if pc_keyword in header:
+                            header.set(pc_keyword, header[pc_keyword] * step)
+                else:
+                    cdelt_keyword = 'CDELT{}'.format(idx + 1)
+                    header.set(cdelt_keyword, header.get(cdelt_keyword, 1.0) * step)
+            elif shift:
+                header.set(keyword, header.get(keyword, 0.0) - shift)
+
+        if any(step != 1 for step in self.steps[:2]):
+            self._apply_sip(header)
+
+        if self.removed_axis is not None:
+            self._remove_axis(header)
+
+    def get_wcs(self):
+        """
+        Build a full WCS for the cutout, which means copying the WCS cut from.
+        :return: (WCS, CRPIX array) tuple, or (None, None) without a WCS to start from.
+        """
+        if self.wcs is None:
+            return None, None
+
+        output_wcs = deepcopy(self.wcs)
+        wcs_crpix = output_wcs.wcs.crpix
+
+        while len(wcs_crpix) < len(self.shift):
+            wcs_crpix = np.append(wcs_crpix, 1.0)
+
+        for idx, (shift, step) in enumerate(zip(self.shift, self.steps)):
+            if step == 1:
+                wcs_crpix[idx] -= shift
+                continue
+
+            wcs_crpix[idx] = ((wcs_crpix[idx] - shift - 1.0) / step) + 1.0
+
+            if idx < output_wcs.wcs.naxis:
+                if output_wcs.wcs.has_cd():
+                    output_wcs.wcs.cd[:, idx] *= step
+                elif np.any(np.delete(output_wcs.wcs.get_pc()[:, idx], idx)):
+                    output_wcs.wcs.pc[:, idx] *= step
+                else:
+                    output_wcs.wcs.cdelt[idx] *= step
+
+        output_wcs._naxis = list(self.naxis)
+
+        if self.wcs.sip is not None:
+            curr_sip = self.wcs.sip
+            sip_arrays = [curr_sip.a, curr_sip.b, curr_sip.ap, curr_sip.bp]
+
+            if any(step != 1 for step in self.steps[:2]):
+                sip_arrays = [None if sip_array is None else
+                              sip_array * self._get_sip_scale(sip_array.shape[0] - 1)[idx % 2]
+                              for idx, sip_array in enumerate(sip_arrays)]
+
+            output_wcs.sip = Sip(sip_arrays[0], sip_arrays[1], sip_arrays[2], sip_arrays[3], wcs_crpix[0:2])
+
+        if self.removed_axis is not None:
+            output_wcs = output_wcs.dropaxis(self.removed_axis)
+            output_wcs._naxis = list(self.naxis)
+            wcs_crpix = np.delete(wcs_crpix, self.removed_axis)
+
+        return output_wcs, wcs_crpix
 
 
 class CutoutResult(object):
     """
     Just a DTO to move results of a cutout.  It's more readable than a plain tuple.
+
+    The WCS of the cutout is only built when first asked for, from the WCS offset.  The blank value is the value
+    integer data was padded with, if it was.  Binned cutouts give the method used, and the number of pixels in a
+    block.
     """
 
-    def __init__(self, data, wcs=None, wcs_crpix=None):
+    def __init__(self, data, wcs=None, wcs_crpix=None, wcs_offset=None, blank=None, bin_method=None, bin_size=1):
         self.data = data
-        self.wcs = wcs
-        self.wcs_crpix = wcs_crpix
+        self.wcs_offset = wcs_offset
+        self.blank = blank
+        self.bin_method = bin_method
+        self.bin_size = bin_size
+        self._wcs = wcs
+        self._wcs_crpix = wcs_crpix
+
+    def _build_wcs(self):
+        if self._wcs is None and self.wcs_offset is not None:
+            self._wcs, self._wcs_crpix = self.wcs_offset.get_wcs()
+
+    @property
+    def wcs(self):
+        self._build_wcs()
+        return self._wcs
+
+    @property
+    def wcs_crpix(self):
+        self._build_wcs()
+        return self._wcs_crpix
+
+
+class StreamedCutout(object):
+    """
+    A cutout too large to hold in memory at once, which is read in chunks of whole planes along its slowest axis (or
+    of rows, for images) as it is written out.  Only the first chunk is read before then, to find the type of the
+    data.
+
+    Parameters
+    ----------
+    data : array-like
+        The data cut from, usually a lazy reader that only reads the rows it's indexed with.
+    slices : tuple of slice
+        The slices of the data in the cutout, in numpy order, with no padding.  They may have a step.
+    max_bytes : int
+        The most bytes to read in one chunk.  A chunk is at least one plane, however large.
+    """
+
+    def __init__(self, data, slices, max_bytes):
+        self.data = data
+        self.slices = tuple(slices)
+        self.shape = tuple(len(range(s.start, s.stop, s.step or 1)) for s in self.slices)
+        self._plane_step = self.slices[0].step or 1
+        plane_bytes = int(np.prod(self.shape[1:], dtype=np.int64)) * data.dtype.itemsize
+        self.chunk_planes = max(1, int(max_bytes // max(1, plane_bytes)))
+        self._first_chunk = None
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    @property
+    def dtype(self):
+        return self._get_first_chunk().dtype
+
+    def _read_chunk(self, start):
+        stop = min(start + (self.chunk_planes * self._plane_step), self.slices[0].stop)
+        return np.asarray(self.data[(slice(start, stop, self._plane_step),) + self.slices[1:]])
+
+    def _get_first_chunk(self):
+        if self._first_chunk is None:
+            self._first_chunk = self._read_chunk(self.slices[0].start)
+        return self._first_chunk
+
+    def iter_chunks(self):
+        """
+        Read the cutout, one chunk at a time.
+        :return: iterator of arrays, to be written one after the other.
+        """
+        first_chunk = self._get_first_chunk()
+        # Let the first chunk go once it's been handed out.
+        self._first_chunk = None
+        yield first_chunk
+        del first_chunk
+
+        chunk_step = self.chunk_planes * self._plane_step
+        for start in range(self.slices[0].start + chunk_step, self.slices[0].stop, chunk_step):
+            yield self._read_chunk(start)
+
+
+class BinnedCutout(StreamedCutout):
+    """
+    A binned cutout too large to read at once, which is read in chunks of whole blocks of planes, each of which is
+    binned as it is read.  Only the binned data is ever held for more than one chunk.
+
+    Parameters
+    ----------
+    data : array-like
+        The data cut from, usually a lazy reader that only reads the rows it's indexed with.
+    slices : tuple of slice
+        The slices of the data in the cutout, in numpy order, with no padding.  They may have a step.  Pixels past the
+        last whole block of each axis are left out.
+    factors : tuple of int
+        The block size along each axis, in numpy order.
+    method : str
+        One of BIN_MEAN, BIN_SUM or BIN_MEDIAN.
+    max_bytes : int
+        The most bytes to read in one chunk.  A chunk is at least one block of planes, however large.
+    blank : int
+        The value of blank pixels of integer data.
+    """
+
+    def __init__(self, data, slices, factors, method, max_bytes, blank=None):
+        whole_slices = []
+        for s, factor in zip(slices, factors):
+            step = s.step or 1
+            count = (len(range(s.start, s.stop, step)) // factor) * factor
+            whole_slices.append(slice(s.start, s.start + ((count - 1) * step) + 1 if count else s.start, step))
+
+        super(BinnedCutout, self).__init__(data, whole_slices, max_bytes)
+        self.factors = tuple(factors)
+        self.method = method
+        self.blank = blank
+        self.chunk_planes = max(1, self.chunk_planes // self.factors[0]) * self.factors[0]
+        self.shape = tuple(length // factor for length, factor in zip(self.shape, self.factors))
+
+    @property
+    def dtype(self):
+        return _get_bin_dtype(self.data.dtype)
+
+    def _read_chunk(self, start):
+        return _block_reduce(super(BinnedCutout, self)._read_chunk(start), self.factors, self.method, self.blank)
+
+
+class StampsResult(object):
+    """
+    DTO for the results of a postage stamp extraction.
+
+    Parameters
+    ----------
+    data : `~numpy.ndarray`
+        The stamps, stacked along a new first axis.
+    starts : `~numpy.ndarray`
+        The 0-based index in the data of the first pixel of each stamp, one row per stamp.
+    overlaps : `~numpy.ndarray`
+        Whether each stamp overlaps the data at all.  Stamps that don't are entirely padding.
+    """
+
+    def __init__(self, data, starts, overlaps):
+        self.data = data
+        self.starts = starts
+        self.overlaps = overlaps
 
 
 class CutoutND(object):
@@ -102,7 +503,9 @@ class CutoutND(object):
       cutout_region : `PixelCutoutHDU`
           The Pixel HDU Cutout description.  See opencadc_cutout.pixel_cutout_hdu.py.
       wcs : `~astropy.wcs.WCS` or `None`
-          A WCS object associated with the cutout array.  If it's specified, reset the WCS values for the cutout.
+          A WCS object associated with the cutout array.  If it's specified, the WCS of the cutout can be obtained
+          from the result.  The offset of the WCS (see `WCSOffset`) is always given, so that pixel cutouts can move
+          the reference pixel of a header without one.
 
       Returns
       -------
@@ -119,7 +522,7 @@ class CutoutND(object):
         requested_shape = cutout_region.get_shape()
         requested_position = cutout_region.get_position()
 
-        # reverse position because extract_array uses reverse ordering (i.e. x,y -> y,x).
+        # reverse position because overlap_slices uses reverse ordering (i.e. x,y -> y,x).
         r_position = tuple(reversed(requested_position))
         r_shape = tuple(reversed(requested_shape))
 
@@ -141,49 +544,437 @@ class CutoutND(object):
                 r_position, data_shape))
 
         if r_position:
-            position = tuple((data_shape[:(len_data - len_pos)]) + r_position)
+            # Axes without a range are taken whole, so centre on them.
+            position = tuple(tuple((x - 1) / 2.0 for x in data_shape[:(len_data - len_pos)]) + r_position)
+            if shape:
+                # As are axes whose range is the whole axis, which would otherwise be centred half a pixel low when
+                # of even length.
+                position = tuple((data_shape[idx] - 1) / 2.0 if shape[idx] == data_shape[idx] else position[idx]
+                                 for idx in range(len_data))
         else:
             position = None
 
         return (position, shape)
 
-    def extract(self, cutout_region):
+    def _get_stepped_slices(self, data_shape, cutout_region):
+        """
+        Obtain the slices of a cutout keeping only every step-th pixel of some axes.  These are always clipped to the
+        data, starting from the first pixel of each range (as in cfitsio), or the first one on the data if the range
+        starts before it.
+        :return: tuple of slices, with steps, in numpy order.
+        """
+        ranges = cutout_region.get_ranges()
+        steps = cutout_region.get_steps()
+        len_data = len(data_shape)
+
+        if len(ranges) > len_data:
+            raise NoContentError('Invalid shape requested (tried to extract {} from {}).'.format(
+                tuple(reversed(ranges)), data_shape))
+
+        slices = [slice(0, length, 1) for length in data_shape]
+
+        for idx, ((lower, upper), step) in enumerate(zip(ranges, steps)):
+            axis = len_data - idx - 1
+            start = lower - 1
+            if start < 0:
+                # Move on to the first selected pixel on the data.
+                start += ((-start + step - 1) // step) * step
+            stop = min(upper, data_shape[axis])
+
+            if start >= stop:
+                raise NoOverlapError('Range {}:{}:{} does not overlap the data along axis {} of length {}.'.format(
+                    lower, upper, step, idx + 1, data_shape[axis]))
+
+            slices[axis] = slice(start, stop, step)
+
+        return tuple(slices)
+
+    def get_slices(self, cutout_region, data_shape=None):
+        """
+        Obtain the slices of the data that extract() will read for the given region.  Raises the same errors as
+        extract() for regions that miss the data.
+
+        :param cutout_region: `PixelCutoutHDU`  The Pixel HDU Cutout description.
+        :param data_shape: Optional shape to use instead of that of the data, so that a region can be checked (from a
+        header, say) before there is any data.
+        :return: tuple of slices, or an Ellipsis if the entire data is used.
+        """
+        data_shape = self.data.shape if data_shape is None else tuple(data_shape)
+
+        if cutout_region.has_steps():
+            return self._get_stepped_slices(data_shape, cutout_region)
+
+        position, shape = self._get_position_shape(data_shape, cutout_region)
+
+        if (not position and not shape) or shape == data_shape:
+            return Ellipsis
+        else:
+            large_slices, _ = overlap_slices(data_shape, shape, position, mode='partial')
+            return large_slices
+
+    def _get_streamed(self, position, shape, max_bytes):
+        """
+        Set up the cutout to be read in chunks, if it's larger than max_bytes and isn't padded (padded cutouts are
+        made whole, by extract()).
+        :return: StreamedCutout instance, or None if the cutout is to be read at once.
+        """
+        data = self.data
+        data_shape = data.shape
+
+        if data.ndim < 2:
+            return None
+        elif (not position and not shape) or shape == data_shape:
+            slices = tuple(slice(0, length) for length in data_shape)
+        else:
+            slices, _ = overlap_slices(data_shape, shape, position, mode='partial')
+            if tuple(s.stop - s.start for s in slices) != tuple(shape):
+                return None
+
+        if int(np.prod([s.stop - s.start for s in slices], dtype=np.int64)) * data.dtype.itemsize <= max_bytes:
+            return None
+        else:
+            return StreamedCutout(data, slices, max_bytes)
+
+    def _extract_stepped(self, cutout_region, max_bytes):
+        """
+        Extract a cutout keeping only every step-th pixel of some axes, which lazy readers do by reading only the
+        rows selected.
+        :return: CutoutResult instance
+        """
+        data = self.data
+        slices = self._get_stepped_slices(data.shape, cutout_region)
+        shape = tuple(len(range(s.start, s.stop, s.step)) for s in slices)
+        self.logger.debug('Cutting out {} with steps {} for extension {} from {}.'.format(
+            shape, tuple(s.step for s in slices), cutout_region.get_extension(), data.shape))
+
+        if max_bytes is not None and data.ndim >= 2 and \
+                int(np.prod(shape, dtype=np.int64)) * data.dtype.itemsize > max_bytes:
+            cutout_data = StreamedCutout(data, slices, max_bytes)
+        else:
+            cutout_data = data[slices]
+
+        wcs_offset = WCSOffset([s.start for s in reversed(slices)], list(reversed(cutout_data.shape)), wcs=self.wcs,
+                               steps=[s.step for s in reversed(slices)])
+
+        return CutoutResult(data=cutout_data, wcs_offset=wcs_offset)
+
+    def _extract_partial(self, large_slices, small_slices, shape, fill_value):
+        """
+        Pad a cutout hanging off the edge of the data, in a single array of the type of the data, which the overlap is
+        read straight into where the data supports it.
+        :return: tuple of the array, and the value integer data was padded with (or None for floating point data).
+        """
+        data = self.data
+
+        if np.issubdtype(data.dtype, np.floating):
+            blank = None
+            padding_value = np.nan
+        else:
+            blank = np.iinfo(data.dtype).min if fill_value is None else int(fill_value)
+            padding_value = blank
+
+        cutout_data = np.full(shape, padding_value, dtype=data.dtype)
+        read_into = getattr(data, 'read_into', None)
+
+        if read_into is not None:
+            read_into(large_slices, cutout_data, small_slices)
+        else:
+            cutout_data[small_slices] = data[large_slices]
+
+        return cutout_data, blank
+
+    def _get_bin_factors(self, bin_factors):
+        """
+        Normalize the bin factors to one per axis of the data, in numpy order.
+        :param bin_factors: A factor for every axis, or a list of them in FITS order (later axes aren't binned).
+        """
+        ndim = self.data.ndim
+
+        if np.isscalar(bin_factors):
+            bin_factors = [bin_factors] * ndim
+        elif len(bin_factors) > ndim:
+            raise ValueError('Too many bin factors ({}) for data of shape {}.'.format(bin_factors, self.data.shape))
+
+        if not all(int(factor) == factor and factor >= 1 for factor in bin_factors):
+            raise ValueError('Bin factors must be positive integers, but got {}.'.format(bin_factors))
+
+        return tuple(reversed([int(factor) for factor in bin_factors] + [1] * (ndim - len(bin_factors))))
+
+    def _get_reduction_slices(self, cutout_region, padding, fill_value):
+        """
+        Obtain the slices of the data to reduce (by binning or collapsing) for the given region.  Regions hanging off
+        the edge of the data are padded (unless clipped), in which case the padded cutout is given, with slices
+        starting at the requested range, for the WCS to be moved to.
+        :return: tuple of (slices with steps in numpy order, padded cutout or None, the value of blank pixels of
+        integer data)
+        """
         data = self.data
         data_shape = data.shape
+        padded_data = None
+
+        if cutout_region.has_steps():
+            slices = self._get_stepped_slices(data_shape, cutout_region)
+        else:
+            position, shape = self._get_position_shape(data_shape, cutout_region)
+            if (not position and not shape) or shape == data_shape:
+                slices = tuple(slice(0, length, 1) for length in data_shape)
+            else:
+                large_slices, small_slices = overlap_slices(data_shape, shape, position, mode='partial')
+                slices = tuple(slice(s.start, s.stop, 1) for s in large_slices)
+                if tuple(s.stop - s.start for s in large_slices) != tuple(shape) and padding == PADDING_FILL:
+                    padded_data, blank = self._extract_partial(large_slices, small_slices, shape, fill_value)
+                    fill_value = blank
+                    # The padded cutout starts at the requested range.
+                    ranges = cutout_region.get_ranges()
+                    slices = tuple([slice(0, length, 1) for length in shape[:len(shape) - len(ranges)]] +
+                                   [slice(r[0] - 1, r[0] - 1 + length, 1)
+                                    for r, length in zip(reversed(ranges), shape[len(shape) - len(ranges):])])
+
+        return slices, padded_data, fill_value
+
+    def _extract_binned(self, cutout_region, factors, method, max_bytes, padding, fill_value):
+        """
+        Extract a cutout reduced by the given factors.  Cutouts within the data (or clipped to it) are binned as they
+        are read, in chunks of at most max_bytes, and padded cutouts once padded.
+        :return: CutoutResult instance
+        """
+        data = self.data
+        slices, padded_data, fill_value = self._get_reduction_slices(cutout_region, padding, fill_value)
+        lengths = [len(range(s.start, s.stop, s.step)) for s in slices]
+        if any(length < factor for length, factor in zip(lengths, factors)):
+            raise NoContentError('Cutout of shape {} is smaller than a bin of {}.'.format(tuple(lengths), factors))
+
+        self.logger.debug('Binning {} by {} with {} for extension {}.'.format(
+            tuple(lengths), factors, method, cutout_region.get_extension()))
+
+        if padded_data is not None:
+            cutout_data = _block_reduce(padded_data, factors, method, fill_value)
+        elif max_bytes is None or int(np.prod(lengths, dtype=np.int64)) * data.dtype.itemsize <= max_bytes:
+            # Read with the same slices as get_slices(), so that prefetched rows are used.
+            cutout_data = _block_reduce(data[slices], factors, method, fill_value)
+        else:
+            cutout_data = BinnedCutout(data, slices, factors, method, max_bytes, blank=fill_value)
+
+        # Each binned pixel is centred on its block.
+        shift = [s.start + ((factor - 1) * s.step / 2.0) for s, factor in zip(reversed(slices), reversed(factors))]
+        steps = [factor * s.step for s, factor in zip(reversed(slices), reversed(factors))]
+        wcs_offset = WCSOffset(shift, list(reversed(cutout_data.shape)), wcs=self.wcs, steps=steps)
+
+        return CutoutResult(data=cutout_data, wcs_offset=wcs_offset, bin_method=method,
+                            bin_size=int(np.prod(factors, dtype=np.int64)))
+
+    def _extract_collapsed(self, cutout_region, method, axis, channel_width, max_bytes, padding, fill_value):
+        """
+        Extract a cutout collapsed along one axis, accumulating chunks of planes of at most max_bytes (at least one
+        plane) along it, so that no more than that and the collapsed cutout are ever held in memory.
+        :return: CutoutResult instance
+        """
+        data = self.data
+
+        if not 0 <= axis < data.ndim:
+            raise NoContentError('No axis {} to collapse in data of shape {}.'.format(axis + 1, data.shape))
+
+        numpy_axis = data.ndim - axis - 1
+        slices, padded_data, fill_value = self._get_reduction_slices(cutout_region, padding, fill_value)
+        lengths = [len(range(s.start, s.stop, s.step)) for s in slices]
+
+        if padded_data is not None:
+            source = padded_data
+            read_slices = tuple(slice(0, length, 1) for length in padded_data.shape)
+        else:
+            source = data
+            read_slices = slices
+
+        total_bytes = int(np.prod(lengths, dtype=np.int64)) * data.dtype.itemsize
+        if max_bytes is None or total_bytes <= max_bytes:
+            # Read with the same slices as get_slices(), so that prefetched rows are used.
+            chunk_planes = lengths[numpy_axis]
+        else:
+            chunk_planes = max(1, int(max_bytes // max(1, total_bytes // lengths[numpy_axis])))
+
+        self.logger.debug('Collapsing {} along axis {} with {}, {} planes at a time, for extension {}.'.format(
+            tuple(lengths), axis + 1, method, chunk_planes, cutout_region.get_extension()))
+
+        axis_slice = read_slices[numpy_axis]
+        accumulated = None
+        counts = None
+
+        for start in range(axis_slice.start, axis_slice.stop, chunk_planes * axis_slice.step):
+            chunk_slices = list(read_slices)
+            chunk_slices[numpy_axis] = slice(start, min(start + (chunk_planes * axis_slice.step), axis_slice.stop),
+                                             axis_slice.step)
+            planes = _to_float(source[tuple(chunk_slices)], fill_value)
+
+            if method == COLLAPSE_MAX:
+                with warnings.catch_warnings():
+                    # All blank pixels.
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    chunk_max = np.nanmax(planes, axis=numpy_axis)
+                accumulated = chunk_max if accumulated is None else np.fmax(accumulated, chunk_max)
+            else:
+                chunk_sum = np.nansum(planes, axis=numpy_axis, dtype=np.float64)
+                chunk_count = np.sum(~np.isnan(planes), axis=numpy_axis)
+                accumulated = chunk_sum if accumulated is None else accumulated + chunk_sum
+                counts = chunk_count if counts is None else counts + chunk_count
+
+        if method != COLLAPSE_MAX:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                if method == COLLAPSE_MEAN:
+                    accumulated = accumulated / counts
+                elif method == COLLAPSE_MOMENT0:
+                    # With a step, each plane stands for that many channels.
+                    accumulated = accumulated * (channel_width * axis_slice.step)
+            accumulated[counts == 0] = np.nan
+
+        cutout_data = accumulated.astype(_get_bin_dtype(data.dtype), copy=False)
+        shift = [s.start for s in reversed(slices)]
+        steps = [s.step for s in reversed(slices)]
+        wcs_offset = WCSOffset(shift, list(reversed(cutout_data.shape)), wcs=self.wcs, steps=steps, removed_axis=axis)
+
+        return CutoutResult(data=cutout_data, wcs_offset=wcs_offset)
+
+    def extract(self, cutout_region, max_bytes=None, padding=PADDING_FILL, fill_value=None, bin_factors=None,
+                bin_method=BIN_MEAN, collapse_method=None, collapse_axis=None, channel_width=1.0):
+        """
+        Extract the cutout.
+
+        :param cutout_region: `PixelCutoutHDU`  The Pixel HDU Cutout description.
+        :param max_bytes: Optional size, in bytes, above which the cutout data is given as a `StreamedCutout`, to
+        be read in chunks of at most this size as it's written, rather than read at once.
+        :param padding: What to do with cutouts hanging off the edge of the data.  PADDING_FILL to pad them to their
+        full shape, with NaN for floating point data and fill_value for integer data, or PADDING_CLIP to clip them to
+        the data.
+        :param fill_value: The value to pad integer data with (e.g. its BLANK value).  Defaults to the smallest value
+        of the type of the data.  Cutouts with steps (see `PixelCutoutHDU`) are always clipped.
+        :param bin_factors: Optional factors to reduce the cutout by, combining blocks of pixels with bin_method.
+        Either one factor for every axis, or a list of factors in FITS order (i.e. NAXIS1 first).  The result is
+        floating point, with NaN for blank pixels.
+        :param bin_method: One of BIN_MEAN, BIN_SUM or BIN_MEDIAN.
+        :param collapse_method: Optional method to collapse the cutout along collapse_axis with: COLLAPSE_SUM,
+        COLLAPSE_MEAN, COLLAPSE_MAX or COLLAPSE_MOMENT0.  The result is floating point, with NaN for blank pixels,
+        and can't be binned as well.
+        :param collapse_axis: The 0-based FITS axis (i.e. 0 for NAXIS1) to collapse along.
+        :param channel_width: The width of one pixel along the collapsed axis, which COLLAPSE_MOMENT0 multiplies the
+        sum by.
+        :return: CutoutResult instance
+        """
+        if padding not in PADDING_POLICIES:
+            raise ValueError('Unknown padding {} (should be one of {}).'.format(padding, ', '.join(PADDING_POLICIES)))
+
+        if collapse_method is not None:
+            if collapse_method not in COLLAPSE_METHODS:
+                raise ValueError('Unknown collapse method {} (should be one of {}).'.format(
+                    collapse_method, ', '.join(COLLAPSE_METHODS)))
+            elif bin_factors is not None:
+                raise ValueError('Collapsed cutouts can not be binned as well.')
+            return self._extract_collapsed(cutout_region, collapse_method, collapse_axis, channel_width, max_bytes,
+                                           padding, fill_value)
+
+        if bin_factors is not None:
+            if bin_method not in BIN_REDUCERS:
+                raise ValueError('Unknown bin method {} (should be one of {}).'.format(
+                    bin_method, ', '.join(sorted(BIN_REDUCERS))))
+            return self._extract_binned(cutout_region, self._get_bin_factors(bin_factors), bin_method, max_bytes,
+                                        padding, fill_value)
+
+        if cutout_region.has_steps():
+            return self._extract_stepped(cutout_region, max_bytes)
+
+        data = self.data
+        data_shape = data.shape
+        blank = None
+        shift = [r[0] - 1 for r in cutout_region.get_ranges()]
         position, shape = self._get_position_shape(data_shape, cutout_region)
         self.logger.debug('Position {} and Shape {}'.format(position, shape))
+        streamed = self._get_streamed(position, shape, max_bytes) if max_bytes is not None else None
 
+        if streamed is not None:
+            self.logger.debug('Streaming {} in chunks of {} planes for extension {}.'.format(
+                streamed.shape, streamed.chunk_planes, cutout_region.get_extension()))
+            cutout_data = streamed
         # No pixels specified, so return the entire HDU
-        if (not position and not shape) or shape == data_shape:
+        elif (not position and not shape) or shape == data_shape:
             self.logger.debug('Returning entire HDU data for {}'.format(
                 cutout_region.get_extension()))
-            cutout_data = data
+            # Indexing with an Ellipsis is a view for arrays, and a full read for lazy readers.
+            cutout_data = data[...]
         else:
             self.logger.debug('Cutting out {} at {} for extension {} from {}.'.format(
                 shape, position, cutout_region.get_extension(), data.shape))
-            cutout_data, position = extract_array(data, shape, position, mode='partial', return_position=True)
+            large_slices, small_slices = overlap_slices(data_shape, shape, position, mode='partial')
+
+            if tuple(s.stop - s.start for s in large_slices) == tuple(shape):
+                # Wholly within the data.
+                cutout_data = data[large_slices]
+            elif padding == PADDING_CLIP:
+                cutout_data = data[large_slices]
+                # The cutout starts where the overlap does.
+                shift = [s.start for s in reversed(large_slices)]
+            else:
+                cutout_data, blank = self._extract_partial(large_slices, small_slices, shape, fill_value)
+
+        # Only the offset of the WCS is worked out here.  Copying the WCS is left until (and unless) it is needed.
+        wcs_offset = WCSOffset(shift, list(reversed(cutout_data.shape)), wcs=self.wcs)
+
+        return CutoutResult(data=cutout_data, wcs_offset=wcs_offset, blank=blank)
+
+    def get_stamp_starts(self, positions, shape):
+        """
+        Obtain the index of the first pixel of stamps of the given shape centred on the given positions, rounded the
+        same way as extract().
 
-        if self.wcs is not None:
-            cutout_shape = cutout_data.shape
-            output_wcs = deepcopy(self.wcs)
-            wcs_crpix = output_wcs.wcs.crpix
-            ranges = cutout_region.get_ranges()
-            l_ranges = len(ranges)
+        :param positions: Array of 0-based positions, one row per stamp, in numpy (i.e. y, x) order.
+        :param shape: The stamp shape, in numpy order.
+        :return: Array of integer indexes, one row per stamp.
+        """
+        return np.ceil(np.asarray(positions, dtype=float) - np.asarray(shape) / 2.0).astype(np.intp)
 
-            while len(wcs_crpix) < l_ranges:
-                wcs_crpix = np.append(wcs_crpix, 1.0)
+    def extract_stamps(self, positions, shape, fill_value=None):
+        """
+        Extract stamps of one shape around many positions in a single vectorized gather, rather than one extract()
+        per position.  Stamps hanging off the edge of the data are padded with fill_value.
 
-            for idx, _ in enumerate(ranges):
-                wcs_crpix[idx] -= (ranges[idx][0] - 1)
+        :param positions: Array of 0-based positions, one row per stamp, in numpy (i.e. y, x) order.
+        :param shape: The stamp shape, in numpy order.
+        :param fill_value: Padding value.  Defaults to NaN for floating point data, and 0 otherwise.
+        :return: StampsResult instance
+        """
+        data = np.asarray(self.data)
+        shape = tuple(int(x) for x in shape)
+        positions = np.atleast_2d(np.asarray(positions, dtype=float))
+        ndim = len(shape)
 
-            output_wcs._naxis = list(cutout_shape)
+        if data.ndim != ndim or positions.shape[1] != ndim:
+            raise ValueError('Stamp shape {} and positions of {} dimensions do not match data of shape {}.'.format(
+                shape, positions.shape[1], data.shape))
 
-            if self.wcs.sip is not None:
-                curr_sip = self.wcs.sip
-                output_wcs.sip = Sip(curr_sip.a, curr_sip.b,
-                                     curr_sip.ap, curr_sip.bp,
-                                     wcs_crpix[0:2])
+        if fill_value is None:
+            fill_value = np.nan if np.issubdtype(data.dtype, np.floating) else 0
+
+        starts = self.get_stamp_starts(positions, shape)
+        stamp_count = len(starts)
+        indexes = []
+        mask = np.ones((stamp_count,) + shape, dtype=bool)
+        overlaps = np.ones(stamp_count, dtype=bool)
+
+        for axis in range(ndim):
+            # Broadcast each axis' indexes to (stamp_count, 1, ..., shape[axis], ..., 1).
+            broadcast_shape = [stamp_count] + [1] * ndim
+            broadcast_shape[axis + 1] = shape[axis]
+            axis_indexes = starts[:, axis][:, np.newaxis] + np.arange(shape[axis])
+            valid = (axis_indexes >= 0) & (axis_indexes < data.shape[axis])
+
+            overlaps &= valid.any(axis=1)
+            mask &= valid.reshape(broadcast_shape)
+            indexes.append(np.clip(axis_indexes, 0, max(data.shape[axis] - 1, 0)).reshape(broadcast_shape))
+
+        if data.size:
+            stamps = data[tuple(indexes)]
         else:
-            output_wcs = None
+            stamps = np.empty((stamp_count,) + shape, dtype=data.dtype)
+            mask[...] = False
+
+        if not mask.all():
+            stamps[~mask] = fill_value
 
-        return CutoutResult(data=cutout_data, wcs=output_wcs, wcs_crpix=wcs_crpix)
+        return StampsResult(data=stamps, starts=starts, overlaps=overlaps)
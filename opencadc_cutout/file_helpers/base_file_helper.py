@@ -73,7 +73,7 @@ from __future__ import (absolute_import, division, print_function,
 import logging
 import numpy as np
 
-from ..cutoutnd import CutoutND
+from ..cutoutnd import CutoutND, PADDING_FILL, BIN_MEAN
 from ..pixel_range_input_parser import PixelRangeInputParser
 
 __all__ = ['BaseFileHelper']
@@ -87,19 +87,28 @@ class BaseFileHelper(object):
         else:
             self.input_stream = input_stream
 
-        if output_writer is None:
-            raise ValueError('An output stream (file-like object or io/stream) is required to write to.')
-        else:
-            self.output_writer = output_writer
+        # May be None for batch cutouts, where every request has its own writer.
+        self.output_writer = output_writer
 
         self.input_range_parser = input_range_parser
 
-    def do_cutout(self, data, cutout_dimension, wcs):
+    def do_cutout(self, data, cutout_dimension, wcs=None, max_bytes=None, padding=PADDING_FILL, fill_value=None,
+                  bin_factors=None, bin_method=BIN_MEAN, collapse_method=None, collapse_axis=None, channel_width=1.0):
         """
         Perform a Cutout of the given data at the given position and size.
         :param data:  The data to cutout from
         :param cutout_dimension:  `PixelCutoutHDU`       Cutout object.
-        :param wcs:    The WCS object to use with the cutout to return a copy of the WCS object.
+        :param wcs:    Optional WCS object to build the WCS of the cutout from, when it is needed.  The offset of the
+        WCS is given without it.
+        :param max_bytes:   Optional size above which the cutout is streamed in chunks (see `CutoutND.extract`).
+        :param padding:     PADDING_FILL to pad cutouts hanging off the edge of the data, or PADDING_CLIP to clip them.
+        :param fill_value:  The value to pad integer data with.
+        :param bin_factors: Optional factors to reduce the cutout by (see `CutoutND.extract`).
+        :param bin_method:  How blocks of pixels are combined when binning.
+        :param collapse_method: Optional method to collapse the cutout along collapse_axis with (see
+        `CutoutND.extract`).
+        :param collapse_axis:   The 0-based FITS axis of the squeezed data to collapse along.
+        :param channel_width:   The width of a pixel along the collapsed axis.
 
         :return: CutoutND instance
         """
@@ -107,4 +116,6 @@ class BaseFileHelper(object):
         # Sanitize the array by removing the single-dimensional entries.
         sanitized_data = np.squeeze(data)
         c = CutoutND(data=sanitized_data, wcs=wcs)
-        return c.extract(cutout_dimension)
+        return c.extract(cutout_dimension, max_bytes=max_bytes, padding=padding, fill_value=fill_value,
+                         bin_factors=bin_factors, bin_method=bin_method, collapse_method=collapse_method,
+                         collapse_axis=collapse_axis, channel_width=channel_width)
@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import logging
+import os
+import threading
+import weakref
+import numpy as np
+
+from .read_planner import ReadPlanner
+
+__all__ = ['ByteRangeReader', 'SpanReader', 'BITPIX_DTYPES', 'get_fileno']
+
+
+# FITS data is always stored big-endian.
+BITPIX_DTYPES = {
+    8: '>u1',
+    16: '>i2',
+    32: '>i4',
+    64: '>i8',
+    -32: '>f4',
+    -64: '>f8'
+}
+
+
+def get_fileno(stream):
+    """
+    Obtain the OS file descriptor for a stream backed by a plain file, or None otherwise.  Wrapping streams (e.g.
+    gzip.GzipFile) expose the descriptor of the underlying file, whose bytes are not the ones we want to read.
+    """
+    raw = getattr(stream, 'raw', stream)
+    if isinstance(raw, io.FileIO):
+        try:
+            return raw.fileno()
+        except (IOError, OSError, ValueError):
+            return None
+    else:
+        return None
+
+
+# One lock per stream, shared by every reader that uses seek/readinto on it.
+_STREAM_LOCKS = weakref.WeakKeyDictionary()
+_STREAM_LOCKS_LOCK = threading.Lock()
+_FALLBACK_LOCK = threading.Lock()
+
+
+def _get_stream_lock(stream):
+    with _STREAM_LOCKS_LOCK:
+        try:
+            lock = _STREAM_LOCKS.get(stream)
+            if lock is None:
+                lock = threading.Lock()
+                _STREAM_LOCKS[stream] = lock
+            return lock
+        except TypeError:
+            # Not weak referenceable.
+            return _FALLBACK_LOCK
+
+
+class SpanReader(object):
+    """
+    Read byte spans of a stream into buffers, following a `.read_planner.ReadPlan`.
+
+    Uses pread on plain files, which leaves the file position alone and is safe across threads, and seek/readinto
+    under a per-stream lock otherwise.
+
+    Parameters
+    ----------
+    input_stream : File-like object
+        A readable stream that supports seek(), at least forward.
+    read_planner : `.read_planner.ReadPlanner`
+        Planner used to merge neighbouring spans into larger reads.  Defaults to ReadPlanner().
+    """
+
+    def __init__(self, input_stream, read_planner=None):
+        self.logger = logging.getLogger()
+        self.input_stream = input_stream
+        self.read_planner = ReadPlanner() if read_planner is None else read_planner
+        self._fileno = get_fileno(input_stream)
+        self._lock = _get_stream_lock(input_stream)
+
+    def read_spans(self, offsets, lengths):
+        """
+        Read the given spans, back to back, into a new buffer.
+        :param offsets: The file offset of each span.
+        :param lengths: The length, in bytes, of each span.  A scalar applies to all spans.
+        :return: tuple of (buffer, destination offsets), where the span i starts at destination offsets[i].
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        lengths = np.broadcast_to(np.asarray(lengths, dtype=np.int64), offsets.shape)
+        destination_offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+        buf = np.empty(int(lengths.sum()), dtype=np.uint8)
+
+        if offsets.size > 0:
+            self.read_plan(self.read_planner.plan(offsets, lengths, destination_offsets[:offsets.size]), buf)
+
+        return buf, destination_offsets[:offsets.size]
+
+    def read_plan(self, read_plan, buf):
+        """
+        Execute the given plan, scattering the spans of each block into the buffer.
+        """
+        scratch = None
+
+        for block in read_plan.blocks:
+            if block.is_direct():
+                start = int(block.destination_offsets[0])
+                self.read_into(block.offset, buf[start:start + block.length])
+            else:
+                if scratch is None or len(scratch) < block.length:
+                    scratch = np.empty(block.length, dtype=np.uint8)
+                block_buf = scratch[:block.length]
+                self.read_into(block.offset, block_buf)
+                for span_offset, span_length, destination_offset in zip(
+                        block.span_offsets, block.span_lengths, block.destination_offsets):
+                    buf[destination_offset:destination_offset + span_length] = \
+                        block_buf[span_offset:span_offset + span_length]
+
+    def read_into(self, offset, buf):
+        """
+        Fill the given buffer with the bytes starting at offset.
+        """
+        expected = len(buf)
+        total = 0
+
+        if self._fileno is not None and hasattr(os, 'preadv'):
+            while total < expected:
+                count = os.preadv(self._fileno, [buf[total:]], offset + total)
+                if not count:
+                    break
+                total += count
+        else:
+            with self._lock:
+                self.input_stream.seek(offset)
+                while total < expected:
+                    count = self.input_stream.readinto(buf[total:])
+                    if not count:
+                        break
+                    total += count
+
+        if total < expected:
+            raise IOError('Unexpected end of file at byte {} (expected {} more bytes).'.format(
+                offset + total, expected - total))
+
+
+class ByteRangeReader(object):
+    """
+    Array-like view over the data section of a single FITS HDU that reads only the bytes a cutout touches.
+
+    The header values (BITPIX, NAXISn) and the offset of the data in the file are used to compute the byte span of
+    every contiguous row segment covered by a set of slices.  Only those spans are read (with pread where available,
+    or seek/readinto otherwise) directly into a preallocated output array, so no more of the file is paged in than
+    the cutout needs.
+
+    Instances support the subset of the numpy API used by `CutoutND`: ``shape``, ``ndim``, ``dtype``,
+    ``squeeze()``, and indexing with a tuple of slices (or an Ellipsis).  Slices with a step only read the rows
+    they select, and take every step-th pixel of those rows in memory.
+
+    Parameters
+    ----------
+    input_stream : File-like object
+        A seekable, readable stream of the FITS file.
+    data_offset : int
+        The byte offset of the first data byte of the HDU in the stream.
+    bitpix : int
+        The BITPIX header value.
+    naxis : list
+        The NAXISn header values, in FITS order (i.e. NAXIS1 first).
+    read_planner : `.read_planner.ReadPlanner`
+        Planner used to merge neighbouring row segments into larger reads.  Defaults to ReadPlanner().
+    """
+
+    def __init__(self, input_stream, data_offset, bitpix, naxis, read_planner=None, axes=None, cache=None):
+        self.logger = logging.getLogger()
+        self.input_stream = input_stream
+        self.read_planner = ReadPlanner() if read_planner is None else read_planner
+        self.data_offset = int(data_offset)
+        self.bitpix = int(bitpix)
+        self.naxis = tuple(int(n) for n in naxis)
+
+        if self.bitpix not in BITPIX_DTYPES:
+            raise ValueError('Unsupported BITPIX value {}.'.format(bitpix))
+
+        self.dtype = np.dtype(BITPIX_DTYPES[self.bitpix])
+
+        # Numpy (C) ordering, slowest varying axis first.
+        self._full_shape = tuple(reversed(self.naxis))
+        self._axes = tuple(range(len(self._full_shape))) if axes is None else tuple(axes)
+
+        strides = []
+        stride = self.dtype.itemsize
+        for length in reversed(self._full_shape):
+            strides.insert(0, stride)
+            stride *= length
+        self._strides = tuple(strides)
+
+        self._span_reader = SpanReader(input_stream, self.read_planner)
+
+        # Prefetched arrays, keyed by their full (unsqueezed) slices.  Shared with squeezed views.
+        self._cache = {} if cache is None else cache
+
+    @property
+    def shape(self):
+        return tuple(self._full_shape[axis] for axis in self._axes)
+
+    @property
+    def ndim(self):
+        return len(self._axes)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    def squeeze(self):
+        """
+        Remove single-dimensional entries from the shape.  This returns a new view and reads nothing.
+        """
+        axes = [axis for axis in self._axes if self._full_shape[axis] != 1]
+        return ByteRangeReader(self.input_stream, self.data_offset, self.bitpix, self.naxis,
+                               read_planner=self.read_planner, axes=axes, cache=self._cache)
+
+    def _to_full_slices(self, key):
+        """
+        Expand the given key into one (start, stop, step) triple per axis of the full (unsqueezed) shape, with each
+        stop just after the last index selected.
+        """
+        if key is Ellipsis:
+            key = ()
+        elif not isinstance(key, tuple):
+            key = (key,)
+
+        if len(key) > self.ndim:
+            raise IndexError('Too many indices ({}) for shape {}.'.format(len(key), self.shape))
+
+        # Axes hidden by squeeze() are of length one.
+        full_slices = [(0, 1, 1)] * len(self._full_shape)
+
+        for idx, axis in enumerate(self._axes):
+            length = self._full_shape[axis]
+            if idx < len(key):
+                s = key[idx]
+                if not isinstance(s, slice):
+                    raise IndexError('Only slices are supported, but got {}.'.format(s))
+                start, stop, step = s.indices(length)
+                if step < 1:
+                    raise IndexError('Only forward slices are supported, but got {}.'.format(s))
+                count = len(range(start, stop, step))
+                full_slices[axis] = (start, start + (count - 1) * step + 1 if count else start, step)
+            else:
+                full_slices[axis] = (0, length, 1)
+
+        return full_slices
+
+    def get_spans(self, key):
+        """
+        Compute the byte spans of the contiguous row segments covered by the given key.  With a step along the rows,
+        each segment spans from the first to the last pixel selected.
+
+        :param key: tuple of slices, or an Ellipsis
+        :return: tuple of (offsets, length), with the offsets (from the start of the stream) of every row segment,
+                 in file order, and the length, in bytes, of each segment.
+        """
+        full_slices = self._to_full_slices(key)
+        row_start, row_stop, _ = full_slices[-1]
+        length = (row_stop - row_start) * self.dtype.itemsize
+
+        offsets = np.array([self.data_offset + (row_start * self._strides[-1])], dtype=np.int64)
+        for (start, stop, step), stride in zip(reversed(full_slices[:-1]), reversed(self._strides[:-1])):
+            axis_offsets = np.arange(start, stop, step, dtype=np.int64) * stride
+            offsets = (axis_offsets[:, np.newaxis] + offsets[np.newaxis, :]).ravel()
+
+        return offsets, length
+
+    def _get_output_shape(self, full_slices):
+        return tuple(len(range(*full_slices[axis])) for axis in self._axes)
+
+    def _get_read_shape(self, full_slices):
+        # Rows are read whole, from the first to the last pixel selected.
+        last_axis = len(self._full_shape) - 1
+        return tuple(full_slices[axis][1] - full_slices[axis][0] if axis == last_axis
+                     else len(range(*full_slices[axis])) for axis in self._axes)
+
+    def _take_row_step(self, read_data, full_slices):
+        row_step = full_slices[-1][2]
+        return read_data[..., ::row_step] if row_step > 1 else read_data
+
+    def __getitem__(self, key):
+        full_slices = self._to_full_slices(key)
+        read_shape = self._get_read_shape(full_slices)
+        cached = self._cache.pop(tuple(full_slices), None)
+
+        if cached is not None:
+            return self._take_row_step(cached.reshape(read_shape), full_slices)
+
+        output = np.empty(read_shape, dtype=self.dtype)
+
+        if output.size > 0:
+            offsets, length = self.get_spans(key)
+            read_plan = self.read_planner.plan(offsets, length, np.arange(len(offsets), dtype=np.int64) * length)
+            self.logger.debug('Reading {} segments of {} bytes with {}.'.format(len(offsets), length, read_plan))
+            self._span_reader.read_plan(read_plan, output.reshape(-1).view(np.uint8))
+
+        return self._take_row_step(output, full_slices)
+
+    def read_into(self, key, output, output_key):
+        """
+        Read the data for the given key straight into part of an existing array, such as the middle of a padded
+        cutout, rather than into an array of its own.
+        :param key: tuple of slices, or an Ellipsis.
+        :param output: C-contiguous array of this reader's dtype to read into.
+        :param output_key: tuple of slices of the output to read into, of the same shape as the data of the key.
+        """
+        full_slices = self._to_full_slices(key)
+
+        if any(step != 1 for _, _, step in full_slices) or tuple(full_slices) in self._cache:
+            output[output_key] = self[key]
+            return
+
+        if not output.flags.c_contiguous or output.dtype != self.dtype:
+            raise ValueError('Can only read into a C-contiguous array of type {}.'.format(self.dtype))
+
+        if not self._axes or self._axes[-1] != len(self._full_shape) - 1:
+            # Rows of length one, squeezed out, so the rows of the data aren't the rows of the output.
+            output[output_key] = self[key]
+            return
+
+        offsets, length = self.get_spans(key)
+
+        if len(offsets) == 0 or length == 0:
+            return
+
+        # The byte offset in the output of every row segment, in the same (file) order as the offsets.
+        output_starts = [output_slice.indices(output_length)[0]
+                         for output_slice, output_length in zip(output_key, output.shape)]
+        output_starts += [0] * (output.ndim - len(output_starts))
+        destinations = np.array([output_starts[-1] * output.strides[-1]], dtype=np.int64)
+        row_axes = list(zip(full_slices[:-1], [None] * (len(full_slices) - 1)))
+
+        for axis, output_axis in zip(self._axes[:-1], range(output.ndim - 1)):
+            row_axes[axis] = (full_slices[axis], output_axis)
+
+        for (start, stop, _), output_axis in reversed(row_axes):
+            if output_axis is None:
+                # Axes hidden by squeeze() are of length one.
+                continue
+            axis_destinations = (output_starts[output_axis] + np.arange(stop - start, dtype=np.int64)) * \
+                output.strides[output_axis]
+            destinations = (axis_destinations[:, np.newaxis] + destinations[np.newaxis, :]).ravel()
+
+        read_plan = self.read_planner.plan(offsets, length, destinations)
+        self.logger.debug('Reading {} segments of {} bytes into place with {}.'.format(len(offsets), length,
+                                                                                      read_plan))
+        self._span_reader.read_plan(read_plan, output.reshape(-1).view(np.uint8))
+
+    def prefetch(self, keys):
+        """
+        Read the data for all of the given keys in a single pass over the file, in file order.  Indexing with one of
+        the keys afterward returns the prefetched array (once) without reading anything.  This is what allows several
+        cutouts of the same HDU to be served from a forward-only stream.
+
+        :param keys: list of keys (tuples of slices, or Ellipsis) that will be used to index this reader.
+        """
+        all_offsets = []
+        all_lengths = []
+        all_destinations = []
+        outputs = []
+        total = 0
+
+        for key in keys:
+            full_slices = self._to_full_slices(key)
+            output_shape = self._get_read_shape(full_slices)
+            size = int(np.prod(output_shape, dtype=np.int64)) * self.dtype.itemsize
+
+            if size > 0:
+                offsets, length = self.get_spans(key)
+                all_offsets.append(offsets)
+                all_lengths.append(np.full(len(offsets), length, dtype=np.int64))
+                all_destinations.append(total + (np.arange(len(offsets), dtype=np.int64) * length))
+
+            outputs.append((tuple(full_slices), total, size, output_shape))
+            total += size
+
+        buf = np.empty(total, dtype=np.uint8)
+
+        if all_offsets:
+            read_plan = self.read_planner.plan(np.concatenate(all_offsets), np.concatenate(all_lengths),
+                                               np.concatenate(all_destinations))
+            self.logger.debug('Prefetching {} arrays with {}.'.format(len(keys), read_plan))
+            self._span_reader.read_plan(read_plan, buf)
+
+        for cache_key, start, size, output_shape in outputs:
+            self._cache[cache_key] = buf[start:start + size].view(self.dtype).reshape(output_shape)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+
+from astropy.io import fits
+
+from .fits_header_scanner import BLOCK_SIZE, CARD_LENGTH
+
+__all__ = ['CardHeader', 'format_card']
+
+
+END_CARD = 'END'.ljust(CARD_LENGTH)
+
+# Cards that carry no value, and that no WCS reads.
+COMMENTARY_KEYWORDS = frozenset(['COMMENT', 'HISTORY', ''])
+
+
+def format_card(keyword, value):
+    """
+    Format a card with a numeric value and no comment, far more cheaply than through `~astropy.io.fits.Card`.
+    :return: The card image, as bytes.
+    """
+    if isinstance(value, (int, np.integer)):
+        value_str = str(int(value))
+    else:
+        value_str = repr(float(value)).upper()
+        if len(value_str) > 20:
+            value_str = '{:.15G}'.format(float(value))
+        if '.' not in value_str and 'E' not in value_str:
+            value_str += '.0'
+
+    return '{:<8}= {:>20}'.format(keyword, value_str).ljust(CARD_LENGTH).encode('ascii')
+
+
+def _get_keyword(image):
+    keyword = image[:8].rstrip().upper()
+    if keyword == 'HIERARCH':
+        # The keyword runs up to the value indicator.
+        keyword = image[9:].split('=', 1)[0].strip().upper()
+    return keyword
+
+
+class CardHeader(object):
+    """
+    A header kept as the raw 80 character cards it was read as, with targeted edits applied card by card.
+
+    Building a `~astropy.io.fits.Header` parses and verifies every card, and writing it out formats every card
+    again, which is noticeable for headers with thousands of HISTORY or COMMENT cards when only a handful of
+    keywords (NAXISn, CRPIXn, the PCi_j matrix and the like) change in a cutout.  Here, only the cards that are read
+    are parsed, only the cards that are set are formatted, and every other card is written out byte for byte.
+
+    Supports the subset of the `~astropy.io.fits.Header` API used when sanitizing cutout headers.
+
+    Parameters
+    ----------
+    header_bytes : bytes
+        The raw header, as read from the file.  Anything from the END card on is ignored.
+    """
+
+    def __init__(self, header_bytes=b''):
+        # Latin-1 maps each byte to one character, so that cards with stray non-ASCII bytes (e.g. in a comment) are
+        # still written out byte for byte.
+        header_str = header_bytes.decode('latin-1') if isinstance(header_bytes, bytes) else header_bytes
+        self._images = []
+        self._keywords = []
+
+        for offset in range(0, len(header_str), CARD_LENGTH):
+            image = header_str[offset:offset + CARD_LENGTH].ljust(CARD_LENGTH)
+            if image == END_CARD:
+                break
+            self._images.append(image)
+            self._keywords.append(_get_keyword(image))
+
+    @staticmethod
+    def from_header(header):
+        """
+        Convert a `~astropy.io.fits.Header`.
+        """
+        return CardHeader(header.tostring())
+
+    def copy(self):
+        header_copy = CardHeader()
+        header_copy._images = list(self._images)
+        header_copy._keywords = list(self._keywords)
+        return header_copy
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, keyword):
+        return keyword.strip().upper() in self._keywords
+
+    def __getitem__(self, keyword):
+        return self._get_card(self.index(keyword)).value
+
+    def __setitem__(self, keyword, value):
+        self.set(keyword, value)
+
+    def index(self, keyword):
+        try:
+            return self._keywords.index(keyword.strip().upper())
+        except ValueError:
+            raise KeyError('Keyword {} not found.'.format(keyword))
+
+    def get(self, keyword, default=None):
+        try:
+            return self[keyword]
+        except KeyError:
+            return default
+
+    def keywords(self):
+        return list(self._keywords)
+
+    def keys(self):
+        """
+        The keywords, in header order, as with `~astropy.io.fits.Header.keys`.
+        """
+        return self.keywords()
+
+    def iter_cards(self):
+        """
+        :return: Iterator over (keyword, card image) tuples, in header order.
+        """
+        return zip(self._keywords, self._images)
+
+    def _card_images(self, card):
+        # Long strings are continued over several cards.
+        image = card.image
+        return [image[offset:offset + CARD_LENGTH] for offset in range(0, len(image), CARD_LENGTH)]
+
+    def _replace(self, idx, count, keyword, images):
+        self._images[idx:idx + count] = images
+        self._keywords[idx:idx + count] = [keyword.strip().upper()] + ['CONTINUE'] * (len(images) - 1)
+
+    def _get_card(self, idx):
+        return fits.Card.fromstring(''.join(self._images[idx:idx + self._card_count(idx)]))
+
+    def _card_count(self, idx):
+        count = 1
+        while idx + count < len(self._keywords) and self._keywords[idx + count] == 'CONTINUE':
+            count += 1
+        return count
+
+    def _get_append_index(self):
+        # As with astropy, new cards go after the last card with a value, ahead of any trailing commentary cards.
+        idx = len(self._keywords)
+        while idx > 0 and self._keywords[idx - 1] in COMMENTARY_KEYWORDS:
+            idx -= 1
+        return idx
+
+    def _put(self, keyword, images):
+        if keyword.strip().upper() in self._keywords:
+            idx = self.index(keyword)
+            self._replace(idx, self._card_count(idx), keyword, images)
+        else:
+            self._replace(self._get_append_index(), 0, keyword, images)
+
+    def set(self, keyword, value, comment=None):
+        """
+        Set the value of the first card with the given keyword, keeping its place and comment, or add a card after
+        the last card with a value if there is none.
+        """
+        if comment is None and keyword.strip().upper() in self._keywords:
+            comment = self._get_card(self.index(keyword)).comment
+        self._put(keyword, self._card_images(fits.Card(keyword, value, comment)))
+
+    def insert(self, idx, card):
+        """
+        Insert a card before the given position.
+        :param card: (keyword, value) or (keyword, value, comment) tuple.
+        """
+        self._replace(idx, 0, card[0], self._card_images(fits.Card(*card)))
+
+    def remove(self, keyword, ignore_missing=False, remove_all=False):
+        keyword = keyword.strip().upper()
+        if keyword not in self._keywords:
+            if ignore_missing:
+                return
+            raise KeyError('Keyword {} not found.'.format(keyword))
+
+        while keyword in self._keywords:
+            idx = self._keywords.index(keyword)
+            count = self._card_count(idx)
+            del self._images[idx:idx + count]
+            del self._keywords[idx:idx + count]
+            if not remove_all:
+                break
+
+    def rename_keyword(self, oldkeyword, newkeyword):
+        """
+        Rename the first card with the given keyword, keeping its place, value and comment.
+        """
+        idx = self.index(oldkeyword)
+        card = self._get_card(idx)
+        self._replace(idx, self._card_count(idx), newkeyword,
+                      self._card_images(fits.Card(newkeyword, card.value, card.comment)))
+
+    def update(self, header):
+        """
+        Set every card of the given `~astropy.io.fits.Header` (e.g. the header of a WCS), as
+        `~astropy.io.fits.Header.update` does.  Commentary cards are appended, unless already present.
+        """
+        for card in header.cards:
+            images = self._card_images(card)
+            if card.keyword not in COMMENTARY_KEYWORDS:
+                self._put(card.keyword, images)
+            elif images[0] not in self._images:
+                self._replace(len(self._images), 0, card.keyword, images)
+
+    def tostring(self, skip_commentary=False):
+        """
+        :param skip_commentary: Leave out COMMENT, HISTORY and blank cards, which no WCS reads, e.g. to parse a WCS
+        from a large header more cheaply.
+        :return: The header, including its END card and padding.
+        """
+        if skip_commentary:
+            images = [image for keyword, image in self.iter_cards() if keyword not in COMMENTARY_KEYWORDS]
+        else:
+            images = list(self._images)
+
+        images.append(END_CARD)
+        header_str = ''.join(images)
+        return header_str.ljust(len(header_str) + (-len(header_str) % BLOCK_SIZE))
+
+    def to_header(self):
+        """
+        :return: The equivalent `~astropy.io.fits.Header`.
+        """
+        return fits.Header.fromstring(self.tostring())
@@ -71,39 +71,147 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import logging
+import re
+import threading
 import time
+import warnings
 import astropy
+import numpy as np
 
 from copy import copy
+from astropy import units as u
 from astropy.io import fits
-from astropy.io.fits import PrimaryHDU, ImageHDU
-from astropy.wcs import WCS
+from astropy.wcs import WCS, WCSSUB_SPECTRAL
 from astropy.nddata import NoOverlapError
+from opencadc_cutout.cutoutnd import (CutoutND, CutoutResult, StreamedCutout, WCSOffset, PADDING_FILL, BIN_MEAN,
+                                     BIN_SUM, COLLAPSE_MOMENT0)
+from opencadc_cutout.forward_only_reader import ForwardOnlyReader
+from opencadc_cutout.gzip_index_reader import GzipIndexCache, GzipIndexReader, is_gzip
 from opencadc_cutout.utils import is_integer
 from opencadc_cutout.file_helpers.base_file_helper import BaseFileHelper
+from opencadc_cutout.file_helpers.fits.byte_range_reader import ByteRangeReader
+from opencadc_cutout.file_helpers.fits.card_header import CardHeader, format_card
+from opencadc_cutout.file_helpers.fits.fits_header_scanner import FITSHeaderScanner, CARD_LENGTH as FITS_CARD_LENGTH
+from opencadc_cutout.file_helpers.fits.fits_output_writer import FITSOutputWriter
+from opencadc_cutout.file_helpers.fits.read_planner import ReadPlanner, DEFAULT_GAP_THRESHOLD
+from opencadc_cutout.file_helpers.fits.tile_compressed_reader import (
+    TileCompressedReader, TILE_COMPRESSION_SUPPORTED, DEFAULT_DECOMPRESSION_WORKERS, DEFAULT_TILE_CACHE_BYTES,
+    get_image_header, read_compressed_data)
 from opencadc_cutout.no_content_error import NoContentError
+from opencadc_cutout.pixel_cutout_hdu import PixelCutoutHDU
 from opencadc_cutout.pixel_range_input_parser import PixelRangeInputParser
+from opencadc_cutout.sky_region import get_separation
+from opencadc_cutout.sky_region_parser import SkyRegionParser
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 
-__all__ = ['FITSHelper']
+
+__all__ = ['FITSHelper', 'STAMP_LAYOUT_CUBE', 'STAMP_LAYOUT_MEF', 'DEFAULT_MEMORY_BUDGET']
 
 
 # Remove the DQ1 and DQ2 headers until the issue with wcslib is resolved:
 # https://github.com/astropy/astropy/issues/7828
 UNDESIREABLE_HEADER_KEYS = ['DQ1', 'DQ2']
 
+# CDi_j keywords, which are replaced by their PCi_j equivalents.
+CD_KEYWORD_PATTERN = re.compile(r'^CD([1-9]\d*)_([1-9]\d*)$')
+
+# Postage stamps are written as a single cube plus a position table, or as one extension per stamp.
+STAMP_LAYOUT_CUBE = 'cube'
+STAMP_LAYOUT_MEF = 'mef'
+
+# Keywords describing the pixel values, copied to the header of a stamp cube.
+STAMP_CUBE_HEADER_KEYS = ['BSCALE', 'BZERO', 'BLANK', 'BUNIT']
+
+# Extensions are cut out one at a time unless asked otherwise.
+DEFAULT_EXTRACTION_WORKERS = 1
+
+# Cutouts larger than this many bytes are read and written in chunks of planes of at most this size.
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Checkpoints of gzipped inputs, shared by all helpers in the process.
+DEFAULT_GZIP_INDEX_CACHE = GzipIndexCache()
+
 
 class FITSHelper(BaseFileHelper):
+    """
+    File helper for FITS files.
 
-    def __init__(self, input_stream, output_writer, input_range_parser=PixelRangeInputParser()):
+    Parameters
+    ----------
+    read_gap_threshold : int
+        Row segments of a cutout separated by at most this many bytes are read together in one sequential read.
+        See `.read_planner.ReadPlanner`.
+    index_cache : `.hdu_index_cache.HDUIndexCache`
+        Optional cache of HDU indexes, so that files are not rescanned on every cutout.
+    decompression_workers : int
+        Number of threads used to decompress the tiles of tile compressed images.
+    gzip_index_cache : `opencadc_cutout.gzip_index_reader.GzipIndexCache`
+        Cache of decompressor checkpoints for gzipped inputs, so that cutouts only decompress from the nearest
+        checkpoint before the bytes they need.
+    extraction_workers : int
+        Number of threads reading, cutting out and sanitizing the requested extensions of multi-extension requests.
+        Output is still written by a single writer, in extension order.  Only used for seekable inputs.
+    sky_region_parser : `opencadc_cutout.sky_region_parser.SkyRegionParser`
+        Parser for cutouts of a region of the sky (e.g. CIRCLE 12.0 34.0 0.5), rather than of pixel ranges.
+    memory_budget : int
+        Cutouts larger than this many bytes are read and written in chunks of whole planes (along the slowest axis)
+        of at most this size, rather than held in memory at once.  None to always read cutouts at once.
+    padding : str
+        What to do with cutouts hanging off the edge of the data: `opencadc_cutout.cutoutnd.PADDING_FILL` pads them
+        to their full shape in the type of the data, with NaN for floating point data and the BLANK value for integer
+        data (a BLANK card is added if there was none), and `opencadc_cutout.cutoutnd.PADDING_CLIP` clips them to the
+        data.
+    bin_factors : int or list of int
+        Optional factors to reduce cutouts by (e.g. for previews), either one for every axis, or a list of them in
+        FITS order.  Blocks of pixels are combined with bin_method as the rows are read, so the full resolution
+        cutout is never held in memory.  Binned cutouts are floating point, with NaN for blank pixels, and their WCS
+        is moved and scaled to match.
+    bin_method : str
+        How blocks of pixels are combined: `opencadc_cutout.cutoutnd.BIN_MEAN`, `opencadc_cutout.cutoutnd.BIN_SUM` or
+        `opencadc_cutout.cutoutnd.BIN_MEDIAN`.
+    collapse : str
+        Optional method to collapse cube cutouts along their spectral axis with, into an image with the spectral axis
+        removed from its WCS: `opencadc_cutout.cutoutnd.COLLAPSE_SUM`, `opencadc_cutout.cutoutnd.COLLAPSE_MEAN`,
+        `opencadc_cutout.cutoutnd.COLLAPSE_MAX` or `opencadc_cutout.cutoutnd.COLLAPSE_MOMENT0` (the sum multiplied by
+        the channel width at the reference pixel, with BUNIT to match).  Planes are accumulated a chunk at a time,
+        within the memory budget.  HDUs without a spectral axis are skipped.
+    """
+
+    def __init__(self, input_stream, output_writer, input_range_parser=PixelRangeInputParser(),
+                 read_gap_threshold=DEFAULT_GAP_THRESHOLD, index_cache=None,
+                 decompression_workers=DEFAULT_DECOMPRESSION_WORKERS,
+                 gzip_index_cache=DEFAULT_GZIP_INDEX_CACHE, extraction_workers=DEFAULT_EXTRACTION_WORKERS,
+                 sky_region_parser=SkyRegionParser(), memory_budget=DEFAULT_MEMORY_BUDGET, padding=PADDING_FILL,
+                 bin_factors=None, bin_method=BIN_MEAN, collapse=None):
         self.logger = logging.getLogger()
         self.logger.setLevel('DEBUG')
         super(FITSHelper, self).__init__(
             input_stream, output_writer, input_range_parser)
+        self.read_planner = ReadPlanner(gap_threshold=read_gap_threshold)
+        self.index_cache = index_cache
+        self.decompression_workers = decompression_workers
+        self.gzip_index_cache = gzip_index_cache
+        self.extraction_workers = extraction_workers
+        self.sky_region_parser = sky_region_parser
+        self.memory_budget = memory_budget
+        self.padding = padding
+        self.bin_factors = bin_factors
+        self.bin_method = bin_method
+        self.collapse = collapse
+        self.fits_writer = FITSOutputWriter(output_writer) if output_writer is not None else None
+        # Full WCS objects by HDU header offset, for the lifetime of this helper.
+        self._wcs_cache = {}
+        self._footprint_cache = {}
+        self._wcs_lock = threading.Lock()
 
     def _post_sanitize_header(self, header, cutout_result):
         """
-        Remove headers that don't belong in the cutout output.
+        Remove headers that don't belong in the cutout output, and move the reference pixel to match the cutout.  The
+        header is a `.card_header.CardHeader`, so only the cards touched here are parsed or formatted.
         """
         # Remove known keys
         [header.remove(x, ignore_missing=True, remove_all=True)
@@ -124,35 +232,43 @@ class FITSHelper(BaseFileHelper):
                 header.insert(
                     ctype1_index, (wcsaxes_keyword, existing_wcsaxes_value))
 
-        if cutout_result.wcs is not None:
-            naxis = header.get('NAXIS')
-            cutout_wcs = cutout_result.wcs
-            cutout_wcs_header = cutout_wcs.to_header(relax=True)
-            header.update(cutout_wcs_header)
+        if cutout_result.blank is not None and 'BLANK' not in header:
+            header.set('BLANK', cutout_result.blank, 'Value of undefined pixels')
 
-            if cutout_wcs.sip is not None:
-                cutout_crpix = cutout_result.wcs_crpix
+        if cutout_result.bin_method is not None:
+            # Binned data is floating point, with NaN for blank pixels.
+            header.remove('BLANK', ignore_missing=True)
+            if cutout_result.bin_method == BIN_SUM and header.get('BZERO'):
+                # Each binned pixel adds up the zero point of every pixel in its block.
+                header.set('BZERO', header.get('BZERO') * cutout_result.bin_size)
 
-                for idx, val in enumerate(cutout_crpix):
-                    header.set('CRPIX{}'.format(idx + 1), val)
-
-            # Remove the CDi_j headers in favour of the PCi_j equivalents
-            for i in range(naxis):
-                for j in range(naxis):
-                    idx_val = '{}_{}'.format(str(i + 1), str(j + 1))
-                    cd_key = 'CD{}'.format(idx_val)
-                    cd_val = header.get(cd_key)
-
-                    if cd_val is not None:
-                        pc_key = 'PC{}'.format(idx_val)
-                        if header.get(pc_key) is None:
-                            header.set(pc_key, cd_val)
+        if cutout_result.wcs_offset is not None:
+            naxis = header.get('NAXIS')
+            if cutout_result.wcs_offset.removed_axis is not None:
+                naxis -= 1
+            # Only the reference pixel moves, so the rest of the WCS cards are left as they are.
+            cutout_result.wcs_offset.apply(header)
 
-                        header.remove(
-                            cd_key, ignore_missing=True, remove_all=True)
+            # Remove the CDi_j headers in favour of the PCi_j equivalents, with a unit CDELTi as the CD matrix
+            # already carries the scale.
+            cd_axes = set()
+            for keyword in header.keywords():
+                match = CD_KEYWORD_PATTERN.match(keyword)
+                if match is not None and max(int(match.group(1)), int(match.group(2))) <= naxis:
+                    pc_key = 'PC{}_{}'.format(match.group(1), match.group(2))
+                    if header.get(pc_key) is None:
+                        header.set(pc_key, header.get(keyword))
+                    header.remove(keyword, ignore_missing=True, remove_all=True)
+                    cd_axes.add(int(match.group(1)))
+            for axis in sorted(cd_axes):
+                header.set('CDELT{}'.format(axis), 1.0)
 
             # Is this necessary?
-            header.set('WCSAXES', naxis)
+            if wcsaxes_keyword in header:
+                header.set(wcsaxes_keyword, naxis)
+            else:
+                # Structural keywords are written first, so this still precedes the WCS keywords.
+                header.insert(0, (wcsaxes_keyword, naxis))
 
     def _get_wcs(self, header):
         naxis_value = header.get('NAXIS')
@@ -168,28 +284,222 @@ class FITSHelper(BaseFileHelper):
         else:
             naxis = naxis_value
 
-        return WCS(header=header, naxis=naxis)
+        # No WCS reads the commentary cards, of which there may be thousands.
+        return WCS(header=fits.Header.fromstring(header.tostring(skip_commentary=True)), naxis=naxis)
+
+    def _get_hdu_wcs(self, entry, header):
+        """
+        Obtain the full WCS of an HDU, which is only parsed once per request, however many regions use it.  Pixel
+        cutouts don't need one, as they only move the reference pixel.
+        """
+        with self._wcs_lock:
+            wcs = self._wcs_cache.get(entry.header_offset)
+            if wcs is None:
+                wcs = self._get_wcs(header)
+                self._wcs_cache[entry.header_offset] = wcs
+            return wcs
+
+    def _get_naxis(self, header):
+        """
+        The length of each axis of an HDU, in FITS order, from its header.
+        """
+        return [header.get('NAXIS{}'.format(idx + 1), 0) for idx in range(header.get('NAXIS', 0))]
+
+    def _check_overlap(self, header, cutout_dimension):
+        """
+        Check a pixel cutout against the axes given in the header of an HDU, so that cutouts missing the data are
+        rejected before any of it is read.
+        :raises NoOverlapError: if the cutout lies wholly outside the data.
+        :raises NoContentError: if the cutout has more dimensions than the data.
+        """
+        naxis = self._get_naxis(header)
+        if naxis:
+            # The data is cut out with its axes of length one squeezed out.
+            shape = tuple(length for length in reversed(naxis) if length != 1)
+            CutoutND(data=None).get_slices(cutout_dimension, data_shape=shape)
 
-    def _write_cutout(self, header, data, cutout_dimension, wcs):
+    def _is_overlapping(self, header, cutout_dimension):
+        """
+        Check, from the header alone, whether a pixel cutout can be made from an HDU.  Cutouts that can't be made are
+        reported as they would be once the data is read.
+        :return: True if the cutout overlaps the data.
+        :raises NoContentError: if the cutout lies wholly outside the data.
+        """
+        extension = cutout_dimension.get_extension()
         try:
-            cutout_result = self.do_cutout(
-                data=data, cutout_dimension=cutout_dimension, wcs=wcs)
+            self._check_overlap(header, cutout_dimension)
+            return True
+        except NoContentError:
+            self.logger.warn('No cutout possible on extension {}.  Skipping...'.format(extension))
+            return False
+        except NoOverlapError:
+            self.logger.error('No overlap found for extension {}'.format(extension))
+            raise NoContentError('No content (arrays do not overlap).')
+
+    def _get_hdu_footprint(self, entry, wcs, naxis):
+        """
+        Obtain a circle enclosing the celestial footprint of an HDU, from the centre and corners of its celestial
+        plane.  It's only computed once per request, however many regions are checked against it.
+        :return: (ra, dec, radius) tuple, in degrees, or None if the corners don't all project.
+        """
+        with self._wcs_lock:
+            if entry.header_offset in self._footprint_cache:
+                return self._footprint_cache[entry.header_offset]
+
+        lng = wcs.wcs.lng
+        lat = wcs.wcs.lat
+        corners = np.ones((5, wcs.naxis))
+        corners[:, lng] = [(naxis[lng] + 1) / 2.0, 0.5, naxis[lng] + 0.5, 0.5, naxis[lng] + 0.5]
+        corners[:, lat] = [(naxis[lat] + 1) / 2.0, 0.5, 0.5, naxis[lat] + 0.5, naxis[lat] + 0.5]
 
-            self._post_sanitize_header(header, cutout_result)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            footprint = wcs.all_pix2world(corners, 1)
+
+        if np.all(np.isfinite(footprint[:, [lng, lat]])):
+            radius = np.max(get_separation(footprint[0, lng], footprint[0, lat],
+                                           footprint[1:, lng], footprint[1:, lat]))
+            hdu_footprint = (footprint[0, lng], footprint[0, lat], radius)
+        else:
+            hdu_footprint = None
 
-            fits.append(filename=self.output_writer, header=header, data=cutout_result.data,
-                        overwrite=False, output_verify='silentfix', checksum='remove')
-            self.output_writer.flush()
+        with self._wcs_lock:
+            self._footprint_cache[entry.header_offset] = hdu_footprint
+
+        return hdu_footprint
+
+    def _get_spectral_axis(self, header):
+        """
+        Find the spectral axis of a cube, to collapse along, from its header.
+        :return: tuple of (0-based FITS axis of the squeezed data, channel width, channel unit)
+        :raises NoContentError: if there is no spectral axis of more than one channel.
+        """
+        wcs = self._get_wcs(header)
+        spectral_axis = wcs.wcs.spec
+        naxis = self._get_naxis(header)
+
+        if spectral_axis < 0 or spectral_axis >= len(naxis) or naxis[spectral_axis] == 1:
+            raise NoContentError('No spectral axis to collapse.')
+
+        # The data is cut out with its axes of length one squeezed out.
+        squeezed_axis = len([length for length in naxis[:spectral_axis] if length != 1])
+        return squeezed_axis, abs(wcs.pixel_scale_matrix[spectral_axis, spectral_axis]), wcs.wcs.cunit[spectral_axis]
+
+    def _is_reduced(self):
+        """
+        Whether cutouts are binned or collapsed, rather than copied pixel for pixel.
+        """
+        return self.bin_factors is not None or self.collapse is not None
+
+    def _restore_axes(self, header, cutout_result):
+        """
+        Put back the axes of length one that come before longer axes (e.g. the STOKES axis of a RA, DEC, STOKES, FREQ
+        cube), which are squeezed out of the data to cut out, so that the axes of the cutout still match the
+        numbering of the WCS in its header.  Axes of length one at the end are left out, as their WCS still applies.
+        The WCS offset, numbered by the axes of the squeezed data, is numbered by the header axes either way.
+        """
+        wcs_offset = cutout_result.wcs_offset
+        naxis = self._get_naxis(header)
+        # The header axis of each axis of the squeezed data.
+        squeezed_axes = [axis for axis, length in enumerate(naxis) if length != 1]
+
+        if wcs_offset is None or len(squeezed_axes) == len(naxis):
+            return
+
+        removed_axis = None if wcs_offset.removed_axis is None else squeezed_axes[wcs_offset.removed_axis]
+        output_axes = [axis for axis in range(len(naxis)) if axis != removed_axis]
+        last_long_axis = max([axis for axis in output_axes if naxis[axis] != 1] or [-1])
+        restored_axes = [axis for axis in output_axes if naxis[axis] == 1 and axis < last_long_axis]
+
+        padding = len(squeezed_axes) - len(wcs_offset.shift)
+        offsets = dict(zip(squeezed_axes, zip(list(wcs_offset.shift) + [0] * padding,
+                                              list(wcs_offset.steps) + [1] * padding)))
+        axes = sorted(squeezed_axes + restored_axes)
+        lengths = iter(reversed(cutout_result.data.shape))
+        output_naxis = [1 if axis in restored_axes else next(lengths) for axis in axes if axis != removed_axis]
+
+        if restored_axes:
+            output_shape = tuple(reversed(output_naxis))
+            if isinstance(cutout_result.data, StreamedCutout):
+                # The chunks are laid out the same either way.
+                cutout_result.data.shape = output_shape
+            else:
+                cutout_result.data = cutout_result.data.reshape(output_shape)
+
+        # Axes of length one are not moved, up to the last axis cut from.
+        header_axes = range(max(axes) + 1)
+        cutout_result.wcs_offset = WCSOffset([offsets.get(axis, (0, 1))[0] for axis in header_axes], output_naxis,
+                                             wcs=wcs_offset.wcs,
+                                             steps=[offsets.get(axis, (0, 1))[1] for axis in header_axes],
+                                             removed_axis=removed_axis)
+
+    def _make_cutout(self, header, data, cutout_dimension, max_bytes=None):
+        if self.collapse is not None:
+            collapse_axis, channel_width, channel_unit = self._get_spectral_axis(header)
+        else:
+            collapse_axis, channel_width, channel_unit = None, 1.0, None
+
+        cutout_result = self.do_cutout(data=data, cutout_dimension=cutout_dimension, max_bytes=max_bytes,
+                                       padding=self.padding, fill_value=header.get('BLANK'),
+                                       bin_factors=self.bin_factors, bin_method=self.bin_method,
+                                       collapse_method=self.collapse, collapse_axis=collapse_axis,
+                                       channel_width=channel_width)
+
+        if self.collapse == COLLAPSE_MOMENT0 and header.get('BUNIT') and channel_unit is not None:
+            try:
+                header.set('BUNIT', (u.Unit(header.get('BUNIT'), format='fits') * channel_unit).to_string('fits'))
+            except ValueError:
+                self.logger.warn('Unable to work out the unit of the moment of {}.'.format(header.get('BUNIT')))
+
+        self._restore_axes(header, cutout_result)
+        self._post_sanitize_header(header, cutout_result)
+        return cutout_result
+
+    def _write_cutout(self, header, data, cutout_dimension):
+        try:
+            cutout_result = self._make_cutout(header, data, cutout_dimension, max_bytes=self.memory_budget)
+            self.fits_writer.write_hdu(header, cutout_result.data)
         except NoContentError:
             self.logger.warn('No cutout possible on extension {}.  Skipping...'.format(
                 cutout_dimension.get_extension()))
 
+    def _get_passthrough(self, header, data, cutout_dimension):
+        """
+        Check for a request covering all of an uncompressed HDU, whose data can then be copied verbatim rather than
+        decoded and encoded again.  Squeezing out axes of length one doesn't change the layout of the data, so only
+        the header is rewritten (sanitized, with its WCS left alone since the pixel grid is unchanged).
+        :return: The squeezed ByteRangeReader to copy the data of, or None if the data has to be cut out.
+        """
+        if not isinstance(data, ByteRangeReader) or self._is_reduced() or \
+                any(r[0] != 1 for r in cutout_dimension.get_ranges()):
+            return None
+
+        squeezed_data = data.squeeze()
+        try:
+            if CutoutND(data=squeezed_data).get_slices(cutout_dimension) is not Ellipsis:
+                return None
+        except NoContentError:
+            return None
+
+        self._post_sanitize_header(header, CutoutResult(data=None))
+
+        if squeezed_data.ndim < data.ndim and 'WCSAXES' not in header:
+            # Keep the WCS of the squeezed out axes.  Structural keywords are written first, so this still precedes
+            # the other WCS keywords.
+            header.insert(0, ('WCSAXES', data.ndim))
+
+        self.logger.debug('Copying extension {} verbatim.'.format(cutout_dimension.get_extension()))
+        return squeezed_data
+
     def _pixel_cutout(self, header, data, cutout_dimension):
+        passthrough_data = self._get_passthrough(header, data, cutout_dimension)
+        if passthrough_data is not None:
+            self.fits_writer.write_hdu(header, passthrough_data)
+            return
+
         extension = cutout_dimension.get_extension()
-        wcs = self._get_wcs(header)
         try:
-            self._write_cutout(header=header, data=data,
-                               cutout_dimension=cutout_dimension, wcs=wcs)
+            self._write_cutout(header=header, data=data, cutout_dimension=cutout_dimension)
             self.logger.debug(
                 'Cutting out from extension {}'.format(extension))
         except NoOverlapError:
@@ -197,6 +507,159 @@ class FITSHelper(BaseFileHelper):
                 'No overlap found for extension {}'.format(extension))
             raise NoContentError('No content (arrays do not overlap).')
 
+    def _is_seekable(self):
+        seekable = getattr(self.input_stream, 'seekable', None)
+        if seekable is not None:
+            return seekable()
+        else:
+            try:
+                self.input_stream.tell()
+                return True
+            except (AttributeError, IOError, OSError):
+                return False
+
+    def _get_source(self):
+        """
+        The stream to scan and read from.  Non-seekable inputs are wrapped so that they can be skipped through, and
+        gzipped inputs so that they can be read at random through their checkpoint index.
+        """
+        if self._is_seekable():
+            if is_gzip(self.input_stream):
+                return GzipIndexReader(self.input_stream, self.gzip_index_cache.get_index(self.input_stream))
+            else:
+                return self.input_stream
+        else:
+            return ForwardOnlyReader(self.input_stream)
+
+    def _get_index(self, source):
+        """
+        Obtain the HDU index entries, from the index cache if possible.  Without a cache (or for streams that can't be
+        identified) the file is scanned lazily, so iteration can stop early.
+        """
+        if self.index_cache is not None and self._is_seekable():
+            key = self.index_cache.get_file_key(self.input_stream)
+            if key is not None:
+                index = self.index_cache.get(key)
+                if index is None:
+                    index = FITSHeaderScanner(source).get_index()
+                    self.index_cache.put(key, index)
+                return index
+
+        return FITSHeaderScanner(source)
+
+    def _is_supported(self, entry):
+        return entry.is_image() or entry.is_compressed_image()
+
+    def _get_header(self, entry):
+        """
+        Obtain the header to write out for the given HDU, as a `.card_header.CardHeader` over its raw cards.  Tile
+        compressed images are written out uncompressed.
+        """
+        if entry.is_compressed_image():
+            return CardHeader.from_header(get_image_header(entry.get_header()))
+        else:
+            return CardHeader(entry.header_bytes)
+
+    def _get_data(self, source, entry):
+        """
+        Obtain the data to cut out from.  The data is read through a ByteRangeReader so that only the rows covered by
+        the cutout are read, rather than mapping in the whole HDU.  Tile compressed images are read through a
+        TileCompressedReader, which only decompresses the tiles covered by the cutout, or decompressed whole on
+        Astropy versions without its per-tile codecs.
+        """
+        if entry.is_compressed_image() and not TILE_COMPRESSION_SUPPORTED:
+            return read_compressed_data(source, entry.get_header(), entry.data_offset, read_planner=self.read_planner)
+        elif entry.is_compressed_image():
+            # Keep no more decompressed tiles than the memory budget between the chunks of a streamed cutout.
+            max_cache_bytes = DEFAULT_TILE_CACHE_BYTES if self.memory_budget is None else self.memory_budget
+            return TileCompressedReader(source, entry.get_header(), entry.data_offset,
+                                        read_planner=self.read_planner, max_workers=self.decompression_workers,
+                                        max_cache_bytes=max_cache_bytes)
+        elif entry.naxis:
+            return ByteRangeReader(source, entry.data_offset, entry.bitpix, entry.naxis,
+                                   read_planner=self.read_planner)
+        else:
+            return None
+
+    def _prefetch(self, data, cutout_dimensions):
+        """
+        Read the rows needed by all of the given dimensions in a single pass, in file order, before any cutout is
+        made.  This also allows several cutouts from one HDU on forward-only streams, where they are then held whole
+        whatever the memory budget.  On seekable streams, cutouts over the memory budget are left to be streamed
+        instead, as is a single cutout of an HDU on any stream.
+        """
+        if data is not None and len(cutout_dimensions) > 1:
+            squeezed_data = np.squeeze(data)
+            cutout = CutoutND(data=squeezed_data)
+            keys = []
+
+            for cutout_dimension in cutout_dimensions:
+                try:
+                    key = cutout.get_slices(cutout_dimension)
+                except (NoOverlapError, NoContentError):
+                    # Reported when the cutout is made.
+                    continue
+
+                # Whole HDUs are copied straight from the input instead.
+                if key is Ellipsis and isinstance(data, ByteRangeReader) and not self._is_reduced():
+                    continue
+
+                if self.memory_budget is not None and self._is_seekable():
+                    lengths = squeezed_data.shape if key is Ellipsis else [
+                        len(range(*axis_slice.indices(length)))
+                        for axis_slice, length in zip(key, squeezed_data.shape)]
+                    if int(np.prod(lengths, dtype=np.int64)) * squeezed_data.dtype.itemsize > self.memory_budget:
+                        continue
+
+                keys.append(key)
+
+            squeezed_data.prefetch(keys)
+
+    def _extract_hdu(self, source, entry, cutout_dimensions):
+        """
+        Read, cut out and sanitize all of the given dimensions from one HDU, without writing anything, so that this
+        can run on a worker thread.
+        :return: list of (header, data) tuples to write, in order.
+        """
+        header = self._get_header(entry)
+        cutout_dimensions = [cutout_dimension for cutout_dimension in cutout_dimensions
+                             if self._is_overlapping(header, cutout_dimension)]
+        cutouts = []
+
+        if not cutout_dimensions:
+            # Nothing to read.
+            return cutouts
+
+        data = self._get_data(source, entry)
+        self._prefetch(data, cutout_dimensions)
+
+        for cutout_dimension in cutout_dimensions:
+            extension = cutout_dimension.get_extension()
+            # Sanitizing modifies the header, so each cutout of the same HDU gets its own.
+            cutout_header = header.copy() if len(cutout_dimensions) > 1 else header
+            passthrough_data = self._get_passthrough(cutout_header, data, cutout_dimension)
+            if passthrough_data is not None:
+                cutouts.append((cutout_header, passthrough_data))
+                continue
+
+            try:
+                cutout_result = self._make_cutout(cutout_header, data, cutout_dimension, max_bytes=self.memory_budget)
+                self.logger.debug('Cutting out from extension {}'.format(extension))
+            except NoContentError:
+                self.logger.warn('No cutout possible on extension {}.  Skipping...'.format(extension))
+                continue
+            except NoOverlapError:
+                self.logger.error('No overlap found for extension {}'.format(extension))
+                raise NoContentError('No content (arrays do not overlap).')
+
+            cutouts.append((cutout_header, cutout_result.data))
+
+        return cutouts
+
+    def _write_cutouts(self, cutouts):
+        for header, data in cutouts:
+            self.fits_writer.write_hdu(header, data)
+
     def _is_extension_requested(self, extension_idx, ext_name_ver, cutout_dimension):
         requested_extension = cutout_dimension.get_extension()
 
@@ -214,57 +677,654 @@ class FITSHelper(BaseFileHelper):
 
         return matches
 
-    def _iterate_cutout(self, pixel_cutout_dimensions):
+    def _get_pixel_range(self, pixels, length):
+        """
+        Find the range of pixels along one axis spanned by the given 1-based pixel coordinates, clipped to the axis.
+        Ranges of even width are centred half a pixel low when cut out, so they are widened to an odd width, which is
+        cut out exactly.
+        :param pixels: The pixel coordinates along the axis.
+        :param length: The length of the axis.
+        :return: (start, end) tuple, or None if the coordinates miss the axis.
+        """
+        start = max(1, int(np.floor(np.min(pixels) + 0.5)))
+        end = min(length, int(np.floor(np.max(pixels) + 0.5)))
+
+        if start > end:
+            return None
+
+        if (end - start) % 2 == 1:
+            if end < length:
+                end += 1
+            elif start > 1:
+                start -= 1
+
+        return start, end
+
+    def _get_spatial_ranges(self, entry, wcs, naxis, sky_region):
+        """
+        Find the pixel bounding box a sky region covers on the celestial axes of an HDU.  The footprint of the HDU is
+        first compared with a circle enclosing the region, and then the boundary of the region is taken to pixels in a
+        single vectorized all_world2pix() call (which applies any SIP distortion).
+        :return: dict of the (start, end) range by axis, or None if the region misses the HDU.
+        """
+        if not wcs.has_celestial or max(wcs.wcs.lng, wcs.wcs.lat) >= len(naxis):
+            self.logger.debug('No celestial WCS for extension {}.'.format(entry.index))
+            return None
+
+        lng = wcs.wcs.lng
+        lat = wcs.wcs.lat
+        hdu_footprint = self._get_hdu_footprint(entry, wcs, naxis)
+
+        if hdu_footprint is not None:
+            footprint_ra, footprint_dec, footprint_radius = hdu_footprint
+            ra, dec, radius = sky_region.get_bounding_circle()
+            if get_separation(ra, dec, footprint_ra, footprint_dec) > radius + footprint_radius:
+                self.logger.debug('Region misses the footprint of extension {}.'.format(entry.index))
+                return None
+
+        boundary_ra, boundary_dec = sky_region.get_boundary()
+        world = np.tile(wcs.wcs.crval, (len(boundary_ra), 1))
+        world[:, lng] = boundary_ra
+        world[:, lat] = boundary_dec
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            pixels = wcs.all_world2pix(world, 1, quiet=True)
+
+        ranges = {}
+
+        for axis in (lng, lat):
+            axis_pixels = pixels[:, axis]
+
+            # Boundary points that don't project (e.g. beyond the horizon of the projection) leave the whole axis.
+            if np.all(np.isfinite(axis_pixels)):
+                pixel_range = self._get_pixel_range(axis_pixels, naxis[axis])
+
+                if pixel_range is None:
+                    self.logger.debug('Region misses extension {}.'.format(entry.index))
+                    return None
+
+                ranges[axis] = pixel_range
+
+        return ranges
+
+    def _get_spectral_ranges(self, entry, wcs, naxis, band):
+        """
+        Find the range of planes a spectral band covers on the spectral axis of an HDU.  The spectral WCS is
+        translated to vacuum wavelength (from frequency, wavelength or velocity, the latter needing a rest frequency)
+        so that the band, in metres, can be taken straight to pixels.
+        :return: dict of the (start, end) range by axis, or None if the band misses the HDU.
+        """
+        spectral_axis = wcs.wcs.spec
+
+        if spectral_axis < 0 or spectral_axis >= len(naxis):
+            self.logger.debug('No spectral WCS for extension {}.'.format(entry.index))
+            return None
+
+        try:
+            spectral_wcs = wcs.sub([WCSSUB_SPECTRAL])
+            spectral_wcs.wcs.sptr('WAVE-???')
+        except ValueError as err:
+            self.logger.debug('Unusable spectral WCS for extension {} ({}).'.format(entry.index, err))
+            return None
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            pixels = spectral_wcs.wcs_world2pix([[band.lower], [band.upper]], 1)[:, 0]
+
+        pixel_range = self._get_pixel_range(pixels, naxis[spectral_axis]) if np.all(np.isfinite(pixels)) else None
+
+        if pixel_range is None:
+            self.logger.debug('Band misses extension {}.'.format(entry.index))
+            return None
+
+        return {spectral_axis: pixel_range}
+
+    def _get_sky_cutout_dimensions(self, entry, sky_cutout):
+        """
+        Convert a sky cutout (a sky region, a spectral band, or both) to the pixel bounding box it covers on an HDU.
+        Only the header is used, so HDUs the cutout misses are rejected before any of their data is read.  Axes the
+        cutout doesn't constrain are kept whole.
+        :return: list of the `PixelCutoutHDU` to cut out, which is empty if the cutout misses the HDU or the HDU has no
+        suitable WCS.
+        """
+        header = self._get_header(entry)
+        naxis = self._get_naxis(header)
+
+        if not naxis or 0 in naxis:
+            return []
+
+        wcs = self._get_hdu_wcs(entry, header)
+        axis_ranges = {}
+
+        if sky_cutout.region is not None:
+            spatial_ranges = self._get_spatial_ranges(entry, wcs, naxis, sky_cutout.region)
+            if spatial_ranges is None:
+                return []
+            axis_ranges.update(spatial_ranges)
+
+        if sky_cutout.band is not None:
+            spectral_ranges = self._get_spectral_ranges(entry, wcs, naxis, sky_cutout.band)
+            if spectral_ranges is None:
+                return []
+            axis_ranges.update(spectral_ranges)
+
+        last_axis = max(axis_ranges) if axis_ranges else 0
+        # The data is cut out with its axes of length one squeezed out.
+        ranges = [axis_ranges.get(axis, (1, naxis[axis])) for axis in range(last_axis + 1) if naxis[axis] != 1]
+
+        return [PixelCutoutHDU(dimension_ranges=ranges, extension=entry.index)]
+
+    def _iterate_cutout(self, pixel_cutout_dimensions, sky_cutout=None):
         # Start with the first extension
-        hdu_list = fits.open(name=self.input_stream,
-                             memmap=True, mode='readonly', do_not_scale_image_data=True)
-
-        for curr_extension_idx, hdu in enumerate(hdu_list):
-            if isinstance(hdu, PrimaryHDU) == True:
-                self.logger.debug('Primary at {}'.format(curr_extension_idx))
-                fits.append(filename=self.output_writer, header=hdu.header, data=None,
-                            overwrite=False, output_verify='silentfix', checksum='remove')
-            elif isinstance(hdu, ImageHDU):
-                header = hdu.header
-                ext_name = header.get('EXTNAME')
-                ext_ver = header.get('EXTVER', 0)
-                curr_ext_name_ver = None
-
-                if ext_name is not None:
-                    curr_ext_name_ver = (ext_name, ext_ver)
-
-                if pixel_cutout_dimensions is None:
-                    # TODO - Do WCS transformation and check for overlap.
-                    pass
+        source = self._get_source()
+        index = self._get_index(source)
+
+        if self.extraction_workers > 1 and ThreadPoolExecutor is not None and self._is_seekable():
+            # Finish scanning before any extraction starts, so that the scan doesn't share the stream with the
+            # workers.
+            index = list(index)
+            executor = ThreadPoolExecutor(max_workers=self.extraction_workers)
+        else:
+            executor = None
+
+        # Extractions not yet written, in extension order.  Bounded, so that the results of at most a few
+        # extensions per worker are held in memory.
+        pending = []
+        sky_cutout_found = False
+
+        try:
+            for entry in index:
+                curr_extension_idx = entry.index
+
+                if curr_extension_idx == 0 and (sky_cutout is None or not entry.naxis):
+                    self.logger.debug('Primary at {}'.format(curr_extension_idx))
+                    self.fits_writer.write_hdu(self._get_header(entry))
+                elif self._is_supported(entry):
+                    curr_ext_name_ver = entry.get_ext_name_ver()
+
+                    if sky_cutout is not None:
+                        requested_dimensions = self._get_sky_cutout_dimensions(entry, sky_cutout)
+
+                        if requested_dimensions:
+                            sky_cutout_found = True
+                        elif curr_extension_idx == 0:
+                            # The cutout misses the primary image, but the primary header is still needed.
+                            self.fits_writer.write_hdu(self._get_header(entry))
+                    else:
+                        requested_dimensions = []
+                        for cutout_dimension in pixel_cutout_dimensions:
+                            is_ext_req = self._is_extension_requested(
+                                curr_extension_idx, curr_ext_name_ver, cutout_dimension)
+                            if is_ext_req == True:
+                                self.logger.debug('*** Extension {} does match ({} | {})'.format(
+                                    cutout_dimension.get_extension(), curr_extension_idx, curr_ext_name_ver))
+                                requested_dimensions.append(cutout_dimension)
+
+                    if not requested_dimensions:
+                        pass
+                    elif executor is None:
+                        self._write_cutouts(self._extract_hdu(source, entry, requested_dimensions))
+                    else:
+                        pending.append(executor.submit(self._extract_hdu, source, entry, requested_dimensions))
+                        while len(pending) > 2 * self.extraction_workers:
+                            self._write_cutouts(pending.pop(0).result())
                 else:
-                    for cutout_dimension in pixel_cutout_dimensions:
-                        is_ext_req = self._is_extension_requested(
-                            curr_extension_idx, curr_ext_name_ver, cutout_dimension)
-                        if is_ext_req == True:
-                            self.logger.debug('*** Extension {} does match ({} | {})'.format(
-                                cutout_dimension.get_extension(), curr_extension_idx, curr_ext_name_ver))
-                            self._pixel_cutout(
-                                header, hdu.data, cutout_dimension)
-            else:
-                self.logger.warn(
-                    'Unsupported HDU at extension {}.'.format(curr_extension_idx))
+                    self.logger.warn(
+                        'Unsupported HDU at extension {}.'.format(curr_extension_idx))
+
+            while pending:
+                self._write_cutouts(pending.pop(0).result())
+
+            if sky_cutout is not None and not sky_cutout_found:
+                raise NoContentError('No content ({} does not overlap).'.format(sky_cutout))
+        finally:
+            if executor is not None:
+                for future in pending:
+                    future.cancel()
+                executor.shutdown(wait=True)
 
     def _iterate_pixel_cutout(self, pixel_cutout_dimensions):
         if pixel_cutout_dimensions is not None and len(pixel_cutout_dimensions) == 1:
             cutout_dimension = pixel_cutout_dimensions[0]
-            hdu_list = fits.open(self.input_stream, memmap=True,
-                                 mode='readonly', do_not_scale_image_data=True)
-            ext_idx = hdu_list.index_of(cutout_dimension.get_extension())
-            if ext_idx >= 0:
-                hdu = hdu_list.pop(ext_idx)
-                self._pixel_cutout(hdu.header, hdu.data, cutout_dimension)
+            source = self._get_source()
+
+            for entry in self._get_index(source):
+                if self._is_extension_requested(entry.index, entry.get_ext_name_ver(), cutout_dimension):
+                    header = self._get_header(entry)
+                    if self._is_overlapping(header, cutout_dimension):
+                        self._pixel_cutout(header, self._get_data(source, entry), cutout_dimension)
+                    # Nothing else is needed, so leave the rest of the file unread.
+                    return
+
+            self.logger.warn('Extension {} not found.'.format(cutout_dimension.get_extension()))
         else:
             self._iterate_cutout(pixel_cutout_dimensions)
 
+    def _batch_cutouts(self, source, entry, matches, fits_writers, sink):
+        """
+        Make the cutouts of all requests matching one HDU.  The header is read only once, and the rows of all of the
+        cutouts are read together.
+        :return: The indexes of the requests that produced a cutout.
+        """
+        header = self._get_header(entry)
+        cutout_request_idxs = []
+        overlapping_matches = []
+
+        for request_idx, cutout_dimension in matches:
+            try:
+                self._check_overlap(header, cutout_dimension)
+                overlapping_matches.append((request_idx, cutout_dimension))
+            except (NoOverlapError, NoContentError):
+                self.logger.warn('No cutout possible on extension {} for request {}.  Skipping...'.format(
+                    cutout_dimension.get_extension(), request_idx))
+
+        if not overlapping_matches:
+            # Nothing to read.
+            return cutout_request_idxs
+
+        matches = overlapping_matches
+        data = self._get_data(source, entry)
+        self._prefetch(data, [cutout_dimension for _, cutout_dimension in matches])
+
+        for request_idx, cutout_dimension in matches:
+            # Sanitizing modifies the header, so each request gets its own.
+            cutout_header = header.copy()
+            passthrough_data = self._get_passthrough(cutout_header, data, cutout_dimension) if sink is None else None
+            if passthrough_data is not None:
+                fits_writers[request_idx].write_hdu(cutout_header, passthrough_data)
+                cutout_request_idxs.append(request_idx)
+                continue
+
+            try:
+                # Sinks are handed whole arrays.
+                cutout_result = self._make_cutout(cutout_header, data, cutout_dimension,
+                                                  max_bytes=self.memory_budget if sink is None else None)
+            except (NoOverlapError, NoContentError):
+                self.logger.warn('No cutout possible on extension {} for request {}.  Skipping...'.format(
+                    cutout_dimension.get_extension(), request_idx))
+                continue
+
+            if sink is None:
+                fits_writers[request_idx].write_hdu(cutout_header, cutout_result.data)
+            else:
+                sink(request_idx, cutout_header.to_header(), cutout_result.data)
+
+            cutout_request_idxs.append(request_idx)
+
+        return cutout_request_idxs
+
+    def get_footprints(self):
+        """
+        Find the sky footprint of every image HDU with a celestial WCS, from the headers alone.  No output is written,
+        so no output writer is needed.
+        :return: list of (extension index, ra, dec, radius) tuples, each footprint being given as the circle enclosing
+        it, in degrees.
+        """
+        source = self._get_source()
+        footprints = []
+
+        for entry in self._get_index(source):
+            if not self._is_supported(entry):
+                continue
+
+            header = self._get_header(entry)
+            naxis = self._get_naxis(header)
+
+            if not naxis or 0 in naxis:
+                continue
+
+            wcs = self._get_hdu_wcs(entry, header)
+
+            if wcs.has_celestial and max(wcs.wcs.lng, wcs.wcs.lat) < len(naxis):
+                hdu_footprint = self._get_hdu_footprint(entry, wcs, naxis)
+                if hdu_footprint is not None:
+                    footprints.append((entry.index,) + tuple(float(value) for value in hdu_footprint))
+
+        return footprints
+
+    def _get_grid_offsets(self, reference_wcs, wcs):
+        """
+        Find how many whole pixels the grid of a tile is moved by from the reference grid, along each WCS axis.
+        :raises ValueError: if the tiles don't share a projection, or their grids are moved by fractions of a pixel.
+        """
+        same_projection = (list(wcs.wcs.ctype) == list(reference_wcs.wcs.ctype)
+                           and np.allclose(wcs.wcs.crval, reference_wcs.wcs.crval, rtol=0.0, atol=1e-10)
+                           and np.allclose(wcs.wcs.get_cdelt(), reference_wcs.wcs.get_cdelt(), rtol=1e-10)
+                           and np.allclose(wcs.wcs.get_pc(), reference_wcs.wcs.get_pc(), rtol=0.0, atol=1e-10)
+                           and (wcs.sip is None) == (reference_wcs.sip is None))
+
+        if same_projection and wcs.sip is not None:
+            same_projection = (np.array_equal(wcs.sip.a, reference_wcs.sip.a)
+                               and np.array_equal(wcs.sip.b, reference_wcs.sip.b))
+
+        offsets = reference_wcs.wcs.crpix - wcs.wcs.crpix
+
+        if not same_projection or not np.allclose(offsets, np.round(offsets), rtol=0.0, atol=1e-6):
+            raise ValueError('Tiles must share a projection and pixel grid to be mosaicked.')
+
+        return [int(offset) for offset in np.round(offsets)]
+
+    def _get_sky_pieces(self, sky_cutout):
+        """
+        Find the pieces of a sky cutout on each HDU, from the headers alone.
+        :return: list of (entry, header, `PixelCutoutHDU`) tuples.
+        """
+        source = self._get_source()
+        pieces = []
+
+        for entry in self._get_index(source):
+            if self._is_supported(entry):
+                for cutout_dimension in self._get_sky_cutout_dimensions(entry, sky_cutout):
+                    pieces.append((entry, self._get_header(entry), cutout_dimension))
+
+        return pieces
+
+    def mosaic(self, cutout_dimensions_str, input_streams):
+        """
+        Cut a sky region out of several tiles of a survey, and assemble the pieces into one image on the pixel grid of
+        the first tile (the input of this helper).  The tiles must share a projection, and only differ in their
+        reference pixels (CRPIXn), by whole pixels.
+
+        The bounds of the mosaic are found from the headers, so the output array is allocated once, and each piece
+        is then read (only its rows) and placed in turn.  Where tiles overlap, later tiles are placed over earlier
+        ones, and pixels no tile covers are NaN.
+
+        :param cutout_dimensions_str: The SODA sky region (and/or spectral band) to cut out.
+        :param input_streams: list of the file-like objects of the other tiles.  All inputs must be seekable.
+        :return: The number of pieces in the mosaic.
+        """
+        if self.output_writer is None:
+            raise ValueError('An output stream (file-like object or io/stream) is required to write to.')
+
+        helpers = [self] + [FITSHelper(input_stream, None, sky_region_parser=self.sky_region_parser)
+                            for input_stream in input_streams]
+
+        if not all(helper._is_seekable() for helper in helpers):
+            raise ValueError('Mosaics can only be made from seekable inputs.')
+
+        sky_cutout = self.sky_region_parser.parse_cutout(cutout_dimensions_str)
+        reference_header = None
+        placements = []
+
+        for helper in helpers:
+            for entry, header, cutout_dimension in helper._get_sky_pieces(sky_cutout):
+                naxis = helper._get_naxis(header)
+                wcs = helper._get_hdu_wcs(entry, header)
+
+                if reference_header is None:
+                    reference_header, reference_naxis, reference_wcs = header, naxis, wcs
+                elif len(naxis) != len(reference_naxis):
+                    raise ValueError('Tiles must have the same number of axes to be mosaicked.')
+
+                offsets = self._get_grid_offsets(reference_wcs, wcs)
+                offsets += [0] * (len(naxis) - len(offsets))
+                # The ranges skip the axes of length one.  Axes the cutout doesn't constrain are taken whole.
+                squeezed_ranges = iter(cutout_dimension.get_ranges())
+                ranges = [(1, 1) if length == 1 else next(squeezed_ranges, (1, length)) for length in naxis]
+                placements.append((helper, entry, naxis, ranges, offsets))
+
+        if not placements:
+            raise NoContentError('No content ({} does not overlap).'.format(sky_cutout))
+
+        # The bounds of the mosaic on the reference grid, along each FITS axis.
+        lower = [min(ranges[idx][0] + offsets[idx] for _, _, _, ranges, offsets in placements)
+                 for idx in range(len(reference_naxis))]
+        upper = [max(ranges[idx][1] + offsets[idx] for _, _, _, ranges, offsets in placements)
+                 for idx in range(len(reference_naxis))]
+        mosaic_naxis = [end - start + 1 for start, end in zip(lower, upper)]
+        mosaic_data = None
+
+        for helper, entry, naxis, ranges, offsets in placements:
+            piece_shape = tuple(end - start + 1 for start, end in reversed(ranges))
+            # The data is cut out with its axes of length one squeezed out.
+            squeezed_ranges = [axis_range for axis_range, length in zip(ranges, naxis) if length != 1]
+            piece = helper.do_cutout(data=helper._get_data(helper._get_source(), entry),
+                                     cutout_dimension=PixelCutoutHDU(dimension_ranges=squeezed_ranges,
+                                                                     extension=entry.index)).data
+
+            if mosaic_data is None:
+                mosaic_data = np.full(tuple(reversed(mosaic_naxis)), np.nan,
+                                      dtype=np.result_type(np.float32, piece.dtype))
+
+            key = tuple(slice(start + offset - low, end + offset - low + 1)
+                        for (start, end), offset, low in reversed(list(zip(ranges, offsets, lower))))
+            mosaic_data[key] = np.reshape(piece, piece_shape)
+            self.logger.debug('Placed extension {} at {}.'.format(entry.index, key))
+
+        self._post_sanitize_header(reference_header, CutoutResult(
+            data=mosaic_data, wcs_offset=WCSOffset(shift=[start - 1 for start in lower], naxis=mosaic_naxis)))
+        self.fits_writer.write_hdu(reference_header, mosaic_data)
+
+        return len(placements)
+
+    def cutout_batch(self, cutout_requests, sink=None):
+        """
+        Cut out many regions from the input in a single forward pass.  The input is opened and indexed once, the
+        header of each HDU is read once for all of the regions on it, and the rows needed by those regions are read
+        together, in file order.
+
+        Each request is written to its own writer exactly as cutout() would write it, or handed to the sink.
+
+        :param cutout_requests: list of (cutout_dimensions_str, output_writer) tuples.  When a sink is given, the
+        writers are unused, and plain cutout_dimensions_str values may be given instead.
+        :param sink: Optional callable, called as sink(request_idx, header, data) with every cutout HDU instead of
+        writing it out.  Primary headers are not passed to the sink.
+        :return: list of the number of cutout HDUs made for each request.
+        """
+        cutout_dimensions_list = []
+        fits_writers = []
+
+        for cutout_request in cutout_requests:
+            if isinstance(cutout_request, tuple):
+                cutout_dimensions_str, output_writer = cutout_request
+            else:
+                cutout_dimensions_str, output_writer = cutout_request, None
+
+            if sink is None and output_writer is None:
+                raise ValueError('An output writer is required for {} without a sink.'.format(
+                    cutout_dimensions_str))
+
+            cutout_dimensions_list.append(self.input_range_parser.parse(cutout_dimensions_str))
+            fits_writers.append(FITSOutputWriter(output_writer) if output_writer is not None else None)
+
+        request_count = len(cutout_dimensions_list)
+        # As in cutout(), single region requests are cut from the first matching HDU only, while multiple region
+        # requests get the primary header followed by every matching (non-primary) HDU.
+        single = [len(cutout_dimensions) == 1 for cutout_dimensions in cutout_dimensions_list]
+        found = [False] * request_count
+        cutout_counts = [0] * request_count
+        source = self._get_source()
+
+        for entry in self._get_index(source):
+            pending = [idx for idx in range(request_count) if not (single[idx] and found[idx])]
+
+            if not pending:
+                # Nothing else is needed, so leave the rest of the file unread.
+                break
+
+            if entry.index == 0 and sink is None:
+                for request_idx in pending:
+                    if not single[request_idx]:
+                        fits_writers[request_idx].write_hdu(self._get_header(entry))
+
+            ext_name_ver = entry.get_ext_name_ver()
+            matches = []
+
+            for request_idx in pending:
+                if entry.index == 0 and not single[request_idx]:
+                    continue
+
+                for cutout_dimension in cutout_dimensions_list[request_idx]:
+                    if self._is_extension_requested(entry.index, ext_name_ver, cutout_dimension):
+                        matches.append((request_idx, cutout_dimension))
+                        found[request_idx] = True
+
+            if not matches:
+                continue
+            elif self._is_supported(entry):
+                for request_idx in self._batch_cutouts(source, entry, matches, fits_writers, sink):
+                    cutout_counts[request_idx] += 1
+            else:
+                self.logger.warn('Unsupported HDU at extension {}.'.format(entry.index))
+
+        for request_idx in range(request_count):
+            if single[request_idx] and not found[request_idx]:
+                self.logger.warn('Extension {} not found for request {}.'.format(
+                    cutout_dimensions_list[request_idx][0].get_extension(), request_idx))
+
+        self.logger.debug('Read {} bytes to use {} bytes.'.format(
+            self.read_planner.bytes_read, self.read_planner.bytes_used))
+
+        return cutout_counts
+
+    def _find_card(self, header_bytes, keyword):
+        prefix = '{:<8}='.format(keyword).encode('ascii')
+        for offset in range(0, len(header_bytes), FITS_CARD_LENGTH):
+            if header_bytes[offset:offset + len(prefix)] == prefix:
+                return offset
+        return None
+
+    def _write_stamp_extensions(self, header, stamps_result):
+        """
+        Write every stamp to its own extension.  Building an HDU per stamp is far too slow for large catalogs, so one
+        header is serialized as a template, and only the cards giving the position of each stamp (CRPIXn and
+        EXTVER) are rewritten in place.
+        """
+        stamps = stamps_result.data
+        template = header.copy()
+        [template.remove(x, ignore_missing=True, remove_all=True) for x in UNDESIREABLE_HEADER_KEYS]
+        template['EXTVER'] = 1
+
+        crpix = []
+        for idx in range(2):
+            keyword = 'CRPIX{}'.format(idx + 1)
+            if keyword in template:
+                crpix.append((idx, keyword, template[keyword]))
+
+        header_bytes = bytearray(self.fits_writer.serialize_header(template, stamps[0], primary=False))
+        crpix_offsets = [self._find_card(header_bytes, keyword) for _, keyword, _ in crpix]
+        extver_offset = self._find_card(header_bytes, 'EXTVER')
+
+        for stamp_idx, stamp in enumerate(stamps):
+            # Move the reference pixel along with the stamp origin, in FITS (x, y) order.
+            start = stamps_result.starts[stamp_idx][::-1]
+            for (idx, keyword, value), card_offset in zip(crpix, crpix_offsets):
+                header_bytes[card_offset:card_offset + FITS_CARD_LENGTH] = format_card(
+                    keyword, value - start[idx])
+
+            header_bytes[extver_offset:extver_offset + FITS_CARD_LENGTH] = format_card('EXTVER', stamp_idx + 1)
+            self.fits_writer.begin_hdu(bytes(header_bytes))
+            self.fits_writer.write_data(stamp)
+            self.fits_writer.end_hdu()
+
+    def _get_stamp_table(self, x, y, stamps_result):
+        starts = stamps_result.starts
+        columns = [fits.Column(name='X', format='D', array=x),
+                   fits.Column(name='Y', format='D', array=y),
+                   fits.Column(name='XSTART', format='K', array=starts[:, 1] + 1),
+                   fits.Column(name='YSTART', format='K', array=starts[:, 0] + 1),
+                   fits.Column(name='OVERLAP', format='L', array=stamps_result.overlaps)]
+        table_hdu = fits.BinTableHDU.from_columns(columns, name='POSITIONS')
+        return table_hdu.header, table_hdu.data
+
+    def postage_stamps(self, x, y, shape, extension='0', layout=STAMP_LAYOUT_CUBE):
+        """
+        Cut out stamps of one shape around many positions on one image, in a single vectorized gather.  Only the
+        rows spanned by the stamps are read.  Stamps hanging off the edge of the image are padded, with BLANK for
+        integer images that have it, NaN for floating point ones, and 0 otherwise.
+
+        The primary header is written first, followed by a POSITIONS table with the requested centres, the image pixel
+        of the first pixel of each stamp (XSTART, YSTART), and whether the stamp overlaps the image at all.  With the
+        cube layout, the stamps follow as a single 3D image (EXTNAME=STAMPS), indexed by stamp along the last FITS
+        axis.  With the MEF layout, every stamp is an extension of its own (EXTVER giving the stamp number), with its
+        reference pixel moved to match.
+
+        :param x: Array of stamp centres along the first FITS axis, in 1-based pixel coordinates.
+        :param y: Array of stamp centres along the second FITS axis, in 1-based pixel coordinates.
+        :param shape: The stamp shape, in numpy (rows, columns) order.
+        :param extension: The extension with the image, as in a cutout string (e.g. 1, or 'SCI,2').
+        :param layout: STAMP_LAYOUT_CUBE or STAMP_LAYOUT_MEF.
+        :return: The number of stamps that overlap the image.
+        """
+        if layout not in (STAMP_LAYOUT_CUBE, STAMP_LAYOUT_MEF):
+            raise ValueError('Unknown stamp layout {}.'.format(layout))
+
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        if x.shape != y.shape or not x.size:
+            raise ValueError('Stamp centres must be non-empty arrays of matching lengths.')
+
+        image_dimension = PixelCutoutHDU(extension=extension)
+        source = self._get_source()
+
+        for entry in self._get_index(source):
+            if entry.index == 0:
+                self.fits_writer.write_hdu(self._get_header(entry))
+
+            if self._is_extension_requested(entry.index, entry.get_ext_name_ver(), image_dimension):
+                break
+        else:
+            raise NoContentError('Extension {} not found.'.format(extension))
+
+        if not self._is_supported(entry):
+            raise ValueError('Unsupported HDU at extension {}.'.format(entry.index))
+
+        header = self._get_header(entry)
+        data = self._get_data(source, entry)
+        data = np.squeeze(data) if data is not None else None
+        if data is None or data.ndim != 2:
+            raise ValueError('Postage stamps need a 2D image (extension {}).'.format(extension))
+
+        # 0-based positions, in numpy order.
+        positions = np.column_stack((y - 1.0, x - 1.0))
+        starts = CutoutND(data=data).get_stamp_starts(positions, shape)
+
+        # Only read the rows and columns the stamps cover.
+        lower = np.clip(starts.min(axis=0), 0, data.shape)
+        upper = np.clip((starts + np.asarray(shape)).max(axis=0), lower, data.shape)
+        image = data[tuple(slice(int(lower[idx]), int(upper[idx])) for idx in range(2))]
+
+        if np.issubdtype(image.dtype, np.integer):
+            fill_value = header.get('BLANK', 0)
+        else:
+            fill_value = np.nan
+
+        stamps_result = CutoutND(data=image).extract_stamps(positions - lower, shape, fill_value=fill_value)
+        stamps_result.starts += lower
+
+        self.logger.debug('Extracted {} stamps of shape {} from extension {}.'.format(
+            len(x), tuple(shape), entry.index))
+
+        table_header, table_data = self._get_stamp_table(x, y, stamps_result)
+        self.fits_writer.write_hdu(table_header, table_data)
+
+        if layout == STAMP_LAYOUT_CUBE:
+            stamps_header = fits.Header()
+            for key in STAMP_CUBE_HEADER_KEYS:
+                if key in header:
+                    stamps_header[key] = header[key]
+            stamps_header['EXTNAME'] = 'STAMPS'
+            self.fits_writer.write_hdu(stamps_header, stamps_result.data)
+        else:
+            self._write_stamp_extensions(header, stamps_result)
+
+        return int(np.count_nonzero(stamps_result.overlaps))
+
     def cutout(self, cutout_dimensions_str):
+        if self.output_writer is None:
+            raise ValueError('An output stream (file-like object or io/stream) is required to write to.')
+
         if self.input_range_parser.is_pixel_cutout(cutout_dimensions_str):
             cutout_dimensions = self.input_range_parser.parse(
                 cutout_dimensions_str)
+        else:
+            cutout_dimensions = None
+
+        if cutout_dimensions is not None:
             self._iterate_pixel_cutout(cutout_dimensions)
         else:
-            self._iterate_cutout(None)
+            self._iterate_cutout(None, sky_cutout=self.sky_region_parser.parse_cutout(cutout_dimensions_str))
+
+        self.logger.debug('Read {} bytes to use {} bytes.'.format(
+            self.read_planner.bytes_read, self.read_planner.bytes_used))
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import logging
+
+from astropy.io import fits
+
+__all__ = ['HDUIndexEntry', 'FITSHeaderScanner', 'BLOCK_SIZE', 'CARD_LENGTH']
+
+
+# FITS files are made up of blocks of this many bytes, each holding 36 cards.
+BLOCK_SIZE = 2880
+CARD_LENGTH = 80
+END_KEYWORD = b'END     '
+VALUE_INDICATOR = b'= '
+
+# The only keywords the scanner parses.  Everything else is left in the raw header bytes.
+INDEX_KEYWORDS = frozenset([b'SIMPLE', b'XTENSION', b'BITPIX', b'NAXIS', b'PCOUNT', b'GCOUNT', b'GROUPS',
+                            b'EXTNAME', b'EXTVER', b'ZIMAGE'])
+
+
+def _parse_value(card):
+    """
+    Parse the value of a fixed format card.  Only strings, logicals, and numbers are supported, which is all
+    that the index keywords use.
+    """
+    raw = card[10:].strip()
+
+    if raw.startswith(b"'"):
+        # Quotes inside strings are escaped by doubling them.
+        chars = []
+        idx = 1
+        while idx < len(raw):
+            c = raw[idx:idx + 1]
+            if c == b"'":
+                if raw[idx + 1:idx + 2] == b"'":
+                    chars.append(c)
+                    idx += 2
+                    continue
+                else:
+                    break
+            chars.append(c)
+            idx += 1
+        return b''.join(chars).rstrip().decode('latin-1')
+    else:
+        value = raw.split(b'/')[0].strip()
+        if value == b'T':
+            return True
+        elif value == b'F':
+            return False
+        else:
+            try:
+                return int(value)
+            except ValueError:
+                try:
+                    return float(value.replace(b'D', b'E'))
+                except ValueError:
+                    return None
+
+
+class HDUIndexEntry(object):
+    """
+    Location and structure of a single HDU, as found by the `FITSHeaderScanner`.
+
+    The raw header bytes are kept so that a full `~astropy.io.fits.Header` can be built on demand, which is only
+    done for HDUs that are actually used.
+    """
+
+    def __init__(self, index, header_offset, data_offset, header_bytes, keywords):
+        self.index = index
+        self.header_offset = header_offset
+        self.data_offset = data_offset
+        self.header_bytes = header_bytes
+        self.keywords = keywords
+        self.xtension = keywords.get('XTENSION')
+        self.extname = keywords.get('EXTNAME')
+        self.extver = keywords.get('EXTVER')
+        self.bitpix = keywords.get('BITPIX')
+        self.naxis = tuple(keywords.get('NAXIS{}'.format(i), 0) for i in range(1, keywords.get('NAXIS', 0) + 1))
+        self.data_size = self._get_data_size()
+        self.next_offset = data_offset + (((self.data_size + BLOCK_SIZE - 1) // BLOCK_SIZE) * BLOCK_SIZE)
+        self._header = None
+
+    def _get_data_size(self):
+        """
+        Size, in bytes and without padding, of the data that follows the header.
+        """
+        if not self.naxis:
+            return 0
+        else:
+            size = 1
+            for idx, naxis_value in enumerate(self.naxis):
+                # Random groups have NAXIS1 = 0.
+                if idx > 0 or naxis_value != 0 or not self.keywords.get('GROUPS'):
+                    size *= naxis_value
+
+            return (abs(self.bitpix) // 8) * self.keywords.get('GCOUNT', 1) * (self.keywords.get('PCOUNT', 0) + size)
+
+    def to_dict(self):
+        """
+        Serializable (JSON compatible) form of this entry.
+        """
+        return {
+            'index': self.index,
+            'header_offset': self.header_offset,
+            'data_offset': self.data_offset,
+            'header': self.header_bytes.decode('latin-1'),
+            'keywords': self.keywords
+        }
+
+    @staticmethod
+    def from_dict(d):
+        return HDUIndexEntry(d['index'], d['header_offset'], d['data_offset'], d['header'].encode('latin-1'),
+                             d['keywords'])
+
+    def get_header(self):
+        """
+        Parse the full header.  This is only done once.
+        :return: astropy.io.fits.Header instance.
+        """
+        if self._header is None:
+            self._header = fits.Header.fromstring(self.header_bytes.decode('latin-1'))
+        return self._header
+
+    def get_ext_name_ver(self):
+        """
+        The (EXTNAME, EXTVER) tuple as used to match requested extensions, or None if there is no EXTNAME.
+        """
+        if self.extname is None:
+            return None
+        else:
+            return (self.extname, 0 if self.extver is None else self.extver)
+
+    def is_image(self):
+        return self.index == 0 or self.xtension == 'IMAGE'
+
+    def is_compressed_image(self):
+        """
+        Whether this is a tile compressed image (a binary table with ZIMAGE = T).
+        """
+        return self.xtension == 'BINTABLE' and self.keywords.get('ZIMAGE') is True
+
+    def __repr__(self):
+        return 'HDUIndexEntry(index={}, extname={}, extver={}, header_offset={}, data_offset={}, data_size={}, ' \
+               'bitpix={}, naxis={})'.format(self.index, self.extname, self.extver, self.header_offset,
+                                             self.data_offset, self.data_size, self.bitpix, self.naxis)
+
+
+class FITSHeaderScanner(object):
+    """
+    Walk a FITS file header block by header block to build an index of its HDUs, without handing any header to
+    astropy.  Only the cards needed to locate the data (and to match extensions) are parsed.
+
+    Iterating yields `HDUIndexEntry` objects lazily, and seeks past the data of each HDU before reading the next
+    header.  With a `ForwardOnlyReader` that means reading and discarding the data, so consumers that read part of
+    an HDU's data must do so before asking for the next entry.
+
+    Parameters
+    ----------
+    input_stream : File-like object
+        Stream positioned at the start of a header.  It must support seek(), at least forward.
+    """
+
+    def __init__(self, input_stream):
+        self.logger = logging.getLogger()
+        self.input_stream = input_stream
+
+    def __iter__(self):
+        index = 0
+        offset = self.input_stream.tell()
+
+        while True:
+            self.input_stream.seek(offset)
+            entry = self._read_entry(index, offset)
+
+            if entry is None:
+                break
+
+            yield entry
+
+            offset = entry.next_offset
+            index += 1
+
+    def get_index(self):
+        """
+        Scan the whole file.
+        :return: list of HDUIndexEntry instances.
+        """
+        return list(self)
+
+    def _read_block(self):
+        buf = bytearray(BLOCK_SIZE)
+        view = memoryview(buf)
+        total = 0
+        while total < BLOCK_SIZE:
+            count = self.input_stream.readinto(view[total:])
+            if not count:
+                break
+            total += count
+
+        return bytes(buf[:total])
+
+    def _read_entry(self, index, header_offset):
+        blocks = []
+        keywords = {}
+
+        while True:
+            block = self._read_block()
+
+            if not blocks and index == 0 and not (len(block) == BLOCK_SIZE and block.startswith(b'SIMPLE  ')):
+                # Not FITS at all (e.g. still compressed, or an error page), or cut short.
+                raise IOError('No FITS primary header found at byte {}.'.format(header_offset))
+
+            if len(block) < BLOCK_SIZE:
+                if blocks:
+                    raise IOError('Truncated FITS header at byte {}.'.format(header_offset))
+                else:
+                    # End of file.  Some writers leave trailing bytes after the last HDU.
+                    return None
+
+            if not blocks and not (block.startswith(b'SIMPLE  ') or block.startswith(b'XTENSION')):
+                self.logger.debug('No header at byte {}, assuming end of file.'.format(header_offset))
+                return None
+
+            blocks.append(block)
+
+            for idx in range(0, BLOCK_SIZE, CARD_LENGTH):
+                card = block[idx:idx + CARD_LENGTH]
+                keyword = card[:8]
+
+                if keyword == END_KEYWORD:
+                    header_bytes = b''.join(blocks)
+                    return HDUIndexEntry(index, header_offset, header_offset + len(header_bytes), header_bytes,
+                                         keywords)
+                elif card[8:10] == VALUE_INDICATOR:
+                    name = keyword.rstrip()
+                    if name in INDEX_KEYWORDS or name.startswith(b'NAXIS'):
+                        keywords.setdefault(name.decode('ascii'), _parse_value(card))
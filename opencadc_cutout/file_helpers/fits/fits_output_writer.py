@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import logging
+import os
+import re
+import socket
+import numpy as np
+
+from astropy.io import fits
+
+from opencadc_cutout.cutoutnd import StreamedCutout
+from .byte_range_reader import ByteRangeReader, SpanReader, get_fileno
+from .card_header import CardHeader
+from .fits_header_scanner import BLOCK_SIZE, CARD_LENGTH
+
+__all__ = ['FITSOutputWriter']
+
+
+# Numpy types of each BITPIX value.
+DTYPE_BITPIX = {
+    np.dtype('uint8'): 8,
+    np.dtype('int16'): 16,
+    np.dtype('int32'): 32,
+    np.dtype('int64'): 64,
+    np.dtype('float32'): -32,
+    np.dtype('float64'): -64
+}
+
+# Types without a BITPIX value are written as the nearest type that has one.
+PROMOTED_DTYPES = {
+    np.dtype('bool'): np.dtype('uint8'),
+    np.dtype('int8'): np.dtype('int16'),
+    np.dtype('uint16'): np.dtype('int32'),
+    np.dtype('uint32'): np.dtype('int64'),
+    np.dtype('float16'): np.dtype('float32')
+}
+
+# Keywords that describe the structure of the HDU, which are written from the data instead of copied.
+STRUCTURAL_KEYWORDS = ['SIMPLE', 'XTENSION', 'BITPIX', 'NAXIS', 'EXTEND', 'PCOUNT', 'GCOUNT', 'GROUPS', 'END']
+NAXISN_PATTERN = re.compile(r'^NAXIS\d+$')
+
+# Keywords that no longer match the data once it is cut out.
+STALE_KEYWORDS = ['CHECKSUM', 'DATASUM']
+
+# Size of the buffer used to copy data between streams that can't be copied between by the kernel.
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Keywords that are only valid for integer data.
+INTEGER_ONLY_KEYWORDS = ['BLANK']
+
+
+def _get_output_fileno(stream):
+    """
+    Obtain the OS file descriptor of an output backed by a plain file or a socket, or None otherwise.
+    """
+    raw = getattr(stream, 'raw', stream)
+    if isinstance(raw, io.FileIO) or isinstance(raw, getattr(socket, 'SocketIO', ())):
+        try:
+            return raw.fileno()
+        except (IOError, OSError, ValueError):
+            return None
+    else:
+        return None
+
+
+class FITSOutputWriter(object):
+    """
+    Streaming FITS writer that is opened once per cutout and writes every HDU straight to the output stream.
+
+    Each header is serialized once, with the structural keywords (SIMPLE or XTENSION, BITPIX, NAXISn, PCOUNT,
+    GCOUNT and EXTEND) written to match the data, and the data is streamed in big-endian FITS layout followed by its
+    block padding.  The output is flushed at every HDU boundary.  This replaces going through fits.append(), which
+    builds an HDU object, verifies it, and rereads everything already written on every call.
+
+    As with fits.append(), the first HDU written to an empty output is a primary HDU, and all others are extensions.
+    Image data is written as given, so that the BSCALE, BZERO and BLANK keywords of the header still apply to it;
+    only CHECKSUM and DATASUM are dropped, since the cutout no longer matches them.  Whole HDUs given as a
+    `.byte_range_reader.ByteRangeReader` are copied verbatim from the input, with os.copy_file_range() or
+    os.sendfile() where both ends are plain files or sockets, and through a buffer otherwise.
+
+    Parameters
+    ----------
+    output_writer : File-like object
+        The stream to write to.  Only write() and flush() are used.
+    """
+
+    def __init__(self, output_writer):
+        self.logger = logging.getLogger()
+        self.output_writer = output_writer
+        self.hdu_count = 0
+        self.bytes_written = 0
+        self._data_bytes = None
+
+        try:
+            # Appending to existing content, so there is already a primary HDU.
+            self._has_primary = output_writer.tell() > 0
+        except (AttributeError, IOError, OSError, ValueError):
+            self._has_primary = False
+
+    def _get_dtype(self, data):
+        dtype = data.dtype.newbyteorder('=')
+        dtype = PROMOTED_DTYPES.get(dtype, dtype)
+        if dtype not in DTYPE_BITPIX:
+            raise ValueError('Unable to write data of type {} to FITS.'.format(data.dtype))
+        return dtype
+
+    def _is_kept(self, keyword, dtype):
+        return not (keyword in STRUCTURAL_KEYWORDS or keyword in STALE_KEYWORDS or NAXISN_PATTERN.match(keyword)
+                    or (keyword in INTEGER_ONLY_KEYWORDS and (dtype is None or dtype.kind == 'f')))
+
+    def serialize_header(self, header, data=None, primary=None):
+        """
+        Serialize the header of an image HDU, padded to a whole number of blocks, with structural keywords to match
+        the given data.
+        :param header: The `~astropy.io.fits.Header` or `.card_header.CardHeader` to write.  It is not modified.  The
+        cards of a CardHeader are copied as they are, without being formatted again.
+        :param data: The image data to write after the header (an array, or anything else with a shape and dtype),
+        or None.
+        :param primary: Whether this is the primary HDU.  Defaults to whether a primary HDU is still to be written.
+        :return: The header bytes.
+        """
+        if primary is None:
+            primary = not self._has_primary
+
+        if data is None:
+            dtype = None
+            shape = ()
+        else:
+            dtype = self._get_dtype(data)
+            shape = data.shape
+
+        if primary:
+            cards = [fits.Card('SIMPLE', True, 'conforms to FITS standard')]
+        else:
+            cards = [fits.Card('XTENSION', 'IMAGE', 'Image extension')]
+
+        cards.append(fits.Card('BITPIX', 8 if dtype is None else DTYPE_BITPIX[dtype], 'array data type'))
+        cards.append(fits.Card('NAXIS', len(shape), 'number of array dimensions'))
+        for idx, length in enumerate(reversed(shape)):
+            cards.append(fits.Card('NAXIS{}'.format(idx + 1), length))
+
+        if primary:
+            cards.append(fits.Card('EXTEND', True))
+        else:
+            cards.append(fits.Card('PCOUNT', 0, 'number of parameters'))
+            cards.append(fits.Card('GCOUNT', 1, 'number of groups'))
+
+        if isinstance(header, CardHeader):
+            header_cards = header.iter_cards()
+        else:
+            header_cards = ((card.keyword, card.image) for card in header.cards)
+
+        images = [card.image for card in cards]
+        images.extend(image for keyword, image in header_cards if self._is_kept(keyword, dtype))
+        images.append('END'.ljust(CARD_LENGTH))
+
+        header_str = ''.join(images)
+        return header_str.ljust(len(header_str) + (-len(header_str) % BLOCK_SIZE)).encode('latin-1')
+
+    def _write(self, data_bytes):
+        self.output_writer.write(data_bytes)
+        self.bytes_written += len(data_bytes)
+
+    def begin_hdu(self, header_bytes):
+        """
+        Start an HDU with an already serialized header (see serialize_header()).  Follow with any number of
+        write_data() calls, then end_hdu().
+        """
+        if self._data_bytes is not None:
+            raise ValueError('HDU {} has not been ended.'.format(self.hdu_count))
+
+        self._write(header_bytes)
+        self._data_bytes = 0
+
+    def write_data(self, data):
+        """
+        Write part of the data of the current HDU, in big-endian layout.
+        :param data: Array, or bytes already in FITS layout.
+        """
+        if isinstance(data, np.ndarray):
+            dtype = self._get_dtype(data)
+            data = np.ascontiguousarray(data, dtype=dtype.newbyteorder('>'))
+            data_bytes = np.frombuffer(data.reshape(-1), dtype=np.uint8) if data.size else b''
+        else:
+            data_bytes = data
+
+        self._write(data_bytes)
+        self._data_bytes += len(data_bytes)
+
+    def _copy_fds(self, input_fd, offset, length):
+        """
+        Copy between file descriptors in the kernel.
+        :return: The number of bytes copied, which is less than length if the descriptors don't support it (e.g. an
+        output opened for appending).
+        """
+        output_fd = _get_output_fileno(self.output_writer)
+        copied = 0
+
+        if output_fd is None:
+            return copied
+
+        for copy_function in [getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)]:
+            if copy_function is None:
+                continue
+
+            try:
+                while copied < length:
+                    if copy_function is os.sendfile:
+                        count = os.sendfile(output_fd, input_fd, offset + copied, length - copied)
+                    else:
+                        count = copy_function(input_fd, output_fd, length - copied, offset + copied)
+
+                    if not count:
+                        break
+                    copied += count
+            except OSError as err:
+                self.logger.debug('Unable to copy with {} ({}).'.format(copy_function.__name__, err))
+
+            if copied == length:
+                break
+
+        return copied
+
+    def copy_data(self, input_stream, offset, length):
+        """
+        Copy bytes of the input, already in FITS layout, as data of the current HDU, without decoding them.
+        :param input_stream: The stream to copy from.
+        :param offset: Offset of the first byte to copy.
+        :param length: Number of bytes to copy.
+        """
+        # Everything buffered must be out before writing to the descriptor directly.
+        self.output_writer.flush()
+
+        input_fd = get_fileno(input_stream)
+        copied = self._copy_fds(input_fd, offset, length) if input_fd is not None else 0
+        self.bytes_written += copied
+        self._data_bytes += copied
+
+        if copied < length:
+            span_reader = SpanReader(input_stream)
+            buf = bytearray(min(COPY_BUFFER_SIZE, length - copied))
+            view = memoryview(buf)
+
+            while copied < length:
+                count = min(len(buf), length - copied)
+                span_reader.read_into(offset + copied, view[:count])
+                self.write_data(view[:count])
+                copied += count
+
+    def end_hdu(self):
+        """
+        Pad the data of the current HDU to a whole block, and flush.
+        """
+        padding = -self._data_bytes % BLOCK_SIZE
+        if padding:
+            self._write(b'\0' * padding)
+
+        self._data_bytes = None
+        self._has_primary = True
+        self.hdu_count += 1
+        self.output_writer.flush()
+
+    def write_hdu(self, header, data=None):
+        """
+        Write a whole HDU.
+        :param header: The `~astropy.io.fits.Header` or `.card_header.CardHeader` to write.  It is not modified.
+        :param data: Image data array, a `.byte_range_reader.ByteRangeReader` over all of an HDU's data, a
+        `opencadc_cutout.cutoutnd.StreamedCutout` to write chunk by chunk, table data (`~astropy.io.fits.FITS_rec`),
+        or None.
+        """
+        if isinstance(data, fits.FITS_rec):
+            self._write_table_hdu(header, data)
+        else:
+            self.begin_hdu(self.serialize_header(header, data))
+            if isinstance(data, ByteRangeReader):
+                self.copy_data(data.input_stream, data.data_offset, data.size * data.dtype.itemsize)
+            elif isinstance(data, StreamedCutout):
+                for chunk in data.iter_chunks():
+                    self.write_data(chunk)
+            elif data is not None:
+                self.write_data(data)
+            self.end_hdu()
+
+    def _write_table_hdu(self, header, data):
+        # Tables (such as the position table of postage stamps) are small, so let Astropy lay them out, behind an
+        # empty primary HDU of exactly one block.
+        if not self._has_primary:
+            self.write_hdu(fits.Header())
+
+        buffer = io.BytesIO()
+        fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU(data=data, header=header)]).writeto(buffer)
+        self.begin_hdu(b'')
+        self.write_data(buffer.getvalue()[BLOCK_SIZE:])
+        self.end_hdu()
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+
+from opencadc_cutout.utils import get_file_identity
+from .fits_header_scanner import HDUIndexEntry
+
+__all__ = ['HDUIndexCache', 'DEFAULT_MAX_CACHE_SIZE']
+
+
+DEFAULT_MAX_CACHE_SIZE = 256 * 1024 * 1024
+INDEX_FILE_SUFFIX = '.hduidx'
+
+
+class HDUIndexCache(object):
+    """
+    Persistent cache of HDU indexes (see `.fits_header_scanner.FITSHeaderScanner`), so that hot files are only
+    scanned once.  Each index is stored in its own sidecar file under the cache directory, named after its key, with
+    the offsets, sizes, index keywords and raw header bytes of every HDU.
+
+    Keys default to the file's path, size and modification time, so a file that changes is rescanned.  Callers
+    that know a content checksum (e.g. from archive metadata) can use that as the key instead.  Least recently
+    used indexes are evicted once the cache grows past ``max_size`` bytes.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory to store the index files in.  Created if needed.
+    max_size : int
+        The size cap, in bytes, of all index files together.
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_CACHE_SIZE):
+        self.logger = logging.getLogger()
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def get_file_key(self, input_stream):
+        """
+        Build the key identifying the file behind the given stream.
+        :param input_stream: File-like object.  It must have a name and a file descriptor.
+        :return: The key as a string, or None if the stream is not backed by a named file.
+        """
+        return get_file_identity(input_stream)
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + INDEX_FILE_SUFFIX)
+
+    def get(self, key):
+        """
+        Load the index for the given key.
+        :param key: The key from get_file_key(), or a content checksum.
+        :return: list of HDUIndexEntry instances, or None if not cached.
+        """
+        path = self._get_path(key)
+
+        try:
+            with io.open(path, 'r', encoding='utf-8') as index_file:
+                content = json.load(index_file)
+            cached_key = content.get('key')
+            entries = [HDUIndexEntry.from_dict(d) for d in content['entries']]
+        except (IOError, OSError, ValueError, UnicodeDecodeError, AttributeError, KeyError, TypeError):
+            # Missing, unreadable, or corrupt.
+            self.misses += 1
+            return None
+
+        if cached_key != key:
+            # Hash collision, or a file written by something else.
+            self.misses += 1
+            return None
+
+        # Mark as recently used.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return entries
+
+    def put(self, key, index):
+        """
+        Store the index for the given key, then evict least recently used indexes if over the size cap.
+        :param key: The key from get_file_key(), or a content checksum.
+        :param index: list of HDUIndexEntry instances.
+        """
+        path = self._get_path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'w') as index_file:
+                json.dump({'key': key, 'entries': [entry.to_dict() for entry in index]}, index_file)
+            # Atomic, so concurrent readers never see a partial index.
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            self.logger.warn('Unable to write HDU index to {}.'.format(path))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(INDEX_FILE_SUFFIX):
+                path = os.path.join(self.cache_dir, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+
+            try:
+                os.remove(path)
+                total -= size
+                self.logger.debug('Evicted HDU index {}.'.format(path))
+            except OSError:
+                pass
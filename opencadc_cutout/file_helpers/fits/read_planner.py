@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import threading
+import numpy as np
+
+__all__ = ['ReadBlock', 'ReadPlan', 'ReadPlanner', 'DEFAULT_GAP_THRESHOLD', 'DEFAULT_MAX_BLOCK_SIZE']
+
+
+# Gaps smaller than this are read through rather than seeked over.
+DEFAULT_GAP_THRESHOLD = 64 * 1024
+
+# Upper bound on the size of a single merged read, which bounds the scratch buffer.
+DEFAULT_MAX_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+class ReadBlock(object):
+    """
+    A single sequential read, and where each of the spans it covers goes in the output buffer.
+
+    The span arrays are parallel: ``span_offsets`` is relative to the start of the block, and
+    ``destination_offsets`` is relative to the start of the output buffer.
+    """
+
+    def __init__(self, offset, length, span_offsets, span_lengths, destination_offsets):
+        self.offset = offset
+        self.length = length
+        self.span_offsets = span_offsets
+        self.span_lengths = span_lengths
+        self.destination_offsets = destination_offsets
+
+    def is_direct(self):
+        """
+        Whether the block can be read straight into the output buffer.  This is the case when the spans are
+        back to back both in the file and in the output, so no scattering is needed.
+        """
+        if self.span_offsets[0] != 0 or self.span_lengths.sum() != self.length:
+            return False
+        else:
+            ends = self.span_offsets + self.span_lengths
+            return bool(np.all(self.span_offsets[1:] == ends[:-1])
+                        and np.all(self.destination_offsets - self.destination_offsets[0] == self.span_offsets))
+
+    def __repr__(self):
+        return 'ReadBlock(offset={}, length={}, spans={})'.format(self.offset, self.length,
+                                                                 len(self.span_offsets))
+
+
+class ReadPlan(object):
+    """
+    Just a DTO for the blocks to read, with the read statistics used to tune the gap threshold.
+    """
+
+    def __init__(self, blocks, bytes_read, bytes_used):
+        self.blocks = blocks
+        self.bytes_read = bytes_read
+        self.bytes_used = bytes_used
+
+    def __repr__(self):
+        return 'ReadPlan(blocks={}, bytes_read={}, bytes_used={})'.format(len(self.blocks), self.bytes_read,
+                                                                         self.bytes_used)
+
+
+class ReadPlanner(object):
+    """
+    Merge neighbouring byte spans into larger sequential reads.
+
+    Spans separated by a gap of at most ``gap_threshold`` bytes are merged into one block, so a strided cutout
+    becomes a few large reads rather than one seek and read per row.  The bytes in the gaps are read and thrown
+    away, which is reported through the `ReadPlan` as the difference between ``bytes_read`` and ``bytes_used``.
+
+    Parameters
+    ----------
+    gap_threshold : int
+        The largest gap, in bytes, to read through.  Zero only merges spans that are back to back.
+    max_block_size : int
+        The largest merged block, in bytes.  A single span larger than this is still read as one block.
+
+    The ``bytes_read`` and ``bytes_used`` attributes keep running totals over every plan made.
+    """
+
+    def __init__(self, gap_threshold=DEFAULT_GAP_THRESHOLD, max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+        if gap_threshold < 0:
+            raise ValueError('Gap threshold must be zero or more (got {}).'.format(gap_threshold))
+
+        self.gap_threshold = int(gap_threshold)
+        self.max_block_size = int(max_block_size)
+        self.bytes_read = 0
+        self.bytes_used = 0
+        self._lock = threading.Lock()
+
+    def plan(self, offsets, lengths, destination_offsets):
+        """
+        Plan the reads for the given spans.
+
+        :param offsets:     The file offset of each span.
+        :param lengths:     The length, in bytes, of each span.  A scalar applies to all spans.
+        :param destination_offsets: The offset in the output buffer that each span is copied to.
+        :return: ReadPlan instance with the blocks in file order.
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        lengths = np.broadcast_to(np.asarray(lengths, dtype=np.int64), offsets.shape)
+        destination_offsets = np.asarray(destination_offsets, dtype=np.int64)
+
+        if offsets.size == 0:
+            return ReadPlan([], 0, 0)
+
+        order = np.argsort(offsets, kind='mergesort')
+        offsets = offsets[order]
+        lengths = lengths[order]
+        destination_offsets = destination_offsets[order]
+        ends = np.maximum.accumulate(offsets + lengths)
+
+        # A new block starts wherever the gap to everything before it is too large.
+        gaps = offsets[1:] - ends[:-1]
+        starts = np.concatenate(([0], np.flatnonzero(gaps > self.gap_threshold) + 1, [len(offsets)]))
+
+        blocks = []
+        for group_start, group_end in zip(starts[:-1], starts[1:]):
+            idx = group_start
+            while idx < group_end:
+                # Split groups that would exceed the maximum block size.
+                limit = offsets[idx] + self.max_block_size
+                stop = idx + 1 + np.searchsorted(ends[idx + 1:group_end], limit, side='right')
+                block_offset = offsets[idx]
+                block_end = ends[stop - 1]
+                blocks.append(ReadBlock(int(block_offset), int(block_end - block_offset),
+                                        offsets[idx:stop] - block_offset, lengths[idx:stop],
+                                        destination_offsets[idx:stop]))
+                idx = stop
+
+        bytes_read = sum(block.length for block in blocks)
+        bytes_used = int(lengths.sum())
+        # Planners are shared by the threads extracting different extensions.
+        with self._lock:
+            self.bytes_read += bytes_read
+            self.bytes_used += bytes_used
+
+        return ReadPlan(blocks, bytes_read, bytes_used)
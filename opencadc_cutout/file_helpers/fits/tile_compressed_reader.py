@@ -0,0 +1,537 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import logging
+import re
+import threading
+import numpy as np
+
+from astropy.io import fits
+from collections import OrderedDict
+from .byte_range_reader import BITPIX_DTYPES, SpanReader
+from .read_planner import ReadPlanner
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+try:
+    # The per-tile codecs are only exposed as private helpers, so support depends on the installed Astropy.  Without
+    # them, whole images are decompressed by Astropy instead (see read_compressed_data()).
+    from astropy.io.fits.hdu.compressed._tiled_compression import (
+        DITHER_METHODS, Quantize, _decompress_tile, _finalize_array, _header_to_settings, _update_tile_settings)
+    from astropy.io.fits.hdu.compressed.header import _bintable_header_to_image_header
+    TILE_COMPRESSION_SUPPORTED = True
+except ImportError:
+    TILE_COMPRESSION_SUPPORTED = False
+
+__all__ = ['TileCompressedReader', 'TileCache', 'TILE_COMPRESSION_SUPPORTED', 'DEFAULT_DECOMPRESSION_WORKERS',
+           'DEFAULT_TILE_CACHE_BYTES', 'get_image_header', 'read_compressed_data']
+
+
+DEFAULT_DECOMPRESSION_WORKERS = 4
+
+# Most bytes of decompressed tiles to keep between reads, such as tiles straddling two chunks of a streamed cutout.
+DEFAULT_TILE_CACHE_BYTES = 64 * 1024 * 1024
+
+# Compression types whose (cfitsio) decoders keep global state, so that their tiles must be decompressed one at a
+# time, across all readers.
+SERIAL_COMPRESSION_TYPES = ['HCOMPRESS_1']
+_SERIAL_DECOMPRESSION_LOCK = threading.Lock()
+
+TFORM_PATTERN = re.compile(r'^\s*(?P<repeat>\d*)(?P<code>[LXBIJKAEDCMPQ])(?P<heap_code>[LXBIJKAEDCM]?)')
+
+# Size, in bytes, of one element of each binary table column type.  X (bits) is handled separately.
+COLUMN_TYPE_SIZES = {'L': 1, 'B': 1, 'I': 2, 'J': 4, 'K': 8, 'A': 1, 'E': 4, 'D': 8, 'C': 8, 'M': 16,
+                     'P': 8, 'Q': 16}
+COLUMN_TYPE_DTYPES = {'L': 'i1', 'B': 'u1', 'I': '>i2', 'J': '>i4', 'K': '>i8', 'A': 'S1', 'E': '>f4',
+                      'D': '>f8', 'P': '>i4', 'Q': '>i8'}
+
+# Columns used for decompression.
+DATA_COLUMNS = ['COMPRESSED_DATA', 'GZIP_COMPRESSED_DATA', 'UNCOMPRESSED_DATA']
+SCALAR_COLUMNS = ['ZSCALE', 'ZZERO', 'ZBLANK']
+
+
+def _open_compressed_hdu(header, data_bytes):
+    """
+    Open a tile compressed HDU from its binary table header and data with Astropy.
+    :return: `~astropy.io.fits.HDUList` of an empty primary HDU followed by the compressed HDU.
+    """
+    hdu_bytes = fits.PrimaryHDU().header.tostring().encode('ascii') + header.tostring().encode('latin-1') + data_bytes
+    padding = -len(hdu_bytes) % 2880
+    return fits.open(io.BytesIO(hdu_bytes + (b'\0' * padding)), do_not_scale_image_data=True)
+
+
+def get_image_header(header):
+    """
+    Convert the header of a tile compressed binary table to the header of the image it holds.
+    """
+    if TILE_COMPRESSION_SUPPORTED:
+        return _bintable_header_to_image_header(header)
+
+    # Astropy builds the image header from the table header alone, so leave out the rows and heap.
+    table_header = header.copy()
+    table_header['NAXIS2'] = 0
+    table_header['PCOUNT'] = 0
+    table_header.remove('THEAP', ignore_missing=True)
+    with _open_compressed_hdu(table_header, b'') as hdu_list:
+        return hdu_list[1].header.copy()
+
+
+def read_compressed_data(input_stream, header, data_offset, read_planner=None):
+    """
+    Read and decompress a whole tile compressed image with Astropy.  This is used instead of a TileCompressedReader
+    when the installed Astropy lacks the per-tile codecs, so every tile is decompressed, however small the cutout.
+    :param input_stream: A readable stream of the FITS file that supports seek(), at least forward.
+    :param header: The binary table header of the compressed HDU.
+    :param data_offset: The byte offset of the binary table data in the stream.
+    :param read_planner: Planner used to read the data.  Defaults to ReadPlanner().
+    :return: numpy array of the image.
+    """
+    data_size = (header['NAXIS1'] * header['NAXIS2']) + header.get('PCOUNT', 0)
+    data_buf, _ = SpanReader(input_stream, read_planner).read_spans([int(data_offset)], data_size)
+
+    with _open_compressed_hdu(header, data_buf.tobytes()) as hdu_list:
+        return np.array(hdu_list[1].data)
+
+
+class TileCache(object):
+    """
+    Decompressed tiles, keyed by row index, of which the least recently used are evicted once the cache holds more
+    than max_bytes.  The tiles of a single read are always kept, however large.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The most bytes of tiles to keep between reads.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_TILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._tiles = OrderedDict()
+
+    def __contains__(self, row_index):
+        return row_index in self._tiles
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def get(self, row_index):
+        """
+        Obtain a tile, marking it as the most recently used.
+        :param row_index: The table row of the tile.
+        """
+        tile_data = self._tiles.pop(row_index)
+        self._tiles[row_index] = tile_data
+        return tile_data
+
+    def put(self, tiles, keep=()):
+        """
+        Add tiles, first evicting the least recently used ones, other than those to keep, to make room for them.
+        :param tiles: dict of row index to tile data.
+        :param keep: Row indices of cached tiles needed by the same read.
+        """
+        nbytes = sum(tile_data.nbytes for tile_data in tiles.values())
+
+        for row_index in list(self._tiles):
+            if self.nbytes + nbytes <= self.max_bytes:
+                break
+            if row_index not in keep:
+                self.nbytes -= self._tiles.pop(row_index).nbytes
+
+        for row_index, tile_data in tiles.items():
+            self._tiles[row_index] = tile_data
+        self.nbytes += nbytes
+
+
+class TileCompressedReader(object):
+    """
+    Array-like view over a tile compressed image (a CompImageHDU) that decompresses only the tiles a cutout touches.
+
+    The table rows for the needed tiles, and then their compressed bytes in the heap, are read in file order with
+    a `.byte_range_reader.SpanReader`, and the tiles are decompressed in parallel on a thread pool (zlib and the
+    Astropy codecs release the GIL) before being assembled into the output.
+
+    Supports the same subset of the numpy API as `.byte_range_reader.ByteRangeReader`.
+
+    Parameters
+    ----------
+    input_stream : File-like object
+        A readable stream of the FITS file that supports seek(), at least forward.
+    header : `~astropy.io.fits.Header`
+        The binary table header of the compressed HDU.
+    data_offset : int
+        The byte offset of the binary table data in the stream.
+    read_planner : `.read_planner.ReadPlanner`
+        Planner used to merge neighbouring reads.  Defaults to ReadPlanner().
+    max_workers : int
+        Number of threads to decompress tiles with.  One (or less) decompresses in the calling thread, as do
+        compression types with thread-unsafe decoders (HCOMPRESS_1).
+    max_cache_bytes : int
+        The most bytes of decompressed tiles to keep between reads.  Defaults to DEFAULT_TILE_CACHE_BYTES.
+    """
+
+    def __init__(self, input_stream, header, data_offset, read_planner=None,
+                 max_workers=DEFAULT_DECOMPRESSION_WORKERS, axes=None, tile_cache=None,
+                 max_cache_bytes=DEFAULT_TILE_CACHE_BYTES):
+        if not TILE_COMPRESSION_SUPPORTED:
+            raise ValueError('Tile compressed images are not supported by this version of Astropy.')
+
+        self.logger = logging.getLogger()
+        self.input_stream = input_stream
+        self.header = header
+        self.image_header = get_image_header(header)
+        self.data_offset = int(data_offset)
+        self.read_planner = ReadPlanner() if read_planner is None else read_planner
+        self.max_workers = max_workers
+
+        self.zbitpix = header['ZBITPIX']
+        self.compression_type = header['ZCMPTYPE']
+        self.dtype = np.dtype(BITPIX_DTYPES[self.zbitpix])
+        znaxis = header['ZNAXIS']
+
+        # Numpy (C) ordering, slowest varying axis first.
+        self._full_shape = tuple(header['ZNAXIS{}'.format(i)] for i in range(znaxis, 0, -1))
+        self._tile_shape = tuple(header.get('ZTILE{}'.format(i), header['ZNAXIS1'] if i == 1 else 1)
+                                 for i in range(znaxis, 0, -1))
+        self._n_tiles = tuple((length + tile - 1) // tile for length, tile in zip(self._full_shape, self._tile_shape))
+        self._axes = tuple(range(znaxis)) if axes is None else tuple(axes)
+
+        self._row_size = header['NAXIS1']
+        self._heap_offset = self.data_offset + header.get('THEAP', header['NAXIS1'] * header['NAXIS2'])
+        self._columns = self._parse_columns(header)
+        self._row_dtype = np.dtype({
+            'names': [name for name in self._columns],
+            'formats': [column[1] for column in self._columns.values()],
+            'offsets': [column[0] for column in self._columns.values()],
+            'itemsize': self._row_size
+        })
+
+        self._quantized = 'ZSCALE' in self._columns
+        self._settings = _header_to_settings(header)
+        self._dither_method = DITHER_METHODS[header.get('ZQUANTIZ', 'NO_DITHER')]
+        self._dither_seed = header.get('ZDITHER0', 0)
+        self._zblank = header.get('ZBLANK', self.image_header.get('BLANK'))
+
+        # Decompressed tiles, keyed by row index.  Shared with squeezed views.
+        self._tile_cache = TileCache(max_cache_bytes) if tile_cache is None else tile_cache
+
+    def _parse_columns(self, header):
+        """
+        Find the columns used for decompression.
+        :return: dict of column name to (offset in the row, numpy format, heap dtype).
+        """
+        columns = {}
+        offset = 0
+
+        for i in range(1, header['TFIELDS'] + 1):
+            name = header.get('TTYPE{}'.format(i), '').strip().upper()
+            match = TFORM_PATTERN.match(header['TFORM{}'.format(i)])
+
+            if match is None:
+                raise ValueError('Unsupported TFORM{} {}.'.format(i, header['TFORM{}'.format(i)]))
+
+            repeat = int(match.group('repeat') or 1)
+            code = match.group('code')
+
+            if code == 'X':
+                size = (repeat + 7) // 8
+            else:
+                size = COLUMN_TYPE_SIZES[code] * repeat
+
+            if name in DATA_COLUMNS and code in ('P', 'Q'):
+                # Array descriptor of (element count, heap offset).
+                heap_dtype = np.dtype(COLUMN_TYPE_DTYPES[match.group('heap_code')])
+                columns[name] = (offset, (COLUMN_TYPE_DTYPES[code], 2), heap_dtype)
+            elif name in SCALAR_COLUMNS:
+                columns[name] = (offset, COLUMN_TYPE_DTYPES[code], None)
+
+            offset += size
+
+        if 'COMPRESSED_DATA' not in columns:
+            raise ValueError('No COMPRESSED_DATA column found.')
+
+        return columns
+
+    @property
+    def shape(self):
+        return tuple(self._full_shape[axis] for axis in self._axes)
+
+    @property
+    def ndim(self):
+        return len(self._axes)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    def squeeze(self):
+        """
+        Remove single-dimensional entries from the shape.  This returns a new view and reads nothing.
+        """
+        axes = [axis for axis in self._axes if self._full_shape[axis] != 1]
+        return TileCompressedReader(self.input_stream, self.header, self.data_offset, read_planner=self.read_planner,
+                                    max_workers=self.max_workers, axes=axes, tile_cache=self._tile_cache)
+
+    def _to_full_slices(self, key):
+        if key is Ellipsis:
+            key = ()
+        elif not isinstance(key, tuple):
+            key = (key,)
+
+        if len(key) > self.ndim:
+            raise IndexError('Too many indices ({}) for shape {}.'.format(len(key), self.shape))
+
+        full_slices = [(0, 1, 1)] * len(self._full_shape)
+
+        for idx, axis in enumerate(self._axes):
+            length = self._full_shape[axis]
+            if idx < len(key):
+                s = key[idx]
+                if not isinstance(s, slice):
+                    raise IndexError('Only slices are supported, but got {}.'.format(s))
+                start, stop, step = s.indices(length)
+                if step < 1:
+                    raise IndexError('Only forward slices are supported, but got {}.'.format(s))
+                full_slices[axis] = (start, max(start, stop), step)
+            else:
+                full_slices[axis] = (0, length, 1)
+
+        return full_slices
+
+    def get_tiles(self, key):
+        """
+        Find the tiles intersecting the given key.
+        :return: list of tile indices (one tuple per tile, in numpy order), in row (and so file) order.
+        """
+        full_slices = self._to_full_slices(key)
+
+        if any(stop <= start for start, stop, _ in full_slices):
+            return []
+
+        # With a step, tiles falling entirely between two selected pixels are skipped.
+        tile_ranges = [np.unique(np.arange(start, stop, step) // tile)
+                       for (start, stop, step), tile in zip(full_slices, self._tile_shape)]
+        grid = np.meshgrid(*tile_ranges, indexing='ij')
+        return [tuple(int(i) for i in tile_index) for tile_index in zip(*[g.ravel() for g in grid])]
+
+    def _get_row_index(self, tile_index):
+        return int(np.ravel_multi_index(tile_index, self._n_tiles))
+
+    def _get_tile_slices(self, tile_index):
+        return tuple(slice(i * tile, min((i + 1) * tile, length))
+                     for i, tile, length in zip(tile_index, self._tile_shape, self._full_shape))
+
+    def _fetch_tiles(self, tile_indices):
+        """
+        Read and decompress the given tiles into the tile cache.  Table rows are read first, then the heap, both in
+        file order, so this works on forward-only streams as long as everything is fetched in one call.
+        :return: dict of row index to tile data, for all of the given tiles.
+        """
+        tiles = {}
+        row_indices = []
+
+        for row_index in sorted(set(self._get_row_index(tile_index) for tile_index in tile_indices)):
+            if row_index in self._tile_cache:
+                tiles[row_index] = self._tile_cache.get(row_index)
+            else:
+                row_indices.append(row_index)
+
+        if not row_indices:
+            return tiles
+
+        span_reader = SpanReader(self.input_stream, self.read_planner)
+        row_buf, _ = span_reader.read_spans(
+            [self.data_offset + (row_index * self._row_size) for row_index in row_indices], self._row_size)
+        rows = np.frombuffer(row_buf.tobytes(), dtype=self._row_dtype)
+
+        heap_offsets = []
+        heap_lengths = []
+        heap_columns = []
+
+        for row in rows:
+            column_name = 'COMPRESSED_DATA'
+            if row[column_name][0] == 0:
+                # Tiles that did not quantize well are stored losslessly in one of the other columns.
+                column_name = next((name for name in DATA_COLUMNS[1:] if name in self._columns), None)
+                if column_name is None:
+                    raise ValueError('COMPRESSED_DATA column has zero length but neither GZIP_COMPRESSED_DATA nor '
+                                     'UNCOMPRESSED_DATA column exists.')
+
+            count, offset = row[column_name]
+            heap_offsets.append(self._heap_offset + int(offset))
+            heap_lengths.append(int(count) * self._columns[column_name][2].itemsize)
+            heap_columns.append(column_name)
+
+        heap_buf, heap_destinations = span_reader.read_spans(heap_offsets, heap_lengths)
+        self.logger.debug('Decompressing {} tiles from {} compressed bytes.'.format(len(row_indices), len(heap_buf)))
+
+        tasks = []
+        for idx, row_index in enumerate(row_indices):
+            start = int(heap_destinations[idx])
+            cdata = heap_buf[start:start + heap_lengths[idx]].view(self._columns[heap_columns[idx]][2])
+            tile_index = np.unravel_index(row_index, self._n_tiles)
+            tile_shape = tuple(s.stop - s.start for s in self._get_tile_slices(tile_index))
+            tasks.append((row_index, tile_shape, rows[idx], cdata, heap_columns[idx]))
+
+        if self.max_workers > 1 and len(tasks) > 1 and ThreadPoolExecutor is not None \
+                and self.compression_type not in SERIAL_COMPRESSION_TYPES:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                decompressed = list(executor.map(lambda task: self._decompress(*task), tasks))
+        else:
+            decompressed = [self._decompress(*task) for task in tasks]
+
+        new_tiles = dict((task[0], tile_data) for task, tile_data in zip(tasks, decompressed))
+        self._tile_cache.put(new_tiles, keep=tiles)
+        tiles.update(new_tiles)
+        return tiles
+
+    def _decompress(self, row_index, tile_shape, row, cdata, column_name):
+        """
+        Decompress a single tile.  This follows what Astropy does for a whole image, one tile at a time.
+        """
+        if column_name == 'GZIP_COMPRESSED_DATA':
+            return _finalize_array(_decompress_tile(cdata, algorithm='GZIP_1'), bitpix=self.zbitpix,
+                                   tile_shape=tile_shape, algorithm='GZIP_1', lossless=True)
+        elif column_name == 'UNCOMPRESSED_DATA':
+            return cdata.reshape(tile_shape)
+
+        settings = _update_tile_settings(dict(self._settings), self.compression_type, tile_shape)
+
+        if self.compression_type == 'GZIP_2':
+            # The item size is only known from the total decompressed size.
+            tile_data = np.asarray(_decompress_tile(cdata, algorithm='GZIP_1'))
+            settings['itemsize'] = tile_data.size // int(np.prod(tile_shape))
+
+        if self.compression_type in SERIAL_COMPRESSION_TYPES:
+            with _SERIAL_DECOMPRESSION_LOCK:
+                decompressed = _decompress_tile(cdata, algorithm=self.compression_type, **settings)
+        else:
+            decompressed = _decompress_tile(cdata, algorithm=self.compression_type, **settings)
+
+        tile_data = _finalize_array(decompressed, bitpix=self.zbitpix, tile_shape=tile_shape,
+                                    algorithm=self.compression_type, lossless=not self._quantized)
+
+        zblank = row['ZBLANK'] if 'ZBLANK' in self._columns else self._zblank
+        blank_mask = None if zblank is None else (tile_data == zblank)
+
+        if self._quantized:
+            quantize = Quantize(row=(row_index + self._dither_seed) if self._dither_method != -1 else 0,
+                                dither_method=self._dither_method, quantize_level=None, bitpix=self.zbitpix)
+            tile_data = np.asarray(quantize.decode_quantized(tile_data, row['ZSCALE'], row['ZZERO'])).reshape(
+                tile_shape)
+
+        if blank_mask is not None:
+            if not tile_data.flags.writeable:
+                tile_data = tile_data.copy()
+            tile_data[blank_mask] = self._zblank if self.zbitpix > 0 else np.nan
+
+        return tile_data
+
+    def __getitem__(self, key):
+        full_slices = self._to_full_slices(key)
+        output_shape = tuple(len(range(*full_slices[axis])) for axis in self._axes)
+        output = np.empty(tuple(len(range(*full_slice)) for full_slice in full_slices), dtype=self.dtype)
+        tile_indices = self.get_tiles(key)
+
+        tiles = self._fetch_tiles(tile_indices)
+
+        for tile_index in tile_indices:
+            tile_slices = self._get_tile_slices(tile_index)
+            tile_data = tiles[self._get_row_index(tile_index)]
+            source = []
+            destination = []
+
+            for (start, stop, step), tile_slice in zip(full_slices, tile_slices):
+                # First selected pixel in this tile.
+                lower = start - ((start - max(start, tile_slice.start)) // step) * step
+                upper = min(stop, tile_slice.stop)
+                source.append(slice(lower - tile_slice.start, upper - tile_slice.start, step))
+                destination.append(slice((lower - start) // step, len(range(start, upper, step))))
+
+            output[tuple(destination)] = tile_data[tuple(source)]
+
+        return output.reshape(output_shape)
+
+    def prefetch(self, keys):
+        """
+        Read and decompress the tiles needed by all of the given keys in a single pass over the file.
+        :param keys: list of keys (tuples of slices, or Ellipsis) that will be used to index this reader.
+        """
+        tile_indices = []
+        for key in keys:
+            tile_indices.extend(self.get_tiles(key))
+
+        self._fetch_tiles(tile_indices)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import numpy as np
+
+__all__ = ['ForwardOnlyReader']
+
+
+# Size of the scratch buffer used to read and discard skipped bytes.
+SKIP_BUFFER_SIZE = 1024 * 1024
+
+
+class ForwardOnlyReader(io.RawIOBase):
+    """
+    Seek-forward-only view of a non-seekable stream (e.g. an HTTP response).
+
+    Seeking forward reads and discards the skipped bytes through a fixed size buffer, so memory stays bounded no
+    matter how much is skipped.  Seeking backward is an error, so readers must request bytes in file order.
+
+    This only bounds what is skipped: the bytes of a cutout are held once read.  A single cutout of an HDU is read
+    and written in chunks of at most the memory budget of the `.file_helpers.fits.fits_file_helper.FITSHelper`,
+    but several cutouts of the same HDU are all read in one pass before any is written, so they are held whole.
+
+    Parameters
+    ----------
+    input_stream : File-like object
+        The stream to read from.  Only read() (or readinto()) is used.
+    """
+
+    def __init__(self, input_stream):
+        super(ForwardOnlyReader, self).__init__()
+        self.input_stream = input_stream
+        self._position = 0
+        self._skip_buffer = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        # Only forward seeks are supported, so report as non-seekable to callers that need random access.
+        return False
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('Only SEEK_SET and SEEK_CUR are supported.')
+
+        if offset < self._position:
+            raise IOError('Cannot seek backward on a forward-only stream (from {} to {}).'.format(
+                self._position, offset))
+
+        self.skip(offset - self._position)
+        return self._position
+
+    def skip(self, count):
+        """
+        Read and discard the given number of bytes.
+        :param count:   The number of bytes to skip.
+        :return: The number of bytes skipped, which is less than count only at the end of the stream.
+        """
+        if self._skip_buffer is None:
+            self._skip_buffer = bytearray(SKIP_BUFFER_SIZE)
+
+        view = memoryview(self._skip_buffer)
+        remaining = count
+        while remaining > 0:
+            read_count = self.readinto(view[:min(remaining, len(view))])
+            if not read_count:
+                break
+            remaining -= read_count
+
+        return count - remaining
+
+    def readinto(self, b):
+        readinto = getattr(self.input_stream, 'readinto', None)
+        if readinto is not None:
+            count = readinto(b)
+        else:
+            data = self.input_stream.read(len(b))
+            count = len(data)
+            np.frombuffer(b, dtype=np.uint8)[:count] = np.frombuffer(data, dtype=np.uint8)
+
+        count = count or 0
+        self._position += count
+        return count
+
+    def read_fully(self, count):
+        """
+        Read exactly count bytes, unless the stream ends first.
+        """
+        buf = bytearray(count)
+        view = memoryview(buf)
+        total = 0
+        while total < count:
+            read_count = self.readinto(view[total:])
+            if not read_count:
+                break
+            total += read_count
+
+        return bytes(buf[:total])
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import bisect
+import io
+import threading
+import zlib
+import numpy as np
+
+from collections import OrderedDict
+
+from opencadc_cutout.utils import get_file_identity
+
+__all__ = ['GzipIndex', 'GzipIndexCache', 'GzipIndexReader', 'is_gzip', 'DEFAULT_CHECKPOINT_SPACING',
+           'DEFAULT_MAX_INDEX_BYTES']
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Uncompressed bytes between decompressor checkpoints.
+DEFAULT_CHECKPOINT_SPACING = 1024 * 1024
+
+# Estimated memory held by one checkpoint: the 32KB window of its decompressor copy, plus the rest of its state.
+CHECKPOINT_BYTES = 40 * 1024
+
+# Bytes of checkpoints kept in memory by a GzipIndexCache.
+DEFAULT_MAX_INDEX_BYTES = 64 * 1024 * 1024
+
+# Compressed bytes fed to the decompressor at a time.
+INPUT_CHUNK_SIZE = 64 * 1024
+
+# Size of the scratch buffer used to decompress and discard skipped bytes.
+SKIP_CHUNK_SIZE = 1024 * 1024
+
+# zlib window bits to decode a gzip member, header and trailer included.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def is_gzip(input_stream):
+    """
+    Check for the gzip magic number at the current position of the given stream, without moving it.
+    :param input_stream: Seekable file-like object.
+    """
+    position = input_stream.tell()
+    try:
+        return input_stream.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    finally:
+        input_stream.seek(position)
+
+
+class GzipCheckpoint(object):
+    """
+    Decompressor state at a known point of a gzip stream.
+
+    Parameters
+    ----------
+    uncompressed_offset : int
+        The offset in the uncompressed data that the decompressor will produce next.
+    compressed_offset : int
+        The offset in the gzip stream of the next byte to feed the decompressor.
+    decompressor : zlib.Decompress
+        A private copy of the decompressor.  It is copied again on restore, so it is never modified.
+    """
+
+    def __init__(self, uncompressed_offset, compressed_offset, decompressor):
+        self.uncompressed_offset = uncompressed_offset
+        self.compressed_offset = compressed_offset
+        self.decompressor = decompressor
+
+
+class GzipIndex(object):
+    """
+    zran-style access point index of a gzip stream: a checkpoint of the decompressor every ``spacing`` bytes of
+    uncompressed data.  Reading from an arbitrary offset then only needs to decompress from the nearest checkpoint
+    before it, rather than from the start of the stream.
+
+    Checkpoints are added by `GzipIndexReader` as it decompresses, so the index fills in as the file is read, and can
+    be shared by any number of readers of the same file.
+
+    Parameters
+    ----------
+    spacing : int
+        Uncompressed bytes between checkpoints.  Each checkpoint holds a copy of the decompressor, including its
+        32KB window, so smaller spacings trade memory for less decompression per seek.
+    """
+
+    def __init__(self, spacing=DEFAULT_CHECKPOINT_SPACING):
+        self.spacing = spacing
+        self.size = None
+        self._checkpoints = [GzipCheckpoint(0, 0, zlib.decompressobj(GZIP_WBITS))]
+        self._offsets = [0]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._checkpoints)
+
+    @property
+    def nbytes(self):
+        """
+        Estimated memory held by the checkpoints.
+        """
+        return len(self._checkpoints) * CHECKPOINT_BYTES
+
+    def get_checkpoint(self, uncompressed_offset):
+        """
+        Find the last checkpoint at or before the given offset.
+        :param uncompressed_offset: Offset in the uncompressed data.
+        """
+        with self._lock:
+            return self._checkpoints[bisect.bisect_right(self._offsets, uncompressed_offset) - 1]
+
+    def get_last_offset(self):
+        return self._offsets[-1]
+
+    def add_checkpoint(self, uncompressed_offset, compressed_offset, decompressor):
+        """
+        Add a checkpoint if it is at least ``spacing`` bytes past the last one.  Checkpoints are only ever added at
+        the end, as decompression moves past the indexed part of the stream.
+        :return: True if the checkpoint was added.
+        """
+        with self._lock:
+            if uncompressed_offset < self._offsets[-1] + self.spacing:
+                return False
+            else:
+                self._checkpoints.append(
+                    GzipCheckpoint(uncompressed_offset, compressed_offset, decompressor.copy()))
+                self._offsets.append(uncompressed_offset)
+                return True
+
+
+class GzipIndexCache(object):
+    """
+    In-memory cache of gzip indexes, keyed by file identity (path, size and modification time), so that repeated
+    cutouts from the same file reuse its checkpoints.  Least recently used indexes are dropped once their checkpoints
+    add up to more than ``max_bytes``.  Indexes grow as their files are read, so this is checked whenever an index is
+    asked for, and the index asked for is always kept.
+
+    Parameters
+    ----------
+    spacing : int
+        Uncompressed bytes between checkpoints of new indexes.
+    max_bytes : int
+        Estimated bytes of checkpoints to keep (see `GzipIndex.nbytes`).
+    """
+
+    def __init__(self, spacing=DEFAULT_CHECKPOINT_SPACING, max_bytes=DEFAULT_MAX_INDEX_BYTES):
+        self.spacing = spacing
+        self.max_bytes = max_bytes
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_index(self, input_stream):
+        """
+        Obtain the index for the file behind the given stream.
+        :param input_stream: File-like object.  Streams that are not backed by a named file get a new index that is not
+        cached.
+        :return: GzipIndex instance.
+        """
+        key = get_file_identity(input_stream)
+
+        if key is None:
+            return GzipIndex(self.spacing)
+
+        with self._lock:
+            index = self._indexes.pop(key, None)
+            if index is None:
+                index = GzipIndex(self.spacing)
+            self._indexes[key] = index
+
+            total = sum(cached_index.nbytes for cached_index in self._indexes.values())
+            while total > self.max_bytes and len(self._indexes) > 1:
+                total -= self._indexes.popitem(last=False)[1].nbytes
+
+            return index
+
+
+class GzipIndexReader(io.RawIOBase):
+    """
+    Seekable view of the uncompressed contents of a gzip stream (including multi-member streams).
+
+    Seeking is lazy.  A read at or shortly after the current decompressor position carries on decompressing, while a
+    read anywhere else restarts from the nearest checkpoint of the index before it.  Checkpoints are added to the
+    index as new parts of the stream are decompressed.
+
+    Parameters
+    ----------
+    input_stream : File-like object
+        The gzip stream, positioned at its start.  It must support seek() and read().
+    index : `GzipIndex`
+        The index to use and extend.  Share one between readers of the same file.
+    """
+
+    def __init__(self, input_stream, index=None):
+        super(GzipIndexReader, self).__init__()
+        self.input_stream = input_stream
+        self.index = index if index is not None else GzipIndex()
+        self._start = input_stream.tell()
+        self._position = 0
+        self._decompressor = None
+        self._uncompressed_offset = 0
+        self._compressed_offset = 0
+        self._pending = b''
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._get_size()
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('Unsupported whence value {}.'.format(whence))
+
+        if offset < 0:
+            raise IOError('Negative seek position {}.'.format(offset))
+
+        self._position = offset
+        return self._position
+
+    def _get_size(self):
+        if self.index.size is None:
+            self._move_to(self.index.get_last_offset())
+            while self._inflate(SKIP_CHUNK_SIZE):
+                pass
+        return self.index.size
+
+    def _restore(self, checkpoint):
+        self._decompressor = checkpoint.decompressor.copy()
+        self._uncompressed_offset = checkpoint.uncompressed_offset
+        self._compressed_offset = checkpoint.compressed_offset
+        self._pending = b''
+        self._eof = False
+
+    def _move_to(self, offset):
+        """
+        Bring the decompressor to the given uncompressed offset, from the nearest checkpoint if that is closer than
+        the current decompressor position.
+        """
+        checkpoint = self.index.get_checkpoint(offset)
+
+        if (self._decompressor is None or offset < self._uncompressed_offset
+                or checkpoint.uncompressed_offset > self._uncompressed_offset):
+            self._restore(checkpoint)
+
+        while self._uncompressed_offset < offset:
+            if not self._inflate(min(offset - self._uncompressed_offset, SKIP_CHUNK_SIZE)):
+                break
+
+    def _read_input(self):
+        self.input_stream.seek(self._start + self._compressed_offset)
+        data = self.input_stream.read(INPUT_CHUNK_SIZE)
+        self._compressed_offset += len(data)
+        return data
+
+    def _inflate(self, max_length):
+        """
+        Decompress up to max_length bytes from the current decompressor position.  Past the indexed part of the
+        stream, output stops at the next checkpoint, so that checkpoints are evenly spaced.
+        :return: The decompressed bytes, empty only at the end of the stream.
+        """
+        last_checkpoint = self.index.get_last_offset()
+        if last_checkpoint <= self._uncompressed_offset < last_checkpoint + self.index.spacing:
+            max_length = min(max_length, last_checkpoint + self.index.spacing - self._uncompressed_offset)
+
+        while not self._eof:
+            data = self._pending or self._read_input()
+            output = self._decompressor.decompress(data, max_length)
+            self._pending = self._decompressor.unconsumed_tail
+
+            # Python 2 has no Decompress.eof, but leaves anything past the end of the member in unused_data.
+            if getattr(self._decompressor, 'eof', bool(self._decompressor.unused_data)):
+                # End of a member.  Any further member is decoded by a fresh decompressor.
+                self._pending = self._decompressor.unused_data
+                while len(self._pending) < len(GZIP_MAGIC):
+                    more = self._read_input()
+                    if not more:
+                        break
+                    self._pending += more
+                if self._pending[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+                    self._decompressor = zlib.decompressobj(GZIP_WBITS)
+                else:
+                    # Trailing garbage (e.g. zero padding) is ignored, as gzip does.
+                    self._eof = True
+            elif not data and not output:
+                if not hasattr(self._decompressor, 'eof'):
+                    # Without Decompress.eof, the end of the last member can't be told from a truncated one.
+                    self._eof = True
+                else:
+                    raise IOError('Truncated gzip stream at compressed byte {}.'.format(self._compressed_offset))
+
+            if output:
+                self._uncompressed_offset += len(output)
+                if not self._eof:
+                    self.index.add_checkpoint(self._uncompressed_offset,
+                                              self._compressed_offset - len(self._pending), self._decompressor)
+                return output
+
+        self.index.size = self._uncompressed_offset
+        return b''
+
+    def readinto(self, b):
+        view = np.frombuffer(b, dtype=np.uint8)
+        expected = len(view)
+        total = 0
+
+        self._move_to(self._position)
+
+        while total < expected and self._uncompressed_offset == self._position + total:
+            output = self._inflate(expected - total)
+            if not output:
+                break
+            view[total:total + len(output)] = np.frombuffer(output, dtype=np.uint8)
+            total += len(output)
+
+        self._position += total
+        return total
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import logging
+import re
+import threading
+import numpy as np
+
+from collections import OrderedDict
+
+try:
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib.parse import urlsplit
+except ImportError:
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from urlparse import urlsplit
+
+__all__ = ['HTTPConnectionPool', 'HTTPRangeReader', 'DEFAULT_BLOCK_SIZE', 'DEFAULT_CACHE_SIZE']
+
+
+# Size of the aligned blocks that are requested and cached.
+DEFAULT_BLOCK_SIZE = 512 * 1024
+
+# Size cap, in bytes, of the block cache of each reader.
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+# Most blocks read ahead of a run of sequential reads.
+DEFAULT_MAX_READ_AHEAD = 16
+
+# Most blocks fetched by a single request.
+MAX_REQUEST_BLOCKS = 64
+
+# Idle keep-alive connections kept per host.
+DEFAULT_MAX_IDLE_CONNECTIONS = 4
+
+# Socket timeout, in seconds.
+DEFAULT_TIMEOUT = 60
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class HTTPConnectionPool(object):
+    """
+    Pool of idle keep-alive connections, per scheme and host, so that consecutive range requests do not each pay
+    for a new TCP (and TLS) handshake.
+
+    Parameters
+    ----------
+    max_idle : int
+        Most idle connections kept per host.  Extra connections are closed when released.
+    timeout : int
+        Socket timeout, in seconds, of new connections.
+    """
+
+    def __init__(self, max_idle=DEFAULT_MAX_IDLE_CONNECTIONS, timeout=DEFAULT_TIMEOUT):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get_connection(self, scheme, netloc):
+        """
+        Obtain an idle connection to the given host, or a new one.
+        :param scheme:  'http' or 'https'.
+        :param netloc:  The host, and optionally the port.
+        :return: tuple of (connection, reused) where reused is True for a connection that was idle in the pool.
+        """
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+
+        if scheme == 'https':
+            return HTTPSConnection(netloc, timeout=self.timeout), False
+        elif scheme == 'http':
+            return HTTPConnection(netloc, timeout=self.timeout), False
+        else:
+            raise ValueError('Unsupported URL scheme {}.'.format(scheme))
+
+    def release(self, scheme, netloc, connection):
+        """
+        Return a connection, whose last response has been read fully, to the pool.
+        """
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+
+        connection.close()
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+# Connections shared by all readers in the process.
+DEFAULT_CONNECTION_POOL = HTTPConnectionPool()
+
+
+class HTTPRangeReader(io.RawIOBase):
+    """
+    Seekable, read-only file-like view of a remote file, read through HTTP Range requests.  Pass it as the input
+    stream of a cutout so that only the header blocks and the data the cutout needs are transferred, rather than the
+    whole file.
+
+    Reads are served from an LRU cache of aligned blocks.  Missing blocks are fetched together in a single request,
+    and runs of sequential reads (such as a header scan) fetch increasingly many blocks ahead, up to
+    ``max_read_ahead``.  Requests go through a pool of keep-alive connections.
+
+    Parameters
+    ----------
+    url : str
+        The http or https URL of the file.  The server must support range requests.
+    block_size : int
+        Size of the blocks that are requested and cached.
+    cache_size : int
+        Size cap, in bytes, of the block cache.
+    max_read_ahead : int
+        Most blocks read ahead of sequential reads.
+    headers : dict
+        Extra request headers (e.g. authorization).
+    connection_pool : `HTTPConnectionPool`
+        The connections to use.  Defaults to a pool shared by the process.
+    """
+
+    def __init__(self, url, block_size=DEFAULT_BLOCK_SIZE, cache_size=DEFAULT_CACHE_SIZE,
+                 max_read_ahead=DEFAULT_MAX_READ_AHEAD, headers=None, connection_pool=DEFAULT_CONNECTION_POOL):
+        super(HTTPRangeReader, self).__init__()
+        self.logger = logging.getLogger()
+        self.name = url
+        self.block_size = block_size
+        self.max_cached_blocks = max(1, cache_size // block_size)
+        self.max_read_ahead = max_read_ahead
+        self.headers = headers or {}
+        self.connection_pool = connection_pool
+        self.request_count = 0
+        self.bytes_transferred = 0
+
+        split_url = urlsplit(url)
+        self._scheme = split_url.scheme
+        self._netloc = split_url.netloc
+        self._path = split_url.path or '/'
+        if split_url.query:
+            self._path = '{}?{}'.format(self._path, split_url.query)
+
+        self._position = 0
+        self._size = None
+        self._blocks = OrderedDict()
+        self._last_block = None
+        self._read_ahead = 0
+        self._lock = threading.RLock()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.get_size()
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('Unsupported whence value {}.'.format(whence))
+
+        if offset < 0:
+            raise IOError('Negative seek position {}.'.format(offset))
+
+        self._position = offset
+        return self._position
+
+    def get_size(self):
+        """
+        The size of the remote file, in bytes.  Known after the first request, so this fetches the first block if
+        nothing has been read yet.
+        """
+        with self._lock:
+            if self._size is None:
+                self._fetch(0, 1)
+            return self._size
+
+    def _request(self, start, end):
+        """
+        Issue a range request for bytes [start, end] on a pooled connection, retrying once on a fresh connection if
+        an idle one turns out to have been closed by the server.
+        :return: tuple of (body, total file size).
+        """
+        headers = dict(self.headers)
+        headers['Range'] = 'bytes={}-{}'.format(start, end)
+
+        while True:
+            connection, reused = self.connection_pool.get_connection(self._scheme, self._netloc)
+            try:
+                connection.request('GET', self._path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (HTTPException, IOError, OSError):
+                connection.close()
+                if reused:
+                    continue
+                else:
+                    raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.connection_pool.release(self._scheme, self._netloc, connection)
+
+            break
+
+        self.request_count += 1
+        self.bytes_transferred += len(body)
+
+        if response.status == 206:
+            content_range = CONTENT_RANGE_PATTERN.match(response.getheader('Content-Range', ''))
+            if content_range is None or int(content_range.group(1)) != start:
+                raise IOError('Unexpected Content-Range {} from {}.'.format(
+                    response.getheader('Content-Range'), self.name))
+            size = content_range.group(3)
+            return body, None if size == '*' else int(size)
+        elif response.status == 416:
+            # Past the end of the file.
+            size = response.getheader('Content-Range', '').rpartition('/')[2]
+            return b'', int(size) if size.isdigit() else start
+        elif response.status == 200:
+            raise IOError('Server at {} does not support range requests.'.format(self._netloc))
+        else:
+            raise IOError('Unable to read {} ({} {}).'.format(self.name, response.status, response.reason))
+
+    def _fetch(self, first_block, block_count):
+        """
+        Fetch consecutive blocks in one request, and cache them.  The cache may be too small to keep all of them.
+        :return: dict of block index to block, for the blocks fetched.
+        """
+        start = first_block * self.block_size
+        end = start + block_count * self.block_size - 1
+        if self._size is not None:
+            end = min(end, self._size - 1)
+
+        if end < start:
+            return {}
+
+        body, size = self._request(start, end)
+        if size is not None:
+            self._size = size
+
+        fetched = {}
+        for idx in range(block_count):
+            block = body[idx * self.block_size:(idx + 1) * self.block_size]
+            if not block:
+                break
+            # Re-inserted, to mark it as the most recently used.
+            self._blocks.pop(first_block + idx, None)
+            self._blocks[first_block + idx] = block
+            fetched[first_block + idx] = block
+
+        while len(self._blocks) > self.max_cached_blocks:
+            self._blocks.popitem(last=False)
+
+        return fetched
+
+    def _get_read_ahead(self, first_block):
+        if self._last_block is not None and first_block in (self._last_block, self._last_block + 1):
+            self._read_ahead = min(max(1, self._read_ahead * 2), self.max_read_ahead)
+        else:
+            self._read_ahead = 0
+        return self._read_ahead
+
+    def _get_block(self, block_idx, last_block, fetched):
+        """
+        Obtain a block from the cache, fetching it (and the missing blocks up to last_block, plus any read-ahead) if
+        needed.
+        :param fetched: dict of the blocks fetched so far by the current read, which it uses even once they are
+        evicted from a cache smaller than the read, and adds to.
+        """
+        block = fetched.get(block_idx)
+        if block is not None:
+            return block
+
+        block = self._blocks.get(block_idx)
+
+        if block is None:
+            run_end = block_idx + 1
+            while run_end <= last_block and run_end not in self._blocks and run_end - block_idx < MAX_REQUEST_BLOCKS:
+                run_end += 1
+
+            if run_end > last_block:
+                run_end += self._read_ahead
+
+            fetched.update(self._fetch(block_idx, run_end - block_idx))
+            block = fetched.get(block_idx)
+        else:
+            # Re-inserted, to mark it as the most recently used.
+            self._blocks[block_idx] = self._blocks.pop(block_idx)
+
+        return block
+
+    def readinto(self, b):
+        view = np.frombuffer(b, dtype=np.uint8)
+
+        with self._lock:
+            start = self._position
+            end = start + len(view)
+            if self._size is not None:
+                end = min(end, self._size)
+
+            if end <= start:
+                return 0
+
+            first_block = start // self.block_size
+            last_block = (end - 1) // self.block_size
+            self._get_read_ahead(first_block)
+
+            total = 0
+            fetched = {}
+            for block_idx in range(first_block, last_block + 1):
+                block = self._get_block(block_idx, last_block, fetched)
+                if not block:
+                    break
+
+                block_start = block_idx * self.block_size
+                block_offset = start + total - block_start
+                count = min(len(block) - block_offset, end - start - total)
+                if count <= 0:
+                    break
+                view[total:total + count] = np.frombuffer(block, dtype=np.uint8, count=count, offset=block_offset)
+                total += count
+
+            self._last_block = last_block
+            self._position += total
+            return total
@@ -78,8 +78,10 @@ __all__ = ['PixelCutoutHDU']
 def fix_tuple(t):
     if np.isscalar(t):
         return (t, t)
-    elif len(t) < 2:
+    elif len(t) < 2 or len(t) > 3:
         raise ValueError('Unusable dimension range {}'.format(t))
+    elif len(t) == 3 and (not is_integer(t[2]) or int(t[2]) < 1):
+        raise ValueError('Unusable step in dimension range {}'.format(t))
     else:
         return t
 
@@ -88,7 +90,8 @@ class PixelCutoutHDU(object):
     def __init__(self, dimension_ranges=[], extension='0'):
         """
         A Pixel cutout.
-        :param dimension_ranges: list    Dimension ranges expressed as tuples (i.e. (lower,upper)).
+        :param dimension_ranges: list    Dimension ranges expressed as tuples (i.e. (lower,upper)), or
+            (lower,upper,step) to keep only every step-th pixel.
         :param extension: tuple, int, string
             The Extension specification to use.  If tuple, use (str, int) to get the nth count of the EXTNAME=str
             extension.  If string, use the first extension with EXTNAME=string, or use int to get the extension[int].
@@ -110,6 +113,18 @@ class PixelCutoutHDU(object):
 
         return tuple(acc)
 
+    def get_steps(self):
+        """
+        Obtain the step of each range, which is 1 unless one was given.
+        """
+        return tuple(int(range_tuple[2]) if len(range_tuple) == 3 else 1 for range_tuple in self.dimension_ranges)
+
+    def has_steps(self):
+        """
+        Whether any of the ranges keeps only every step-th pixel.
+        """
+        return any(step != 1 for step in self.get_steps())
+
     def get_shape(self):
         """
         Convert the given dimensions to a shape.
@@ -109,12 +109,20 @@ class PixelRangeInputParser(object):
         if self.delimiter not in rs:
             return (to_num(rs), to_num(rs))  # Turns 7 into 7:7
         else:
-            start, end = rs.split(self.delimiter)
+            values = rs.split(self.delimiter)
 
-            if not start or not end:
+            if len(values) > 3 or not all(values):
                 raise PixelRangeInputParserError(
                     'Incomplete range specified {}'.format(rs))
+            elif len(values) == 3:
+                # Decimated range start:end:step, as in cfitsio.
+                start, end, step = values
+                if not step.isdigit() or int(step) < 1:
+                    raise PixelRangeInputParserError(
+                        'Step must be a positive integer in range {}'.format(rs))
+                return (to_num(start), to_num(end), int(step))
             else:
+                start, end = values
                 return (to_num(start), to_num(end))
 
     def parse(self, pixel_range_input_str):
@@ -134,6 +142,9 @@ class PixelRangeInputParser(object):
         rp.parse('[SCI][99:112][5]')
         => [PixelCutoutHDU((99,112), extension=SCI),PixelCutoutHDU(extension='5')]
 
+        rp.parse('[1:4000:4,1:4000:4]')
+        => [PixelCutoutHDU((1,4000,4),(1,4000,4), extension='0')]
+
         rp.parse('[IMG,2][100:112][6][300:600]')
         => [PixelCutoutHDU((100,112), extension='IMG,2'),PixelCutoutHDU((300,600), extension='6')]
         """
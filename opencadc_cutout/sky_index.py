@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import hashlib
+import json
+import logging
+import math
+import os
+import tempfile
+
+from opencadc_cutout.core import OpenCADCCutout
+from opencadc_cutout.file_helpers.fits.fits_file_helper import FITSHelper
+from opencadc_cutout.no_content_error import NoContentError
+from opencadc_cutout.sky_region import get_separation
+from opencadc_cutout.sky_region_parser import SkyRegionParser
+from opencadc_cutout.utils import get_file_identity
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+__all__ = ['SkyIndex', 'DEFAULT_CELL_SIZE']
+
+
+# In degrees.  Best around the size of the footprint of one file.
+DEFAULT_CELL_SIZE = 1.0
+FITS_FILE_SUFFIXES = ('.fits', '.fit', '.fts', '.fits.gz', '.fits.fz', '.fz')
+INDEX_VERSION = 1
+
+
+def _get_cells(ra, dec, radius, cell_size):
+    """
+    Find the cells of a grid, in declination bands and right ascension columns, touched by a circle on the sky.
+    :return: set of (dec band, ra column) tuples.
+    """
+    dec_bands = int(math.ceil(180.0 / cell_size))
+    ra_columns = int(math.ceil(360.0 / cell_size))
+    first_band = max(0, int(math.floor((dec - radius + 90.0) / cell_size)))
+    last_band = min(dec_bands - 1, int(math.floor((dec + radius + 90.0) / cell_size)))
+
+    if abs(dec) + radius >= 90.0:
+        # Around a pole, so all right ascensions.
+        columns = range(ra_columns)
+    else:
+        # The exact half width, in right ascension, of a circle.
+        half_width = math.degrees(math.asin(math.sin(math.radians(radius)) / math.cos(math.radians(dec))))
+        first_column = int(math.floor((ra - half_width) / cell_size))
+        last_column = int(math.floor((ra + half_width) / cell_size))
+        if last_column - first_column + 1 >= ra_columns:
+            columns = range(ra_columns)
+        else:
+            columns = [column % ra_columns for column in range(first_column, last_column + 1)]
+
+    return set((band, column) for band in range(first_band, last_band + 1) for column in columns)
+
+
+class SkyIndex(object):
+    """
+    Index of the sky footprints of the image HDUs in a collection of FITS files (e.g. the tiles of a survey), to
+    find the files and extensions a region overlaps without opening any of them.  Each footprint is kept as the circle
+    enclosing it, bucketed in the cells of a grid of declination bands and right ascension columns, so a query only
+    checks the footprints in the cells the region touches.
+
+    Files are indexed from their headers only, and are identified by their path, size and modification time, so that
+    scanning a directory again only reads the files that changed.  The index is saved to, and loaded from, a JSON file.
+
+    Parameters
+    ----------
+    cell_size : float
+        The size, in degrees, of the cells of the grid.
+
+    Example
+    -------
+    sky_index = SkyIndex()
+    sky_index.scan('/path/to/tiles')
+    sky_index.save('/path/to/tiles.skyidx')
+
+    sky_index = SkyIndex.load('/path/to/tiles.skyidx')
+    sky_index.query(CircleRegion(210.8, 54.35, 0.05))
+    => [('/path/to/tiles/tile_1.fits', [0])]
+
+    sky_index.cutout('CIRCLE 210.8 54.35 0.05', '/path/to/output', max_workers=4)
+    => [('/path/to/tiles/tile_1.fits', '/path/to/output/tile_1_cutout.fits')]
+    """
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.logger = logging.getLogger()
+        self.cell_size = float(cell_size)
+        # Path to the identity and footprints of each file.
+        self._files = {}
+        # Cell to the (path, extension index, ra, dec, radius) footprints touching it.
+        self._cells = {}
+
+    def __len__(self):
+        return len(self._files)
+
+    def _add_cells(self, path, footprints):
+        for extension, ra, dec, radius in footprints:
+            for cell in _get_cells(ra, dec, radius, self.cell_size):
+                self._cells.setdefault(cell, []).append((path, extension, ra, dec, radius))
+
+    def remove_file(self, path):
+        """
+        Drop a file from the index.
+        :param path: The path of the file, as it was indexed.
+        """
+        if self._files.pop(path, None) is not None:
+            for cell in list(self._cells):
+                footprints = [footprint for footprint in self._cells[cell] if footprint[0] != path]
+                if footprints:
+                    self._cells[cell] = footprints
+                else:
+                    del self._cells[cell]
+
+    def add_file(self, path):
+        """
+        Index the footprints of a file, unless it's already indexed and unchanged.
+        :param path: The path of the FITS file.
+        :return: True if the file was read.
+        """
+        with open(path, 'rb') as input_stream:
+            identity = get_file_identity(input_stream)
+            indexed = self._files.get(path)
+
+            if indexed is not None and indexed['identity'] == identity:
+                return False
+
+            footprints = FITSHelper(input_stream, None).get_footprints()
+
+        self.remove_file(path)
+        self._files[path] = {'identity': identity, 'footprints': footprints}
+        self._add_cells(path, footprints)
+        self.logger.debug('Indexed {} footprints of {}.'.format(len(footprints), path))
+        return True
+
+    def scan(self, directory, suffixes=FITS_FILE_SUFFIXES):
+        """
+        Index every FITS file under a directory.  Files already indexed are only read again if they changed, and
+        files that are gone are dropped.
+        :param directory: The directory to walk.
+        :param suffixes: The file name suffixes of the files to index.
+        :return: The number of files read.
+        """
+        directory = os.path.abspath(directory)
+        found = set()
+        read_count = 0
+
+        for dir_path, _, file_names in os.walk(directory):
+            for file_name in sorted(file_names):
+                if file_name.lower().endswith(suffixes):
+                    path = os.path.join(dir_path, file_name)
+                    found.add(path)
+                    try:
+                        if self.add_file(path):
+                            read_count += 1
+                    except (IOError, OSError, ValueError) as err:
+                        self.logger.warn('Unable to index {} ({}).'.format(path, err))
+
+        for path in list(self._files):
+            if path.startswith(directory + os.sep) and path not in found:
+                self.remove_file(path)
+
+        return read_count
+
+    def query(self, sky_region):
+        """
+        Find the files and extensions whose footprints a region overlaps.  Footprints are enclosing circles, so a file
+        may be returned that the region only just misses.
+        :param sky_region: `.sky_region.CircleRegion` or `.sky_region.PolygonRegion` instance.
+        :return: list of (path, list of extension indexes) tuples, in path order.
+        """
+        ra, dec, radius = sky_region.get_bounding_circle()
+        matches = {}
+
+        for cell in _get_cells(ra, dec, radius, self.cell_size):
+            for path, extension, footprint_ra, footprint_dec, footprint_radius in self._cells.get(cell, []):
+                if get_separation(ra, dec, footprint_ra, footprint_dec) <= radius + footprint_radius:
+                    matches.setdefault(path, set()).add(extension)
+
+        return [(path, sorted(matches[path])) for path in sorted(matches)]
+
+    def _get_output_path(self, path, output_dir):
+        file_name = os.path.basename(path)
+        stem = file_name
+        for suffix in FITS_FILE_SUFFIXES:
+            if stem.lower().endswith(suffix):
+                stem = stem[:-len(suffix)]
+                break
+
+        if sum(1 for other_path in self._files if os.path.basename(other_path) == file_name) > 1:
+            # Files of the same name in different directories get different outputs.
+            stem = '{}_{}'.format(stem, hashlib.sha1(os.path.dirname(path).encode('utf-8')).hexdigest()[:8])
+
+        return os.path.join(output_dir, '{}_cutout.fits'.format(stem))
+
+    def _cutout_file(self, cutout, path, output_path, cutout_dimensions_str, **kwargs):
+        try:
+            with open(path, 'rb') as input_stream, open(output_path, 'wb') as output_stream:
+                cutout.cutout(input_stream, output_stream, cutout_dimensions_str, 'FITS', **kwargs)
+            return output_path
+        except NoContentError:
+            # The region falls between the enclosing circle of the footprint and the footprint itself.
+            self.logger.debug('No content in {}.'.format(path))
+            os.remove(output_path)
+            return None
+
+    def cutout(self, cutout_dimensions_str, output_dir, max_workers=1, **kwargs):
+        """
+        Cut out a region from every indexed file it overlaps, each to its own file in the output directory.
+        :param cutout_dimensions_str: The SODA sky region (and/or spectral band) to cut out, as for
+        `OpenCADCCutout.cutout`.  A band on its own applies to every file.
+        :param output_dir: The directory to write the cutouts to.
+        :param max_workers: The number of files to cut out from in parallel.
+        :param kwargs: Options passed through to the file helper (e.g. read_gap_threshold).
+        :return: list of (input path, output path) tuples, in input path order, for the files with content.
+        """
+        sky_cutout = SkyRegionParser().parse_cutout(cutout_dimensions_str)
+
+        if sky_cutout.region is None:
+            paths = sorted(self._files)
+        else:
+            paths = [path for path, _ in self.query(sky_cutout.region)]
+
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+        cutout = OpenCADCCutout()
+        output_paths = [self._get_output_path(path, output_dir) for path in paths]
+
+        if max_workers > 1 and ThreadPoolExecutor is not None and len(paths) > 1:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                futures = [executor.submit(self._cutout_file, cutout, path, output_path, cutout_dimensions_str,
+                                           **kwargs) for path, output_path in zip(paths, output_paths)]
+                results = [future.result() for future in futures]
+            finally:
+                executor.shutdown(wait=True)
+        else:
+            results = [self._cutout_file(cutout, path, output_path, cutout_dimensions_str, **kwargs)
+                       for path, output_path in zip(paths, output_paths)]
+
+        return [(path, result) for path, result in zip(paths, results) if result is not None]
+
+    def mosaic(self, cutout_dimensions_str, output_writer, **kwargs):
+        """
+        Cut out a region from every indexed file it overlaps, and assemble the pieces into one image, on the pixel grid
+        of the first file (in path order).  The files must share a projection (see `OpenCADCCutout.mosaic`).
+        :param cutout_dimensions_str: The SODA sky region (and/or spectral band) to cut out.
+        :param output_writer: File-like object to write the mosaic to.
+        :param kwargs: Options passed through to the file helper (e.g. read_gap_threshold).
+        :return: The number of pieces in the mosaic.
+        """
+        sky_cutout = SkyRegionParser().parse_cutout(cutout_dimensions_str)
+
+        if sky_cutout.region is None:
+            raise ValueError('A mosaic needs a sky region, not only a band.')
+
+        paths = [path for path, _ in self.query(sky_cutout.region)]
+
+        if not paths:
+            raise NoContentError('No content ({} does not overlap).'.format(sky_cutout))
+
+        input_readers = [open(path, 'rb') for path in paths]
+
+        try:
+            return OpenCADCCutout().mosaic(input_readers, output_writer, cutout_dimensions_str, 'FITS', **kwargs)
+        finally:
+            for input_reader in input_readers:
+                input_reader.close()
+
+    def save(self, index_path):
+        """
+        Write the index to a JSON file.  The file is replaced atomically, so concurrent readers never see a partial
+        index.
+        :param index_path: The path of the file.
+        """
+        index_dir = os.path.dirname(os.path.abspath(index_path))
+        fd, tmp_path = tempfile.mkstemp(dir=index_dir, suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'w') as index_file:
+                json.dump({'version': INDEX_VERSION, 'cell_size': self.cell_size,
+                           'files': [{'path': path, 'identity': indexed['identity'],
+                                      'footprints': [list(footprint) for footprint in indexed['footprints']]}
+                                     for path, indexed in sorted(self._files.items())]}, index_file)
+            os.rename(tmp_path, index_path)
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def load(index_path):
+        """
+        Read an index written by save().
+        :param index_path: The path of the file.
+        :return: SkyIndex instance.
+        """
+        with open(index_path, 'r') as index_file:
+            content = json.load(index_file)
+
+        if content.get('version') != INDEX_VERSION:
+            raise ValueError('Unsupported sky index version {} in {}.'.format(content.get('version'), index_path))
+
+        sky_index = SkyIndex(cell_size=content['cell_size'])
+
+        for indexed in content['files']:
+            footprints = [tuple(footprint) for footprint in indexed['footprints']]
+            sky_index._files[indexed['path']] = {'identity': indexed['identity'], 'footprints': footprints}
+            sky_index._add_cells(indexed['path'], footprints)
+
+        return sky_index
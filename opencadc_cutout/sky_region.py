@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+
+__all__ = ['CircleRegion', 'PolygonRegion', 'SpectralBand', 'SkyCutout', 'get_separation']
+
+
+# Number of points sampled along the boundary of a circle, and along each edge of a polygon.
+CIRCLE_BOUNDARY_SAMPLES = 64
+POLYGON_EDGE_SAMPLES = 16
+
+# In metres per second, to convert frequencies to wavelengths.
+SPEED_OF_LIGHT = 299792458.0
+
+
+def _to_vectors(ra, dec):
+    """
+    Convert positions, in degrees, to unit vectors (one row per position).
+    """
+    ra = np.radians(np.asarray(ra, dtype=float))
+    dec = np.radians(np.asarray(dec, dtype=float))
+    cos_dec = np.cos(dec)
+    return np.column_stack((cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)))
+
+
+def _to_ra_dec(vectors):
+    """
+    Convert vectors (one row per position, not necessarily of unit length) to positions in degrees.
+    """
+    vectors = vectors / np.linalg.norm(vectors, axis=1)[:, np.newaxis]
+    ra = np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0])) % 360.0
+    dec = np.degrees(np.arcsin(np.clip(vectors[:, 2], -1.0, 1.0)))
+    return ra, dec
+
+
+def get_separation(ra1, dec1, ra2, dec2):
+    """
+    Angular separation between positions, in degrees.  Vectorized over any of the arguments.
+    """
+    ra1, dec1, ra2, dec2 = [np.radians(np.asarray(x, dtype=float)) for x in (ra1, dec1, ra2, dec2)]
+    # Vincenty's formula, which is accurate at all separations.
+    delta_ra = ra2 - ra1
+    num1 = np.cos(dec2) * np.sin(delta_ra)
+    num2 = np.cos(dec1) * np.sin(dec2) - np.sin(dec1) * np.cos(dec2) * np.cos(delta_ra)
+    denominator = np.sin(dec1) * np.sin(dec2) + np.cos(dec1) * np.cos(dec2) * np.cos(delta_ra)
+    return np.degrees(np.arctan2(np.hypot(num1, num2), denominator))
+
+
+class CircleRegion(object):
+    """
+    A circle on the sky, as given by a SODA CIRCLE.
+
+    Parameters
+    ----------
+    ra : float
+        Right ascension of the centre, in degrees.
+    dec : float
+        Declination of the centre, in degrees.
+    radius : float
+        Radius, in degrees.
+    """
+
+    def __init__(self, ra, dec, radius):
+        self.ra = float(ra)
+        self.dec = float(dec)
+        self.radius = float(radius)
+
+    def get_bounding_circle(self):
+        """
+        :return: (ra, dec, radius) of a circle enclosing the region, in degrees.
+        """
+        return self.ra, self.dec, self.radius
+
+    def get_boundary(self):
+        """
+        Sample the boundary of the region.
+        :return: (ra, dec) arrays, in degrees.
+        """
+        position_angle = np.linspace(0.0, 2.0 * np.pi, CIRCLE_BOUNDARY_SAMPLES, endpoint=False)
+        dec = np.radians(self.dec)
+        radius = np.radians(self.radius)
+
+        boundary_dec = np.arcsin(np.clip(np.sin(dec) * np.cos(radius)
+                                         + np.cos(dec) * np.sin(radius) * np.cos(position_angle), -1.0, 1.0))
+        boundary_ra = np.radians(self.ra) + np.arctan2(np.sin(position_angle) * np.sin(radius) * np.cos(dec),
+                                                       np.cos(radius) - np.sin(dec) * np.sin(boundary_dec))
+        return np.degrees(boundary_ra) % 360.0, np.degrees(boundary_dec)
+
+    def __repr__(self):
+        return 'CircleRegion(ra={}, dec={}, radius={})'.format(self.ra, self.dec, self.radius)
+
+
+class PolygonRegion(object):
+    """
+    A polygon on the sky, as given by a SODA POLYGON, with great circle edges.
+
+    Parameters
+    ----------
+    vertices : list of (ra, dec) tuples
+        The vertices, in degrees.  At least three are needed.
+    """
+
+    def __init__(self, vertices):
+        vertices = np.asarray(vertices, dtype=float)
+        if vertices.ndim != 2 or vertices.shape[1] != 2 or len(vertices) < 3:
+            raise ValueError('A polygon needs at least three (ra, dec) vertices.')
+
+        self.ra = vertices[:, 0]
+        self.dec = vertices[:, 1]
+
+    def get_bounding_circle(self):
+        """
+        :return: (ra, dec, radius) of a circle enclosing the region, in degrees.
+        """
+        ra, dec = _to_ra_dec(_to_vectors(self.ra, self.dec).sum(axis=0)[np.newaxis, :])
+        radius = get_separation(ra[0], dec[0], self.ra, self.dec).max()
+        return float(ra[0]), float(dec[0]), float(radius)
+
+    def get_boundary(self):
+        """
+        Sample the edges of the region.
+        :return: (ra, dec) arrays, in degrees.
+        """
+        start = _to_vectors(self.ra, self.dec)
+        end = np.roll(start, -1, axis=0)
+        # Interpolating between unit vectors, and normalizing, follows the great circle between them.
+        fraction = np.linspace(0.0, 1.0, POLYGON_EDGE_SAMPLES, endpoint=False)[:, np.newaxis, np.newaxis]
+        samples = start + fraction * (end - start)
+        return _to_ra_dec(samples.reshape(-1, 3))
+
+    def __repr__(self):
+        return 'PolygonRegion(vertices={})'.format(list(zip(self.ra.tolist(), self.dec.tolist())))
+
+
+class SpectralBand(object):
+    """
+    An interval of the spectrum, as given by a SODA BAND.
+
+    Parameters
+    ----------
+    lower : float
+        One end of the interval, as a (vacuum) wavelength in metres.
+    upper : float
+        The other end of the interval, as a wavelength in metres.
+    """
+
+    def __init__(self, lower, upper):
+        self.lower = float(min(lower, upper))
+        self.upper = float(max(lower, upper))
+
+    @staticmethod
+    def from_frequencies(lower, upper):
+        """
+        Build a band from an interval of frequencies, in Hz.
+        """
+        return SpectralBand(SPEED_OF_LIGHT / float(upper), SPEED_OF_LIGHT / float(lower))
+
+    def __repr__(self):
+        return 'SpectralBand(lower={}, upper={})'.format(self.lower, self.upper)
+
+
+class SkyCutout(object):
+    """
+    A cutout given in world coordinates: a region of the sky, a spectral band, or both.
+
+    Parameters
+    ----------
+    region : `CircleRegion`, `PolygonRegion` or `None`
+        The region of the sky to cut out, or None for all of it.
+    band : `SpectralBand` or `None`
+        The spectral band to cut out, or None for all of it.
+    """
+
+    def __init__(self, region=None, band=None):
+        self.region = region
+        self.band = band
+
+    def __repr__(self):
+        return 'SkyCutout(region={}, band={})'.format(self.region, self.band)
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import logging
+
+from .sky_region import CircleRegion, PolygonRegion, SpectralBand, SkyCutout
+
+__all__ = ['SkyRegionParserError', 'SkyRegionParser']
+
+
+CIRCLE_SHAPE = 'CIRCLE'
+POLYGON_SHAPE = 'POLYGON'
+BAND_SHAPE = 'BAND'
+SHAPES = (CIRCLE_SHAPE, POLYGON_SHAPE, BAND_SHAPE)
+
+# Units a BAND may be given in.  Wavelengths in metres are the default, as in SODA.
+WAVELENGTH_UNIT = 'M'
+FREQUENCY_UNIT = 'HZ'
+
+
+class SkyRegionParserError(ValueError):
+    pass
+
+
+class SkyRegionParser(object):
+    """
+    Parse a region on the sky, or a spectral band, as given in a SODA (IVOA Server-side Operations for Data Access)
+    request.  Positions and sizes are in ICRS degrees, and bands are wavelengths in metres, unless followed by Hz for
+    frequencies.
+
+    Example:
+
+    rp = SkyRegionParser()
+    rp.parse('CIRCLE 12.0 34.0 0.5')
+    => CircleRegion(ra=12.0, dec=34.0, radius=0.5)
+
+    rp.parse('POLYGON 12.0 34.0 14.0 35.0 12.5 36.0')
+    => PolygonRegion(vertices=[(12.0, 34.0), (14.0, 35.0), (12.5, 36.0)])
+
+    rp.parse('BAND 1.42e9 1.43e9 Hz')
+    => SpectralBand(lower=0.20964507552447553, upper=0.21112144929577464)
+
+    rp.parse_cutout('CIRCLE 12.0 34.0 0.5 BAND 0.211 0.212')
+    => SkyCutout(region=CircleRegion(ra=12.0, dec=34.0, radius=0.5), band=SpectralBand(lower=0.211, upper=0.212))
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger()
+
+    def _split(self, region_str):
+        # Accept the SODA parameter form too (i.e. CIRCLE=12.0 34.0 0.5).
+        items = region_str.replace('=', ' ').split()
+        return items[0].upper() if items else None, items[1:]
+
+    def is_sky_region(self, input_str):
+        if not input_str:
+            return False
+        else:
+            shape, _ = self._split(input_str)
+            return shape in SHAPES
+
+    def _to_values(self, items, region_str):
+        try:
+            return [float(x) for x in items]
+        except ValueError:
+            raise SkyRegionParserError('Non-numeric value in region "{}".'.format(region_str))
+
+    def _check_dec(self, dec, region_str):
+        if not -90.0 <= dec <= 90.0:
+            raise SkyRegionParserError('Declination {} out of range in region "{}".'.format(dec, region_str))
+
+    def parse(self, region_str):
+        """
+        Parse a region string.
+        :param region_str: The string to parse.
+        :return: `.sky_region.CircleRegion`, `.sky_region.PolygonRegion` or `.sky_region.SpectralBand` instance.
+        """
+        region_str = region_str.strip()
+        shape, items = self._split(region_str)
+        unit = items.pop().upper() if shape == BAND_SHAPE and items and items[-1].upper() in (
+            WAVELENGTH_UNIT, FREQUENCY_UNIT) else WAVELENGTH_UNIT
+        values = self._to_values(items, region_str)
+
+        if shape == CIRCLE_SHAPE:
+            if len(values) != 3:
+                raise SkyRegionParserError('A CIRCLE needs a centre and a radius, got "{}".'.format(region_str))
+            elif values[2] <= 0.0 or values[2] > 180.0:
+                raise SkyRegionParserError('Unusable radius in region "{}".'.format(region_str))
+
+            self._check_dec(values[1], region_str)
+            return CircleRegion(values[0], values[1], values[2])
+        elif shape == POLYGON_SHAPE:
+            if len(values) < 6 or len(values) % 2 != 0:
+                raise SkyRegionParserError('A POLYGON needs at least three vertices, got "{}".'.format(region_str))
+
+            vertices = list(zip(values[0::2], values[1::2]))
+            for _, dec in vertices:
+                self._check_dec(dec, region_str)
+            return PolygonRegion(vertices)
+        elif shape == BAND_SHAPE:
+            if len(values) != 2:
+                raise SkyRegionParserError('A BAND needs two values, got "{}".'.format(region_str))
+            elif min(values) <= 0.0:
+                raise SkyRegionParserError('Unusable interval in band "{}".'.format(region_str))
+
+            if unit == FREQUENCY_UNIT:
+                return SpectralBand.from_frequencies(values[0], values[1])
+            else:
+                return SpectralBand(values[0], values[1])
+        else:
+            raise SkyRegionParserError('Not a valid sky region "{}".  Should be one of {}.'.format(
+                region_str, ', '.join(SHAPES)))
+
+    def parse_cutout(self, cutout_str):
+        """
+        Parse a cutout of a sky region, a spectral band, or both.
+        :param cutout_str: The string to parse, with each shape followed by its values.
+        :return: `.sky_region.SkyCutout` instance.
+        """
+        parts = []
+
+        for item in cutout_str.replace('=', ' ').split():
+            if item.upper() in SHAPES:
+                parts.append([item])
+            elif parts:
+                parts[-1].append(item)
+            else:
+                raise SkyRegionParserError('Not a valid sky region "{}".  Should start with one of {}.'.format(
+                    cutout_str, ', '.join(SHAPES)))
+
+        sky_cutout = SkyCutout()
+
+        for part in parts:
+            parsed = self.parse(' '.join(part))
+            attribute = 'band' if isinstance(parsed, SpectralBand) else 'region'
+
+            if getattr(sky_cutout, attribute) is not None:
+                raise SkyRegionParserError('More than one {} given in "{}".'.format(attribute, cutout_str))
+
+            setattr(sky_cutout, attribute, parsed)
+
+        if sky_cutout.region is None and sky_cutout.band is None:
+            raise SkyRegionParserError('Not a valid sky region "{}".'.format(cutout_str))
+
+        return sky_cutout
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import numpy as np
+import os
+import pytest
+import context as test_context
+
+from astropy.io import fits
+
+from opencadc_cutout.cutoutnd import CutoutND
+from opencadc_cutout.file_helpers.fits.byte_range_reader import ByteRangeReader
+from opencadc_cutout.file_helpers.fits.read_planner import ReadPlanner
+from opencadc_cutout.pixel_cutout_hdu import PixelCutoutHDU
+
+
+pytest.main(args=['-s', os.path.abspath(__file__)])
+
+
+def _create_cube_file(data):
+    cube_file = test_context.random_test_file_name_path()
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data=data)]).writeto(cube_file, overwrite=True)
+    return cube_file
+
+
+def _open_reader(input_stream, file_name):
+    with fits.open(file_name, mode='readonly', do_not_scale_image_data=True) as hdu_list:
+        hdu = hdu_list[1]
+        header = hdu.header
+        naxis = [header['NAXIS{}'.format(i)] for i in range(1, header['NAXIS'] + 1)]
+        return ByteRangeReader(input_stream, hdu.fileinfo()['datLoc'], header['BITPIX'], naxis)
+
+
+def test_shape():
+    data = np.arange(2 * 1 * 5 * 7, dtype=np.int16).reshape(2, 1, 5, 7)
+    cube_file = _create_cube_file(data)
+
+    with open(cube_file, 'rb') as input_reader:
+        test_subject = _open_reader(input_reader, cube_file)
+        assert test_subject.shape == (2, 1, 5, 7), 'Wrong shape.'
+        assert test_subject.dtype == np.dtype('>i2'), 'Wrong dtype.'
+        assert np.squeeze(test_subject).shape == (2, 5, 7), 'Wrong squeezed shape.'
+
+
+def test_get_spans():
+    data = np.arange(3 * 4 * 5, dtype=np.int32).reshape(3, 4, 5)
+    cube_file = _create_cube_file(data)
+
+    with open(cube_file, 'rb') as input_reader:
+        test_subject = _open_reader(input_reader, cube_file)
+        offsets, length = test_subject.get_spans((slice(1, 3), slice(2, 4), slice(1, 4)))
+        base = test_subject.data_offset
+        expected = [base + ((z * 20) + (y * 5) + 1) * 4 for z in (1, 2) for y in (2, 3)]
+        np.testing.assert_array_equal(offsets, expected, 'Wrong offsets.')
+        assert length == 12, 'Wrong length.'
+
+        # Only every other plane and third row, with rows spanning the first to the last pixel selected.
+        offsets, length = test_subject.get_spans((slice(0, 3, 2), slice(0, 4, 3), slice(0, 5, 2)))
+        expected = [base + ((z * 20) + (y * 5)) * 4 for z in (0, 2) for y in (0, 3)]
+        np.testing.assert_array_equal(offsets, expected, 'Wrong stepped offsets.')
+        assert length == 20, 'Wrong stepped length.'
+
+
+def test_getitem():
+    data = np.arange(4 * 1 * 30 * 20, dtype=np.float32).reshape(4, 1, 30, 20)
+    cube_file = _create_cube_file(data)
+    squeezed = np.squeeze(data)
+
+    with open(cube_file, 'rb') as input_reader:
+        test_subject = np.squeeze(_open_reader(input_reader, cube_file))
+
+        np.testing.assert_array_equal(test_subject[...], squeezed, 'Whole array does not match.')
+
+        slices = (slice(1, 3), slice(5, 17), slice(0, 9))
+        np.testing.assert_array_equal(test_subject[slices], squeezed[slices], 'Sub array does not match.')
+
+        slices = (slice(2, 3), slice(29, 30))
+        np.testing.assert_array_equal(test_subject[slices], squeezed[slices], 'Partial key does not match.')
+
+        slices = (slice(0, 4, 2), slice(1, 30, 4), slice(2, 19, 3))
+        np.testing.assert_array_equal(test_subject[slices], squeezed[slices], 'Stepped sub array does not match.')
+
+        with pytest.raises(IndexError):
+            test_subject[(slice(3, 0, -1),)]
+
+    # Streams without a file descriptor are read with seek/readinto.
+    with open(cube_file, 'rb') as input_reader:
+        input_stream = io.BytesIO(input_reader.read())
+
+    test_subject = np.squeeze(_open_reader(input_stream, cube_file))
+    slices = (slice(0, 4), slice(10, 12), slice(3, 19))
+    np.testing.assert_array_equal(test_subject[slices], squeezed[slices], 'BytesIO sub array does not match.')
+
+
+def test_read_into():
+    data = np.arange(4 * 1 * 30 * 20, dtype=np.float32).reshape(4, 1, 30, 20)
+    cube_file = _create_cube_file(data)
+    squeezed = np.squeeze(data)
+
+    with open(cube_file, 'rb') as input_reader:
+        test_subject = np.squeeze(_open_reader(input_reader, cube_file))
+        output = np.full((3, 15, 12), np.nan, dtype=test_subject.dtype)
+        expected = np.full((3, 15, 12), np.nan, dtype=test_subject.dtype)
+        slices = (slice(2, 4), slice(20, 30), slice(0, 9))
+        output_slices = (slice(1, 3), slice(0, 10), slice(3, 12))
+        test_subject.read_into(slices, output, output_slices)
+        expected[output_slices] = squeezed[slices]
+        np.testing.assert_array_equal(output, expected, 'Should read into place.')
+
+        with pytest.raises(ValueError):
+            test_subject.read_into(slices, np.zeros((3, 15, 12), dtype=np.float64), output_slices)
+
+
+def test_cutoutnd():
+    data = np.arange(200 * 100, dtype=np.int32).reshape(200, 100)
+    cube_file = _create_cube_file(data)
+    cutout_region = PixelCutoutHDU([(20, 35), (40, 50)])
+
+    with open(cube_file, 'rb') as input_reader:
+        test_subject = _open_reader(input_reader, cube_file)
+        expected = CutoutND(data=data).extract(cutout_region)
+        result = CutoutND(data=test_subject).extract(cutout_region)
+        np.testing.assert_array_equal(result.data, expected.data, 'Cutouts do not match.')
+
+
+def test_read_planner():
+    data = np.arange(10 * 50 * 40, dtype=np.int16).reshape(10, 50, 40)
+    cube_file = _create_cube_file(data)
+    slices = (slice(2, 7), slice(3, 30), slice(10, 20))
+
+    for gap_threshold in (0, 1024, 1024 * 1024):
+        with open(cube_file, 'rb') as input_reader:
+            test_subject = _open_reader(input_reader, cube_file)
+            test_subject.read_planner = ReadPlanner(gap_threshold=gap_threshold)
+            np.testing.assert_array_equal(test_subject[slices], data[slices], 'Sub array does not match.')
+            assert test_subject.read_planner.bytes_used == 5 * 27 * 10 * 2, 'Wrong bytes used.'
+            assert test_subject.read_planner.bytes_read >= test_subject.read_planner.bytes_used, \
+                'Wrong bytes read.'
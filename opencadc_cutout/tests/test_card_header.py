@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import pytest
+
+from astropy.io import fits
+
+from opencadc_cutout.file_helpers.fits.card_header import CardHeader, format_card
+
+
+pytest.main(args=['-s', os.path.abspath(__file__)])
+
+
+def _create_header():
+    header = fits.Header()
+    header['OBJECT'] = ('M31', 'the target')
+    header['CRPIX1'] = 10.5
+    header['CD1_1'] = -0.0001
+    header['DQ1'] = 1
+    header['DQ1'] = 2
+    header.append(('DQ1', 3))
+    for idx in range(3):
+        header['HISTORY'] = 'step {}'.format(idx)
+    return header
+
+
+def test_edit():
+    raw_header = _create_header().tostring()
+    test_subject = CardHeader(raw_header.encode('ascii'))
+
+    assert len(test_subject) == 8, 'Wrong card count.'
+    assert 'object' in test_subject, 'Keywords should be case insensitive.'
+    assert test_subject['OBJECT'] == 'M31', 'Wrong value.'
+    assert test_subject.get('CRPIX1 ') == 10.5, 'Wrong value.'
+    assert test_subject.get('CRPIX2') is None, 'Should default to None.'
+    with pytest.raises(KeyError):
+        test_subject['CRPIX2']
+
+    header_copy = test_subject.copy()
+    test_subject.set('OBJECT', 'M33')
+    test_subject.set('CRPIX2', 20)
+    test_subject.insert(0, ('WCSAXES', 2))
+    test_subject.remove('DQ1', remove_all=True)
+    test_subject.remove('DQ2', ignore_missing=True)
+    with pytest.raises(KeyError):
+        test_subject.remove('DQ2')
+
+    assert header_copy['OBJECT'] == 'M31', 'Copies should not be modified.'
+    assert test_subject.keywords() == ['WCSAXES', 'OBJECT', 'CRPIX1', 'CD1_1', 'CRPIX2', 'HISTORY', 'HISTORY',
+                                       'HISTORY'], 'New cards should go ahead of the commentary cards.'
+
+    result = test_subject.to_header()
+    assert result['OBJECT'] == 'M33', 'Wrong value.'
+    assert result.comments['OBJECT'] == 'the target', 'Should keep the comment.'
+    assert result['CRPIX2'] == 20, 'Wrong value.'
+
+    # Untouched cards are written out as they were read.
+    result_str = test_subject.tostring()
+    assert len(result_str) % 2880 == 0, 'Should be padded to whole blocks.'
+    assert raw_header[80:160] in result_str, 'Should keep the CRPIX1 card as is.'
+    assert 'HISTORY' not in test_subject.tostring(skip_commentary=True), 'Should skip commentary cards.'
+
+    test_subject.rename_keyword('CD1_1', 'CD2_2')
+    assert test_subject.keys() == ['WCSAXES', 'OBJECT', 'CRPIX1', 'CD2_2', 'CRPIX2', 'HISTORY', 'HISTORY',
+                                   'HISTORY'], 'Should keep the place of the card.'
+    assert test_subject['CD2_2'] == -0.0001, 'Should keep the value.'
+
+
+
+def test_non_ascii():
+    # Stray latin-1 bytes, which Astropy reads, are kept as they are in cards that aren't edited.
+    raw_header = _create_header().tostring().encode('ascii').replace(b'the target', b'la cible \xe9')
+    test_subject = CardHeader(raw_header)
+    assert test_subject['CRPIX1'] == 10.5, 'Wrong value.'
+    test_subject.set('CRPIX1', 20.5)
+    assert test_subject.tostring().encode('latin-1').replace(b'20.5', b'10.5') == raw_header, \
+        'Should keep the other cards byte for byte.'
+
+
+def test_update():
+    test_subject = CardHeader.from_header(_create_header())
+    long_value = ' '.join(['a long string value'] * 6)
+    test_subject.update(fits.Header([('CRPIX1', 5.5, 'new reference'), ('CTYPE1', 'RA---TAN'),
+                                     ('LONGSTR', long_value), ('HISTORY', 'step 0'), ('HISTORY', 'step 3')]))
+
+    assert test_subject['CRPIX1'] == 5.5, 'Should replace the value.'
+    assert test_subject.keywords().index('CRPIX1') == 1, 'Should keep the place of the card.'
+    assert test_subject['LONGSTR'] == long_value, 'Should continue long strings.'
+    assert test_subject.keywords().count('HISTORY') == 4, 'Should only add new commentary cards.'
+
+    result = test_subject.to_header()
+    assert result.comments['CRPIX1'] == 'new reference', 'Should take the new comment.'
+    assert result['LONGSTR'] == long_value, 'Wrong long string.'
+    assert result['CTYPE1'] == 'RA---TAN', 'Wrong value.'
+
+    test_subject.remove('LONGSTR')
+    assert 'CONTINUE' not in test_subject.keywords(), 'Should remove the continuation cards.'
+
+
+def test_format_card():
+    assert format_card('CRPIX1', 12) == 'CRPIX1  = {:>20}'.format('12').ljust(80).encode('ascii'), 'Wrong integer.'
+    for value in [0.5, -1e-20, 3.0, 123456789.123456789]:
+        card = fits.Card.fromstring(format_card('CRPIX1', value).decode('ascii'))
+        assert card.value == pytest.approx(value), 'Wrong value for {}.'.format(value)
+        assert isinstance(card.value, float), 'Should stay a float.'
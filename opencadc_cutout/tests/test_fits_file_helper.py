@@ -70,14 +70,72 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import gzip
 import logging
+import numpy as np
 import pytest
 import io
+import context as test_context
 
-from opencadc_cutout.file_helpers.fits.fits_file_helper import FITSHelper
+from astropy.io import fits
+from astropy.nddata.utils import extract_array, NoOverlapError
+from astropy.wcs import WCS
+
+from opencadc_cutout.cutoutnd import (CutoutND, StreamedCutout, BinnedCutout, WCSOffset, PADDING_CLIP, BIN_SUM,
+                                     BIN_MEDIAN, COLLAPSE_SUM, COLLAPSE_MEAN, COLLAPSE_MAX, COLLAPSE_MOMENT0)
+from opencadc_cutout.file_helpers.fits import fits_file_helper, tile_compressed_reader
+from opencadc_cutout.file_helpers.fits.card_header import CardHeader
+from opencadc_cutout.file_helpers.fits.fits_file_helper import FITSHelper, STAMP_LAYOUT_CUBE, STAMP_LAYOUT_MEF
+from opencadc_cutout.file_helpers.fits.fits_header_scanner import FITSHeaderScanner
+from opencadc_cutout.no_content_error import NoContentError
 from opencadc_cutout.pixel_cutout_hdu import PixelCutoutHDU
 
 
+class NonSeekableStream(io.RawIOBase):
+    """
+    Stand-in for an HTTP response stream.
+    """
+
+    def __init__(self, file_name):
+        self.stream = open(file_name, 'rb')
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def readinto(self, b):
+        return self.stream.readinto(b)
+
+    def close(self):
+        self.stream.close()
+        super(NonSeekableStream, self).close()
+
+
+def _create_mef_file():
+    mef_file = test_context.random_test_file_name_path()
+    hdu1 = fits.ImageHDU(data=np.arange(10000, dtype=np.int32).reshape(100, 100), name='SCI', ver=1)
+    hdu2 = fits.ImageHDU(data=np.arange(24000, dtype=np.float32).reshape(4, 60, 100), name='SCI', ver=2)
+    fits.HDUList([fits.PrimaryHDU(), hdu1, hdu2]).writeto(mef_file, overwrite=True)
+    return mef_file
+
+
+def _cutout(input_stream, cutout_dimensions_str, **kwargs):
+    output_file = test_context.random_test_file_name_path()
+    with open(output_file, 'ab+') as output_writer:
+        FITSHelper(input_stream, output_writer, **kwargs).cutout(cutout_dimensions_str)
+    return output_file
+
+
+def _assert_same_fits(expected_file, result_file):
+    with fits.open(expected_file) as expected_hdu_list, fits.open(result_file) as result_hdu_list:
+        assert len(expected_hdu_list) == len(result_hdu_list), 'Wrong HDU count.'
+        for expected_hdu, result_hdu in zip(expected_hdu_list, result_hdu_list):
+            assert expected_hdu.header == result_hdu.header, 'Headers do not match.'
+            np.testing.assert_array_equal(expected_hdu.data, result_hdu.data, 'Arrays do not match.')
+
+
 def test_is_extension_requested():
     test_subject = FITSHelper(io.BytesIO(), io.BytesIO())
     dimension = PixelCutoutHDU(['400:800'], extension=1)
@@ -88,3 +146,716 @@ def test_is_extension_requested():
 
     dimension = PixelCutoutHDU(['400:800'], extension=2)
     assert test_subject._is_extension_requested('2', ('NOM', 7), dimension) == True
+
+
+def test_stream_cutout():
+    mef_file = _create_mef_file()
+
+    for cutout_dimensions_str in ['[SCI,2][10:40,5:20,2:3]', '[2][10:40,5:20][1][3:7,60:90][SCI,2][1:100,50:60]',
+                                  '[SCI,1][2:11,2:11]']:
+        with open(mef_file, 'rb') as input_stream:
+            expected_file = _cutout(input_stream, cutout_dimensions_str)
+
+        input_stream = NonSeekableStream(mef_file)
+        result_file = _cutout(input_stream, cutout_dimensions_str)
+        input_stream.close()
+
+        _assert_same_fits(expected_file, result_file)
+
+
+def test_gzip_cutout():
+    mef_file = _create_mef_file()
+    gzip_file = test_context.random_test_file_name_path()
+    with open(mef_file, 'rb') as input_stream, gzip.open(gzip_file, 'wb') as output_stream:
+        output_stream.write(input_stream.read())
+
+    for cutout_dimensions_str in ['[SCI,2][10:40,5:20,2:3]', '[2][10:40,5:20][1][3:7,60:90]']:
+        with open(mef_file, 'rb') as input_stream:
+            expected_file = _cutout(input_stream, cutout_dimensions_str)
+
+        with open(gzip_file, 'rb') as input_stream:
+            result_file = _cutout(input_stream, cutout_dimensions_str)
+
+        _assert_same_fits(expected_file, result_file)
+
+    # Gzipped non-seekable streams can't be read, which is an error rather than an empty output.
+    input_stream = NonSeekableStream(gzip_file)
+    with pytest.raises(IOError):
+        FITSHelper(input_stream, io.BytesIO()).cutout('[SCI,2][10:40,5:20,2:3]')
+    input_stream.close()
+
+    with pytest.raises(IOError):
+        FITSHelper(io.BytesIO(b'Not FITS' * 1000), io.BytesIO()).cutout('[1][10:40,5:20]')
+
+
+def test_postage_stamps():
+    image_file = test_context.random_test_file_name_path()
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcs.wcs.crpix = [50.5, 60.0]
+    wcs.wcs.crval = [10.0, 20.0]
+    wcs.wcs.cdelt = [-0.001, 0.001]
+    float_data = np.random.RandomState(3).random_sample((200, 150)).astype(np.float32)
+    int_data = np.arange(30000, dtype=np.int16).reshape(200, 150)
+    int_header = fits.Header([('BLANK', -99)])
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data=float_data, header=wcs.to_header(), name='SCI'),
+                  fits.ImageHDU(data=int_data, header=int_header, name='DQ')]).writeto(image_file, overwrite=True)
+
+    # Inside, on the edges, off a corner and entirely outside.
+    x = np.array([75.0, 1.0, 150.4, 149.0, 500.0])
+    y = np.array([100.0, 50.0, 20.0, 199.6, 3.0])
+    shape = (7, 10)
+
+    for layout in [STAMP_LAYOUT_CUBE, STAMP_LAYOUT_MEF]:
+        output_file = test_context.random_test_file_name_path()
+        with open(image_file, 'rb') as input_stream, open(output_file, 'ab+') as output_writer:
+            count = FITSHelper(input_stream, output_writer).postage_stamps(x, y, shape, extension='SCI', layout=layout)
+
+        assert count == 4, 'Wrong overlapping stamp count.'
+
+        with fits.open(output_file) as result_hdu_list:
+            result_hdu_list.verify('exception')
+            table = result_hdu_list['POSITIONS'].data
+            np.testing.assert_array_equal(table['X'], x, 'Wrong X column.')
+            np.testing.assert_array_equal(table['OVERLAP'], [True, True, True, True, False], 'Wrong OVERLAP column.')
+
+            if layout == STAMP_LAYOUT_CUBE:
+                assert len(result_hdu_list) == 3, 'Wrong HDU count.'
+                stamps = result_hdu_list['STAMPS'].data
+            else:
+                assert len(result_hdu_list) == 2 + len(x), 'Wrong HDU count.'
+                stamps = [hdu.data for hdu in result_hdu_list[2:]]
+
+            assert np.isnan(stamps[-1]).all(), 'Stamp outside of the image should be padding.'
+
+            for idx in range(len(x) - 1):
+                expected = extract_array(float_data, shape, (y[idx] - 1, x[idx] - 1), mode='partial',
+                                         fill_value=np.nan)
+                np.testing.assert_array_equal(stamps[idx], expected, 'Wrong stamp {}.'.format(idx))
+
+                if layout == STAMP_LAYOUT_MEF:
+                    stamp_header = result_hdu_list[idx + 2].header
+                    assert stamp_header['EXTVER'] == idx + 1, 'Wrong EXTVER.'
+                    np.testing.assert_allclose(
+                        WCS(stamp_header).pixel_to_world_values(0, 0),
+                        wcs.pixel_to_world_values(table['XSTART'][idx] - 1, table['YSTART'][idx] - 1),
+                        err_msg='Wrong stamp WCS.')
+
+    output_file = test_context.random_test_file_name_path()
+    with open(image_file, 'rb') as input_stream, open(output_file, 'ab+') as output_writer:
+        FITSHelper(input_stream, output_writer).postage_stamps([2], [2], (5, 5), extension=2)
+
+    with fits.open(output_file, do_not_scale_image_data=True) as result_hdu_list:
+        stamp = result_hdu_list['STAMPS'].data[0]
+        np.testing.assert_array_equal(stamp[1:, 1:], int_data[:4, :4], 'Wrong integer stamp.')
+        assert (stamp[0] == -99).all() and (stamp[:, 0] == -99).all(), 'Should be padded with BLANK.'
+
+
+def test_parallel_cutout():
+    mef_file = test_context.random_test_file_name_path()
+    hdus = [fits.PrimaryHDU()]
+    for idx in range(12):
+        data = np.arange(idx, idx + 6000, dtype=np.float32).reshape(60, 100)
+        hdus.append(fits.ImageHDU(data=data, name='SCI', ver=idx + 1))
+    fits.HDUList(hdus).writeto(mef_file, overwrite=True)
+
+    cutout_dimensions_str = ''.join(['[SCI,{}][{}:{},5:20]'.format(idx + 1, idx + 1, idx + 30) for idx in range(12)])
+    cutout_dimensions_str += '[3][1:10,1:10]'
+
+    with open(mef_file, 'rb') as input_stream:
+        expected_file = _cutout(input_stream, cutout_dimensions_str)
+
+    with open(mef_file, 'rb') as input_stream:
+        _assert_same_fits(expected_file, _cutout(input_stream, cutout_dimensions_str, extraction_workers=4))
+
+    with open(mef_file, 'rb') as input_stream:
+        _assert_same_fits(expected_file,
+                          _cutout(io.BytesIO(input_stream.read()), cutout_dimensions_str, extraction_workers=3))
+
+    with pytest.raises(NoContentError):
+        with open(mef_file, 'rb') as input_stream:
+            _cutout(input_stream, '[1][1:10,1:10][2][300:400,300:400][3][1:10,1:10]', extraction_workers=4)
+
+
+def test_scaled_cutout():
+    image_file = test_context.random_test_file_name_path()
+    data = np.arange(40000, dtype=np.uint16).reshape(200, 200)
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data=data)]).writeto(image_file, overwrite=True)
+
+    with open(image_file, 'rb') as input_stream:
+        output_file = _cutout(input_stream, '[1][3:13,5:15]')
+
+    with fits.open(output_file) as result_hdu_list:
+        assert result_hdu_list[0].header['BZERO'] == 32768, 'Should keep BZERO.'
+        np.testing.assert_array_equal(result_hdu_list[0].data, data[4:15, 2:13], 'Wrong physical values.')
+
+
+def test_passthrough_cutout():
+    mef_file = _create_mef_file()
+    squeezed_file = test_context.random_test_file_name_path()
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data=np.arange(600, dtype=np.float64).reshape(1, 20, 30))]) \
+        .writeto(squeezed_file, overwrite=True)
+
+    with fits.open(mef_file) as hdu_list:
+        sci1_data = hdu_list[1].data.copy()
+        sci2_data = hdu_list[2].data.copy()
+
+    for cutout_dimensions_str in ['[SCI,2]', '[2][1:100,1:60,1:4]', '[1][1:100,1:100]']:
+        with open(mef_file, 'rb') as input_stream:
+            output_file = _cutout(input_stream, cutout_dimensions_str)
+
+        with fits.open(output_file) as result_hdu_list:
+            expected_data = sci1_data if cutout_dimensions_str == '[1][1:100,1:100]' else sci2_data
+            np.testing.assert_array_equal(result_hdu_list[0].data, expected_data, 'Wrong copied data.')
+            assert result_hdu_list[0].header['EXTNAME'] == 'SCI', 'Should keep the header.'
+
+    # Through a write only output, the data is copied from file to file by the kernel.
+    output_file = test_context.random_test_file_name_path()
+    with open(mef_file, 'rb') as input_stream, open(output_file, 'wb') as output_writer:
+        FITSHelper(input_stream, output_writer).cutout('[1][2:20,5:15][1][1:100,1:100][SCI,2]')
+
+    with fits.open(output_file) as result_hdu_list:
+        assert len(result_hdu_list) == 4, 'Wrong HDU count.'
+        np.testing.assert_array_equal(result_hdu_list[1].data, sci1_data[4:15, 1:20], 'Wrong cutout data.')
+        np.testing.assert_array_equal(result_hdu_list[2].data, sci1_data, 'Wrong copied data.')
+        np.testing.assert_array_equal(result_hdu_list[3].data, sci2_data, 'Wrong copied data.')
+
+    with open(squeezed_file, 'rb') as input_stream:
+        output_file = _cutout(input_stream, '[1]')
+
+    with fits.open(output_file) as result_hdu_list:
+        assert result_hdu_list[0].header['NAXIS'] == 2, 'Should squeeze out the axis of length one.'
+        assert result_hdu_list[0].header['WCSAXES'] == 3, 'Should keep the WCS axes.'
+        np.testing.assert_array_equal(result_hdu_list[0].data, np.arange(600).reshape(20, 30), 'Wrong copied data.')
+
+
+def test_wcs_offset():
+    image_file = test_context.random_test_file_name_path()
+    header = fits.Header([('CTYPE1', 'RA---TAN'), ('CTYPE2', 'DEC--TAN'), ('CRPIX1', 50.0), ('CRPIX2', 40.0),
+                          ('CRVAL1', 10.0), ('CRVAL2', 20.0), ('CD1_1', -1e-4), ('CD1_2', 1e-6), ('CD2_1', 2e-6),
+                          ('CD2_2', 1e-4)])
+    data = np.arange(8000, dtype=np.float32).reshape(80, 100)
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data=data, header=header)]).writeto(image_file, overwrite=True)
+
+    with open(image_file, 'rb') as input_stream:
+        output_file = _cutout(input_stream, '[1][11:30,21:60]')
+
+    with fits.open(output_file) as result_hdu_list:
+        result_header = result_hdu_list[0].header
+        assert (result_header['CRPIX1'], result_header['CRPIX2']) == (40.0, 20.0), 'Wrong reference pixel.'
+        assert result_header['PC1_2'] == 1e-6, 'Should keep the other WCS values as they are.'
+        assert 'CD1_2' not in result_header, 'CDi_j should be replaced by PCi_j.'
+        assert (result_header['CDELT1'], result_header['CDELT2']) == (1.0, 1.0), 'Wrong CDELT for the PC matrix.'
+        assert result_header['WCSAXES'] == 2, 'Wrong WCSAXES.'
+        np.testing.assert_allclose(WCS(result_header).pixel_to_world_values(0, 0),
+                                   WCS(header).pixel_to_world_values(10, 20), err_msg='Wrong cutout WCS.')
+
+    # The full WCS of the cutout is only built when asked for.
+    wcs = WCS(header)
+    cutout_result = CutoutND(data=data, wcs=wcs).extract(PixelCutoutHDU([(11, 30), (21, 60)]))
+    assert cutout_result.wcs_offset.shift == [10, 20], 'Wrong WCS offset.'
+    assert cutout_result.wcs_offset.naxis == [20, 40], 'Wrong cutout size.'
+    np.testing.assert_array_equal(cutout_result.wcs.wcs.crpix, [40.0, 20.0], 'Wrong cutout CRPIX.')
+    np.testing.assert_array_equal(wcs.wcs.crpix, [50.0, 40.0], 'Should not modify the original WCS.')
+
+    with open(image_file, 'rb') as input_stream:
+        test_subject = FITSHelper(input_stream, io.BytesIO())
+        entry = list(test_subject._get_index(input_stream))[1]
+        hdu_wcs = test_subject._get_hdu_wcs(entry, test_subject._get_header(entry))
+        assert test_subject._get_hdu_wcs(entry, None) is hdu_wcs, 'Should parse the WCS once.'
+
+
+def test_cube_position():
+    # Axes without a range, or with a range over the whole axis, are taken whole rather than centred on their
+    # length (or half a pixel low).
+    data = np.arange(4 * 6 * 8, dtype=np.float32).reshape(4, 6, 8)
+    for pixel_cutout in [PixelCutoutHDU([(3, 5), (2, 4)]), PixelCutoutHDU([(3, 5), (2, 4), (1, 4)])]:
+        cutout_result = CutoutND(data).extract(pixel_cutout)
+        np.testing.assert_array_equal(cutout_result.data, data[:, 1:4, 2:5], 'Wrong cube cutout.')
+        assert cutout_result.wcs_offset.shift[:2] == [2, 1], 'Wrong WCS offset.'
+
+
+
+def test_non_ascii_header():
+    image_file = test_context.random_test_file_name_path()
+    header = fits.Header([('CRPIX1', 50.0), ('CRPIX2', 40.0), ('OBSERVER', 'Rene', 'observer name')])
+    fits.PrimaryHDU(data=np.arange(8000, dtype=np.int16).reshape(80, 100), header=header).writeto(image_file)
+
+    # A latin-1 byte in a comment, as often found in archives.
+    with open(image_file, 'rb') as f:
+        file_bytes = f.read()
+    with open(image_file, 'wb') as f:
+        f.write(file_bytes.replace(b'observer name', b'observer nam\xe9'))
+
+    with open(image_file, 'rb') as input_stream:
+        output_file = _cutout(input_stream, '[10:40,20:60]')
+
+    with open(output_file, 'rb') as f:
+        assert b'observer nam\xe9' in f.read(), 'Should keep the card as it is.'
+
+    with fits.open(output_file) as result_hdu_list:
+        np.testing.assert_array_equal(result_hdu_list[0].data,
+                                      np.arange(8000, dtype=np.int16).reshape(80, 100)[19:60, 9:40],
+                                      'Wrong cutout.')
+
+
+def test_sky_cutout():
+    mef_file = test_context.random_test_file_name_path()
+    hdu_list = [fits.PrimaryHDU()]
+
+    for crval1, sip in [(10.0, False), (10.2, False), (10.05, True)]:
+        wcs = WCS(naxis=2)
+        wcs.wcs.ctype = ['RA---TAN-SIP', 'DEC--TAN-SIP'] if sip else ['RA---TAN', 'DEC--TAN']
+        wcs.wcs.crpix = [50.5, 40.5]
+        wcs.wcs.crval = [crval1, 20.0]
+        wcs.wcs.cdelt = [-0.001, 0.001]
+        header = wcs.to_header()
+        if sip:
+            header.update([('A_ORDER', 2), ('B_ORDER', 2), ('A_2_0', 1e-4), ('B_0_2', 1e-4)])
+        hdu_list.append(fits.ImageHDU(data=np.arange(8000, dtype=np.float32).reshape(80, 100), header=header))
+
+    fits.HDUList(hdu_list).writeto(mef_file, overwrite=True)
+
+    with open(mef_file, 'rb') as input_stream:
+        output_file = _cutout(input_stream, 'CIRCLE 10.0 20.0 0.01')
+
+    with fits.open(output_file) as result_hdu_list:
+        assert len(result_hdu_list) == 3, 'Should only cut out the overlapping extensions.'
+        for result_hdu, crval1 in zip(result_hdu_list[1:], [10.0, 10.05]):
+            # Pixel centres of the first and last pixels, which are half a pixel inside the edges.
+            ra, dec = WCS(result_hdu.header).all_pix2world([[1, 1], result_hdu.data.shape[::-1]], 1).T
+            ra_radius = 0.01 / np.cos(np.radians(20.0))
+            assert ra.max() + 0.0006 >= 10.0 + ra_radius, 'Should cover the region.'
+            assert ra.min() - 0.0006 <= 10.0 - ra_radius or ra.min() < crval1 - 0.049, \
+                'Should cover the region, or reach the edge of the image.'
+            assert dec.min() - 0.0005 <= 19.99 and dec.max() + 0.0005 >= 20.01, 'Should cover the region.'
+        assert result_hdu_list[1].data.shape == (23, 23), 'Wrong cutout shape.'
+
+    # Misses every extension.
+    test_subject = FITSHelper(open(mef_file, 'rb'), io.BytesIO())
+    test_subject._get_data = None
+    with pytest.raises(NoContentError):
+        test_subject.cutout('CIRCLE 50.0 20.0 1.0')
+    test_subject.input_stream.close()
+
+    with open(mef_file, 'rb') as input_stream:
+        output_file = _cutout(input_stream, 'POLYGON 9.0 19.0 11.0 19.0 11.0 21.0 9.0 21.0')
+
+    with fits.open(output_file) as result_hdu_list:
+        assert [result_hdu.data.shape for result_hdu in result_hdu_list[1:]] == [(80, 100)] * 3, \
+            'Should cut out the whole of every extension.'
+
+
+def test_band_cutout():
+    cube_file = test_context.random_test_file_name_path()
+    wcs = WCS(naxis=3)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN', 'FREQ']
+    wcs.wcs.cunit = ['deg', 'deg', 'Hz']
+    wcs.wcs.crpix = [10.5, 8.5, 1.0]
+    wcs.wcs.crval = [10.0, 20.0, 1.42e9]
+    wcs.wcs.cdelt = [-0.001, 0.001, 1.0e6]
+    data = np.arange(40 * 16 * 20, dtype=np.float32).reshape(40, 16, 20)
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data=data, header=wcs.to_header())]).writeto(cube_file)
+
+    # Planes 11 to 15 (1.430 to 1.434 GHz), as frequencies and as wavelengths.
+    for band in ['BAND 1.4300e9 1.4340e9 Hz', 'BAND {} {}'.format(299792458.0 / 1.4340e9, 299792458.0 / 1.4300e9)]:
+        with open(cube_file, 'rb') as input_stream:
+            output_file = _cutout(input_stream, band)
+
+        with fits.open(output_file) as result_hdu_list:
+            np.testing.assert_array_equal(result_hdu_list[1].data, data[10:15], 'Wrong band cutout.')
+            np.testing.assert_allclose(WCS(result_hdu_list[1].header).wcs_pix2world([[1, 1, 1]], 1)[0, 2], 1.430e9,
+                                       err_msg='Wrong spectral WCS.')
+
+    with open(cube_file, 'rb') as input_stream:
+        output_file = _cutout(input_stream, 'CIRCLE 10.0 20.0 0.002 BAND 1.4300e9 1.4340e9 Hz')
+
+    with fits.open(output_file) as result_hdu_list:
+        assert result_hdu_list[1].data.shape[0] == 5, 'Should cut out the band.'
+        assert result_hdu_list[1].data.shape[1:] < data.shape[1:], 'Should cut out the region.'
+
+    # A STOKES axis of length one in front of the spectral axis is squeezed out of the data, and put back in the
+    # output so that the WCS still numbers the axes the same way.
+    stokes_wcs = WCS(naxis=4)
+    stokes_wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN', 'STOKES', 'FREQ']
+    stokes_wcs.wcs.cunit = ['deg', 'deg', '', 'Hz']
+    stokes_wcs.wcs.crpix = [10.5, 8.5, 1.0, 1.0]
+    stokes_wcs.wcs.crval = [10.0, 20.0, 1.0, 1.42e9]
+    stokes_wcs.wcs.cdelt = [-0.001, 0.001, 1.0, 1.0e6]
+    stokes_file = test_context.random_test_file_name_path()
+    fits.PrimaryHDU(data=data.reshape(40, 1, 16, 20), header=stokes_wcs.to_header()).writeto(stokes_file)
+
+    for cutout_dimensions_str in ['BAND 1.4300e9 1.4340e9 Hz', 'CIRCLE 10.0 20.0 0.002 BAND 1.4300e9 1.4340e9 Hz']:
+        for memory_budget in (None, 1000):
+            with open(stokes_file, 'rb') as input_stream:
+                output_file = _cutout(input_stream, cutout_dimensions_str, memory_budget=memory_budget)
+
+            with fits.open(output_file) as result_hdu_list:
+                result_data = result_hdu_list[0].data
+                assert result_data.shape[:2] == (5, 1), 'Should cut out the band, and keep the STOKES axis.'
+                if 'CIRCLE' in cutout_dimensions_str:
+                    assert result_data.shape[2:] < data.shape[1:], 'Should cut out the region.'
+                else:
+                    np.testing.assert_array_equal(result_data[:, 0], data[10:15], 'Wrong band cutout.')
+                result_wcs = WCS(result_hdu_list[0].header)
+                np.testing.assert_allclose(result_wcs.wcs_pix2world([[1, 1, 1, 1]], 1)[0, 2:], [1.0, 1.430e9],
+                                           err_msg='Wrong spectral WCS.')
+
+    # Beyond the spectral axis.
+    test_subject = FITSHelper(open(cube_file, 'rb'), io.BytesIO())
+    test_subject._get_data = None
+    with pytest.raises(NoContentError):
+        test_subject.cutout('BAND 1.0e9 1.1e9 Hz')
+    test_subject.input_stream.close()
+
+
+def test_cube_cutout():
+    mef_file = _create_mef_file()
+
+    with open(mef_file, 'rb') as input_stream:
+        output_file = _cutout(input_stream, '[SCI,2][11:31,5:21]')
+
+    with fits.open(mef_file) as hdu_list, fits.open(output_file) as result_hdu_list:
+        # Axes without a range are taken whole.
+        np.testing.assert_array_equal(result_hdu_list[0].data, hdu_list[2].data[:, 4:21, 10:31],
+                                      'Wrong cube cutout.')
+
+
+def test_header_pruning():
+    mef_file = _create_mef_file()
+
+    # Cutouts missing the data are rejected from the header, without reading any data.
+    for cutout_dimensions_str in ['[1][200:300,5:10]', '[SCI,2][5:10,70:80]', '[1][200:300,5:10][2][5:10,70:80]']:
+        test_subject = FITSHelper(open(mef_file, 'rb'), io.BytesIO())
+        test_subject._get_data = None
+        with pytest.raises(NoContentError):
+            test_subject.cutout(cutout_dimensions_str)
+        test_subject.input_stream.close()
+
+    with open(mef_file, 'rb') as input_stream:
+        test_subject = FITSHelper(input_stream, None)
+        test_subject._get_data = None
+        assert test_subject.cutout_batch([('[1][200:300,5:10]', io.BytesIO())]) == [0], 'Should make no cutout.'
+
+    # Cutouts reaching past the data still overlap it.
+    with open(mef_file, 'rb') as input_stream:
+        output_file = _cutout(input_stream, '[SCI,2][90:110,1:5]')
+
+    with fits.open(output_file) as result_hdu_list:
+        assert result_hdu_list[0].data.shape == (4, 5, 21), 'Wrong cutout shape.'
+
+
+def test_mosaic():
+    # Two tiles of one grid, side by side, plus one on another grid.
+    grid_data = np.arange(100 * 200, dtype=np.float32).reshape(100, 200)
+    tile_files = []
+
+    for crpix1, tile_data, cdelt in [(50.5, grid_data[:, :100], 0.001), (-49.5, grid_data[:, 100:], 0.001),
+                                     (50.5, grid_data[:, :100], 0.002)]:
+        wcs = WCS(naxis=2)
+        wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+        wcs.wcs.crpix = [crpix1, 50.5]
+        wcs.wcs.crval = [10.0, 20.0]
+        wcs.wcs.cdelt = [-cdelt, cdelt]
+        tile_file = test_context.random_test_file_name_path()
+        fits.PrimaryHDU(data=tile_data, header=wcs.to_header()).writeto(tile_file)
+        tile_files.append(tile_file)
+
+    # Centred on the seam between the tiles, at reference pixel 100.5.
+    ra, dec = WCS(fits.getheader(tile_files[0])).all_pix2world([[100.5, 40.0]], 1)[0]
+    cutout_dimensions_str = 'CIRCLE {} {} 0.01'.format(ra, dec)
+    output_file = test_context.random_test_file_name_path()
+
+    with open(tile_files[0], 'rb') as first, open(tile_files[1], 'rb') as second, \
+            open(output_file, 'wb') as output_writer:
+        assert FITSHelper(first, output_writer).mosaic(cutout_dimensions_str, [second]) == 2, 'Should use both.'
+
+    with fits.open(output_file) as result_hdu_list:
+        result_hdu = result_hdu_list[0]
+        x_start = int(round(50.5 - result_hdu.header['CRPIX1'])) + 1
+        y_start = int(round(50.5 - result_hdu.header['CRPIX2'])) + 1
+        ny, nx = result_hdu.data.shape
+        assert x_start < 100 < x_start + nx, 'Should span the seam.'
+        np.testing.assert_array_equal(result_hdu.data, grid_data[y_start - 1:y_start - 1 + ny,
+                                                                 x_start - 1:x_start - 1 + nx], 'Wrong mosaic.')
+
+    with open(tile_files[0], 'rb') as first, open(tile_files[2], 'rb') as other:
+        with pytest.raises(ValueError):
+            FITSHelper(first, io.BytesIO()).mosaic(cutout_dimensions_str, [other])
+
+
+def test_streamed_cutout():
+    mef_file = _create_mef_file()
+
+    for cutout_dimensions_str in ['[SCI,2][11:31,5:21]', '[1][1:100,1:51]', '[1][11:30,2:61][2][5:95,3:57]']:
+        with open(mef_file, 'rb') as input_stream:
+            expected_file = _cutout(input_stream, cutout_dimensions_str, memory_budget=None)
+
+        # Read a plane, or a couple of rows, at a time.
+        with open(mef_file, 'rb') as input_stream:
+            output_file = _cutout(input_stream, cutout_dimensions_str, memory_budget=1000)
+
+        with open(expected_file, 'rb') as expected, open(output_file, 'rb') as result:
+            assert expected.read() == result.read(), 'Streamed output should match for {}.'.format(
+                cutout_dimensions_str)
+
+        # Chunks are read in file order, so single cutouts of an HDU are streamed from non-seekable inputs too.
+        output_file = _cutout(NonSeekableStream(mef_file), cutout_dimensions_str, memory_budget=1000)
+        with open(expected_file, 'rb') as expected, open(output_file, 'rb') as result:
+            assert expected.read() == result.read(), 'Non-seekable streamed output should match for {}.'.format(
+                cutout_dimensions_str)
+
+    with open(mef_file, 'rb') as input_stream:
+        data = FITSHelper(input_stream, None)._get_data(input_stream, list(FITSHeaderScanner(input_stream))[2])
+        cutout_result = CutoutND(data).extract(PixelCutoutHDU([(11, 31), (5, 21)]), max_bytes=3000)
+        assert isinstance(cutout_result.data, StreamedCutout), 'Should be streamed.'
+        assert cutout_result.data.shape == (4, 17, 21) and cutout_result.data.chunk_planes == 2, 'Wrong chunks.'
+        assert [chunk.shape[0] for chunk in cutout_result.data.iter_chunks()] == [2, 2], 'Wrong chunks.'
+
+
+def test_padding():
+    image_file = test_context.random_test_file_name_path()
+    data = np.arange(10000, dtype=np.int16).reshape(100, 100)
+    header = fits.Header([('CRPIX1', 50.0), ('CRPIX2', 50.0)])
+    fits.PrimaryHDU(data=data, header=header).writeto(image_file)
+
+    # Integer data is padded with BLANK, in its own type.
+    with open(image_file, 'rb') as input_stream:
+        output_file = _cutout(input_stream, '[0][91:111,1:21]')
+
+    with fits.open(output_file, do_not_scale_image_data=True) as result_hdu_list:
+        result_hdu = result_hdu_list[0]
+        assert result_hdu.header['BITPIX'] == 16 and result_hdu.header['BLANK'] == -32768, 'Should stay integer.'
+        np.testing.assert_array_equal(result_hdu.data[:, :10], data[0:21, 90:100], 'Wrong overlap.')
+        assert np.all(result_hdu.data[:, 10:] == -32768), 'Should be padded with BLANK.'
+
+    # Clipped to the data, with the reference pixel moved to match.
+    with open(image_file, 'rb') as input_stream:
+        output_file = _cutout(input_stream, '[0][91:111,1:21]', padding=PADDING_CLIP)
+
+    with fits.open(output_file) as result_hdu_list:
+        result_hdu = result_hdu_list[0]
+        np.testing.assert_array_equal(result_hdu.data, data[0:21, 90:100], 'Wrong clipped cutout.')
+        assert result_hdu.header['CRPIX1'] == -40.0 and result_hdu.header['CRPIX2'] == 50.0, 'Wrong CRPIX.'
+        assert 'BLANK' not in result_hdu.header, 'Nothing was padded.'
+
+    # An existing BLANK is used.
+    header['BLANK'] = 99
+    fits.PrimaryHDU(data=data, header=header).writeto(image_file, overwrite=True)
+
+    with open(image_file, 'rb') as input_stream:
+        output_file = _cutout(input_stream, '[0][91:111,1:21]')
+
+    with fits.open(output_file, do_not_scale_image_data=True) as result_hdu_list:
+        assert np.all(result_hdu_list[0].data[:, 10:] == 99), 'Should be padded with the existing BLANK.'
+
+    with open(image_file, 'rb') as input_stream:
+        with pytest.raises(ValueError):
+            _cutout(input_stream, '[0][91:111,1:21]', padding='bogus')
+
+
+def test_stepped_cutout():
+    image_file = test_context.random_test_file_name_path()
+    header = fits.Header([('CTYPE1', 'RA---TAN-SIP'), ('CTYPE2', 'DEC--TAN-SIP'), ('CRPIX1', 50.0),
+                          ('CRPIX2', 40.0), ('CRVAL1', 10.0), ('CRVAL2', 20.0), ('CD1_1', -1e-4), ('CD1_2', 1e-6),
+                          ('CD2_1', 2e-6), ('CD2_2', 1e-4), ('A_ORDER', 2), ('A_2_0', 1e-5), ('A_1_1', 2e-6),
+                          ('B_ORDER', 2), ('B_0_2', 3e-6)])
+    data = np.arange(8000, dtype=np.float32).reshape(80, 100)
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data=data, header=header)]).writeto(image_file, overwrite=True)
+    wcs = WCS(header)
+
+    for memory_budget in (None, 200):
+        with open(image_file, 'rb') as input_stream:
+            output_file = _cutout(input_stream, '[1][3:100:4,2:80:3]', memory_budget=memory_budget)
+
+        with fits.open(output_file) as result_hdu_list:
+            result_header = result_hdu_list[0].header
+            np.testing.assert_array_equal(result_hdu_list[0].data, data[1:80:3, 2:100:4], 'Wrong stepped cutout.')
+            np.testing.assert_allclose([result_header['CRPIX1'], result_header['CRPIX2']], [12.75, 38.0 / 3 + 1],
+                                       err_msg='Wrong reference pixel.')
+            assert (result_header['PC1_1'], result_header['PC2_1']) == (-4e-4, 8e-6), 'Wrong PC column.'
+            np.testing.assert_allclose(WCS(result_header).pixel_to_world_values([0, 5], [0, 7]),
+                                       wcs.pixel_to_world_values([2, 22], [1, 22]), err_msg='Wrong cutout WCS.')
+
+    # Starting before the data moves on to the first selected pixel on it.
+    cutout_result = CutoutND(data=data, wcs=wcs).extract(PixelCutoutHDU([(3, 100, 4), (-4, 80, 3)]))
+    np.testing.assert_array_equal(cutout_result.data, data[1:80:3, 2:100:4], 'Wrong clipped stepped cutout.')
+    assert cutout_result.wcs_offset.steps == [4, 3], 'Wrong steps.'
+    np.testing.assert_allclose(cutout_result.wcs.pixel_to_world_values([0, 5], [0, 7]),
+                               wcs.pixel_to_world_values([2, 22], [1, 22]), err_msg='Wrong full cutout WCS.')
+
+    # Without a CD matrix, CDELTn is scaled.
+    cdelt_header = fits.Header([('CRPIX1', 50.0), ('CDELT1', 0.5)])
+    WCSOffset([2, 0], [10, 5], steps=[4, 1]).apply(cdelt_header)
+    assert (cdelt_header['CRPIX1'], cdelt_header['CDELT1']) == (12.75, 2.0), 'Wrong CDELT.'
+    assert 'CDELT2' not in cdelt_header and 'CRPIX2' not in cdelt_header, 'Unstepped axes should be left alone.'
+
+    with pytest.raises(NoOverlapError):
+        CutoutND(data=data).extract(PixelCutoutHDU([(101, 200, 2)]))
+
+
+def test_binned_cutout():
+    image_file = test_context.random_test_file_name_path()
+    header = fits.Header([('CTYPE1', 'RA---TAN'), ('CTYPE2', 'DEC--TAN'), ('CRPIX1', 50.0), ('CRPIX2', 40.0),
+                          ('CRVAL1', 10.0), ('CRVAL2', 20.0), ('CDELT1', -1e-4), ('CDELT2', 1e-4), ('BLANK', -1)])
+    data = np.arange(8000, dtype=np.int16).reshape(80, 100)
+    data[0:4, 0:4] = -1
+    data[4, 4] = -1
+    fits.PrimaryHDU(data=data, header=header).writeto(image_file)
+
+    with fits.open(image_file, mode='update', do_not_scale_image_data=True) as hdu_list:
+        hdu_list[0].header['BZERO'] = 10.0
+    wcs = WCS(header)
+    expected = np.ma.masked_equal(data[:76, :100], -1).astype(np.float32).reshape(19, 4, 25, 4)
+
+    # Reading four rows at a time gives the same result as reading the cutout at once.
+    for memory_budget in (None, 4 * 100 * 2):
+        with open(image_file, 'rb') as input_stream:
+            output_file = _cutout(input_stream, '[0][1:100,1:79]', memory_budget=memory_budget, bin_factors=4)
+
+        with fits.open(output_file, do_not_scale_image_data=True) as result_hdu_list:
+            result_hdu = result_hdu_list[0]
+            assert result_hdu.header['BITPIX'] == -32 and 'BLANK' not in result_hdu.header, 'Should be floating point.'
+            assert np.isnan(result_hdu.data[0, 0]), 'All blank blocks should be blank.'
+            np.testing.assert_allclose(result_hdu.data[1:], expected.mean(axis=(1, 3)).data[1:],
+                                       err_msg='Wrong binned cutout.')
+            assert result_hdu.data[1, 1] == pytest.approx(expected[1, :, 1, :].mean()), 'Should leave out blanks.'
+            assert result_hdu.header['BZERO'] == 10.0, 'Means keep the zero point.'
+            # Binned pixels are centred on their block.
+            np.testing.assert_allclose(WCS(result_hdu.header).pixel_to_world_values([0, 3], [0, 2]),
+                                       wcs.pixel_to_world_values([1.5, 13.5], [1.5, 9.5]), err_msg='Wrong WCS.')
+
+    # Sums add up the zero point of every pixel.
+    with open(image_file, 'rb') as input_stream:
+        output_file = _cutout(input_stream, '[0][1:100,1:79]', bin_factors=[2, 4], bin_method=BIN_SUM)
+
+    with fits.open(output_file) as result_hdu_list:
+        result_hdu = result_hdu_list[0]
+        assert result_hdu.data.shape == (19, 50), 'Wrong binned shape.'
+        expected = (data[:76].astype(np.float64) + 10.0).reshape(19, 4, 50, 2).sum(axis=(1, 3))
+        np.testing.assert_allclose(result_hdu.data[5:, 10:], expected[5:, 10:], err_msg='Wrong binned sum.')
+
+    cube = np.arange(4 * 9 * 10, dtype=np.float32).reshape(4, 9, 10)
+    cutout_result = CutoutND(data=cube).extract(PixelCutoutHDU([(1, 10), (1, 9)]), bin_factors=[2, 3, 2],
+                                                bin_method=BIN_MEDIAN, max_bytes=100)
+    assert isinstance(cutout_result.data, BinnedCutout) and cutout_result.data.chunk_planes == 2, 'Should stream.'
+    np.testing.assert_array_equal(np.concatenate(list(cutout_result.data.iter_chunks())),
+                                  np.median(cube.reshape(2, 2, 3, 3, 5, 2), axis=(1, 3, 5)), 'Wrong binned cube.')
+    assert cutout_result.wcs_offset.steps == [2, 3, 2] and cutout_result.wcs_offset.shift == [0.5, 1.0, 0.5], \
+        'Wrong WCS offset.'
+
+    with pytest.raises(ValueError):
+        CutoutND(data=cube).extract(PixelCutoutHDU([(1, 10)]), bin_factors=2, bin_method='bogus')
+
+
+def test_collapsed_cutout():
+    cube_file = test_context.random_test_file_name_path()
+    header = fits.Header([('CTYPE1', 'RA---TAN'), ('CTYPE2', 'DEC--TAN'), ('CTYPE3', 'VRAD'), ('CTYPE4', 'STOKES'),
+                          ('CRPIX1', 10.0), ('CRPIX2', 15.0), ('CRPIX3', 1.0), ('CRPIX4', 1.0), ('CRVAL1', 10.0),
+                          ('CRVAL2', 20.0), ('CRVAL3', 1000.0), ('CRVAL4', 1.0), ('CDELT1', -1e-3), ('CDELT2', 1e-3),
+                          ('CDELT3', -500.0), ('CDELT4', 1.0), ('CUNIT3', 'm/s'), ('PC1_3', 0.0), ('PC4_4', 1.0),
+                          ('BUNIT', 'Jy/beam')])
+    data = np.random.RandomState(7).normal(size=(1, 40, 31, 21)).astype(np.float32)
+    data[0, :, 0, 0] = np.nan
+    fits.PrimaryHDU(data=data, header=header).writeto(cube_file)
+    cube = data[0, 4:31, 1:26, 2:19].astype(np.float64)
+    wcs = WCS(header)
+
+    # Accumulating a plane at a time gives the same result as reading the cutout at once.
+    for memory_budget in (None, 25 * 17 * 4):
+        with open(cube_file, 'rb') as input_stream:
+            output_file = _cutout(input_stream, '[0][3:19,2:26,5:31]', memory_budget=memory_budget,
+                                  collapse=COLLAPSE_MOMENT0)
+
+        with fits.open(output_file) as result_hdu_list:
+            result_header = result_hdu_list[0].header
+            np.testing.assert_allclose(result_hdu_list[0].data, cube.sum(axis=0) * 500.0, rtol=1e-5, atol=1e-2,
+                                       err_msg='Wrong moment 0.')
+            assert result_header['WCSAXES'] == 3 and result_header['CTYPE3'] == 'STOKES', \
+                'Should remove the spectral axis.'
+            assert 'CUNIT3' not in result_header and 'PC1_3' not in result_header and \
+                result_header['PC3_3'] == 1.0, 'Should renumber the axes after the spectral axis.'
+            assert result_header['BUNIT'] == 'Jy m beam-1 s-1', 'Wrong moment unit.'
+            np.testing.assert_allclose(WCS(result_header).pixel_to_world_values(0, 0, 0),
+                                       np.take(wcs.pixel_to_world_values(2, 1, 0, 0), [0, 1, 3]),
+                                       err_msg='Wrong collapsed WCS.')
+
+    # A STOKES axis of length one before the spectral axis is kept, and the spectral axis removed.
+    stokes_file = test_context.random_test_file_name_path()
+    stokes_header = fits.Header([('CTYPE1', 'RA---TAN'), ('CTYPE2', 'DEC--TAN'), ('CTYPE3', 'STOKES'),
+                                 ('CTYPE4', 'VRAD'), ('CRPIX1', 10.0), ('CRPIX2', 15.0), ('CRPIX3', 1.0),
+                                 ('CRPIX4', 1.0), ('CRVAL1', 10.0), ('CRVAL2', 20.0), ('CRVAL3', 1.0),
+                                 ('CRVAL4', 1000.0), ('CDELT1', -1e-3), ('CDELT2', 1e-3), ('CDELT3', 1.0),
+                                 ('CDELT4', -500.0), ('CUNIT4', 'm/s')])
+    fits.PrimaryHDU(data=data.reshape(40, 1, 31, 21), header=stokes_header).writeto(stokes_file)
+    stokes_wcs = WCS(stokes_header)
+
+    for memory_budget in (None, 25 * 17 * 4):
+        with open(stokes_file, 'rb') as input_stream:
+            output_file = _cutout(input_stream, '[0][3:19,2:26,5:31]', memory_budget=memory_budget,
+                                  collapse=COLLAPSE_SUM)
+
+        with fits.open(output_file) as result_hdu_list:
+            result_header = result_hdu_list[0].header
+            np.testing.assert_allclose(result_hdu_list[0].data, cube.sum(axis=0), rtol=1e-5, atol=1e-3,
+                                       err_msg='Wrong sum.')
+            assert result_header['WCSAXES'] == 3 and result_header['CTYPE3'] == 'STOKES', \
+                'Should keep the STOKES axis.'
+            assert 'CTYPE4' not in result_header and 'CUNIT4' not in result_header, \
+                'Should remove the spectral axis.'
+            np.testing.assert_allclose(WCS(result_header).pixel_to_world_values(0, 0, 0),
+                                       np.take(stokes_wcs.pixel_to_world_values(2, 1, 0, 0), [0, 1, 2]),
+                                       err_msg='Wrong collapsed WCS.')
+
+    for method, expected in [(COLLAPSE_SUM, cube.sum(axis=0)), (COLLAPSE_MEAN, cube.mean(axis=0)),
+                             (COLLAPSE_MAX, cube.max(axis=0))]:
+        cutout_result = CutoutND(data=np.squeeze(data), wcs=WCS(header).dropaxis(3)).extract(
+            PixelCutoutHDU([(3, 19), (2, 26), (5, 31)]), max_bytes=1000, collapse_method=method, collapse_axis=2)
+        np.testing.assert_allclose(cutout_result.data, expected, rtol=1e-5, atol=1e-4,
+                                   err_msg='Wrong {}.'.format(method))
+        assert cutout_result.wcs.naxis == 2 and cutout_result.wcs.wcs.ctype[1] == 'DEC--TAN', 'Wrong WCS.'
+
+    # Blank spectra stay blank.
+    cutout_result = CutoutND(data=np.squeeze(data)).extract(PixelCutoutHDU([(1, 3), (1, 3)]),
+                                                            collapse_method=COLLAPSE_MEAN, collapse_axis=2)
+    assert np.isnan(cutout_result.data[0, 0]) and not np.isnan(cutout_result.data[1, 1]), 'Wrong blank pixels.'
+
+    # Images have no spectral axis to collapse.
+    image_file = test_context.random_test_file_name_path()
+    fits.PrimaryHDU(data=data[0, 0]).writeto(image_file)
+    with open(image_file, 'rb') as input_stream:
+        with pytest.raises(NoContentError):
+            FITSHelper(input_stream, io.BytesIO(), collapse=COLLAPSE_SUM)._get_spectral_axis(
+                CardHeader.from_header(fits.getheader(image_file)))
+
+
+def test_compressed_fallback(monkeypatch):
+    data = np.arange(3 * 40 * 30, dtype=np.int32).reshape(3, 40, 30)
+    header = fits.Header([('CTYPE1', 'RA---TAN'), ('CTYPE2', 'DEC--TAN'), ('CRPIX1', 15.0), ('CRPIX2', 20.0),
+                          ('CRVAL1', 10.0), ('CRVAL2', 20.0), ('CDELT1', -1e-4), ('CDELT2', 1e-4)])
+    compressed_file = test_context.random_test_file_name_path()
+    fits.HDUList([fits.PrimaryHDU(), fits.CompImageHDU(data=data, header=header, name='SCI',
+                                                       tile_shape=(1, 10, 30))]).writeto(compressed_file)
+    uncompressed_file = test_context.random_test_file_name_path()
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data=data, header=header, name='SCI')]).writeto(uncompressed_file)
+    cutout_dimensions_str = '[SCI][5:25,11:31,2:3]'
+
+    with open(compressed_file, 'rb') as input_stream:
+        table_header = FITSHeaderScanner(input_stream).get_index()[1].get_header()
+    image_header = tile_compressed_reader.get_image_header(table_header)
+
+    # Without the per-tile codecs, the image header comes from Astropy and the whole image is decompressed.
+    monkeypatch.setattr(tile_compressed_reader, 'TILE_COMPRESSION_SUPPORTED', False)
+    monkeypatch.setattr(fits_file_helper, 'TILE_COMPRESSION_SUPPORTED', False)
+    assert list(tile_compressed_reader.get_image_header(table_header).items()) == list(image_header.items()), \
+        'Wrong image header.'
+
+    with open(compressed_file, 'rb') as input_stream:
+        result_file = _cutout(input_stream, cutout_dimensions_str)
+
+    with open(uncompressed_file, 'rb') as input_stream:
+        expected_file = _cutout(input_stream, cutout_dimensions_str)
+
+    with fits.open(expected_file) as expected_hdu_list, fits.open(result_file) as result_hdu_list:
+        np.testing.assert_array_equal(result_hdu_list[0].data, expected_hdu_list[0].data, 'Arrays do not match.')
+        assert result_hdu_list[0].header['CRPIX1'] == expected_hdu_list[0].header['CRPIX1'], 'Wrong CRPIX1.'
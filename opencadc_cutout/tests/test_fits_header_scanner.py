@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import numpy as np
+import os
+import pytest
+import context as test_context
+
+from astropy.io import fits
+
+from opencadc_cutout.file_helpers.fits.fits_header_scanner import FITSHeaderScanner
+from opencadc_cutout.forward_only_reader import ForwardOnlyReader
+
+
+pytest.main(args=['-s', os.path.abspath(__file__)])
+
+
+def _create_mef_file():
+    mef_file = test_context.random_test_file_name_path()
+    hdu0 = fits.PrimaryHDU()
+    hdu0.header['OBJECT'] = "O'Brien / 'field'"
+    for i in range(100):
+        hdu0.header.add_history('History card {}'.format(i))
+
+    hdu1 = fits.ImageHDU(data=np.arange(1000, dtype=np.int16).reshape(10, 100), name='SCI', ver=1)
+    hdu2 = fits.BinTableHDU.from_columns([fits.Column(name='A', format='J', array=np.arange(5))])
+    hdu3 = fits.ImageHDU(data=np.zeros((3, 4, 5), dtype=np.float64), name="S'Q", ver=2)
+    hdu4 = fits.ImageHDU()
+    fits.HDUList([hdu0, hdu1, hdu2, hdu3, hdu4]).writeto(mef_file, overwrite=True)
+    return mef_file
+
+
+def test_get_index():
+    mef_file = _create_mef_file()
+
+    with open(mef_file, 'rb') as input_stream:
+        index = FITSHeaderScanner(input_stream).get_index()
+
+    with fits.open(mef_file) as hdu_list:
+        assert len(index) == len(hdu_list), 'Wrong HDU count.'
+
+        for entry, hdu in zip(index, hdu_list):
+            info = hdu.fileinfo()
+            assert entry.header_offset == info['hdrLoc'], 'Wrong header offset.'
+            assert entry.data_offset == info['datLoc'], 'Wrong data offset.'
+            assert entry.bitpix == hdu.header['BITPIX'], 'Wrong BITPIX.'
+            assert entry.naxis == tuple(hdu.header['NAXIS{}'.format(i)]
+                                        for i in range(1, hdu.header['NAXIS'] + 1)), 'Wrong NAXIS.'
+            assert entry.extname == hdu.header.get('EXTNAME'), 'Wrong EXTNAME.'
+            assert entry.get_header() == hdu.header, 'Wrong header.'
+
+    assert index[0].is_image() and index[1].is_image() and not index[2].is_image(), 'Wrong image types.'
+    assert index[1].get_ext_name_ver() == ('SCI', 1), 'Wrong EXTNAME and EXTVER.'
+    assert index[3].get_ext_name_ver() == ("S'Q", 2), 'Wrong EXTNAME with a quote.'
+    assert index[1].data_size == 2000, 'Wrong data size.'
+    assert index[1].next_offset == index[2].header_offset, 'Wrong next offset.'
+
+
+def test_forward_only():
+    mef_file = _create_mef_file()
+
+    with open(mef_file, 'rb') as input_stream:
+        data = input_stream.read()
+
+    # Trailing bytes after the last HDU are ignored.
+    index = FITSHeaderScanner(ForwardOnlyReader(io.BytesIO(data + b'\0' * 100))).get_index()
+    assert len(index) == 5, 'Wrong HDU count.'
+    assert index[4].extname is None, 'Should have no EXTNAME.'
+
+    with pytest.raises(IOError):
+        FITSHeaderScanner(io.BytesIO(data[:2880 + 100])).get_index()
+
+
+def test_not_fits():
+    # Garbage, a gzipped file read as is, or a file cut short are errors, not empty files.
+    mef_file = _create_mef_file()
+    with open(mef_file, 'rb') as input_stream:
+        fits_bytes = input_stream.read()
+
+    for input_bytes in [b'\x1f\x8b' + (b'garbage' * 1000), b'', fits_bytes[:1000]]:
+        with pytest.raises(IOError):
+            FITSHeaderScanner(ForwardOnlyReader(io.BytesIO(input_bytes))).get_index()
+
+    # Trailing bytes after the last HDU are still ignored.
+    assert len(FITSHeaderScanner(io.BytesIO(fits_bytes + (b'\0' * 2880))).get_index()) == 5, 'Wrong HDU count.'
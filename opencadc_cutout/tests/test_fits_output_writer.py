@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import os
+import numpy as np
+import pytest
+import context as test_context
+
+from astropy.io import fits
+
+from opencadc_cutout.file_helpers.fits.fits_output_writer import FITSOutputWriter
+
+
+pytest.main(args=['-s', os.path.abspath(__file__)])
+
+
+def test_write_hdus():
+    output = io.BytesIO()
+    test_subject = FITSOutputWriter(output)
+
+    primary_header = fits.Header([('SIMPLE', True), ('BITPIX', 16), ('NAXIS', 2), ('NAXIS1', 10), ('NAXIS2', 10),
+                                  ('OBJECT', 'M31'), ('CHECKSUM', 'abc')])
+    test_subject.write_hdu(primary_header)
+
+    image_header = fits.Header([('XTENSION', 'IMAGE'), ('BITPIX', 16), ('NAXIS', 2), ('NAXIS1', 100),
+                                ('NAXIS2', 100), ('PCOUNT', 0), ('GCOUNT', 1), ('BZERO', 32768), ('BLANK', 0),
+                                ('EXTNAME', 'SCI'), ('DATASUM', '1')])
+    int_data = np.arange(12, dtype='>i2').reshape(3, 4)
+    test_subject.write_hdu(image_header, int_data)
+
+    float_data = np.arange(24, dtype=np.float32).reshape(2, 3, 4)
+    test_subject.write_hdu(image_header, float_data)
+
+    table_hdu = fits.BinTableHDU.from_columns([fits.Column(name='X', format='D', array=[1.5, 2.5])],
+                                              name='TABLE')
+    test_subject.write_hdu(table_hdu.header, table_hdu.data)
+
+    test_subject.write_hdu(fits.Header(), np.array([True, False]))
+
+    assert test_subject.hdu_count == 5, 'Wrong HDU count.'
+    assert test_subject.bytes_written == len(output.getvalue()), 'Wrong byte count.'
+    assert test_subject.bytes_written % 2880 == 0, 'Should be padded to whole blocks.'
+    # The original primary header was written as is, with no data.
+    assert output.getvalue().startswith(b'SIMPLE  =                    T'), 'Should start with a primary header.'
+
+    output.seek(0)
+    with fits.open(output, do_not_scale_image_data=True) as result_hdu_list:
+        result_hdu_list.verify('exception')
+        assert len(result_hdu_list) == 5, 'Wrong HDU count.'
+
+        primary_hdu = result_hdu_list[0]
+        assert primary_hdu.header['NAXIS'] == 0, 'Primary should have no data.'
+        assert primary_hdu.header['OBJECT'] == 'M31', 'Should keep other keywords.'
+        assert 'CHECKSUM' not in primary_hdu.header, 'Should remove CHECKSUM.'
+
+        int_hdu = result_hdu_list[1]
+        assert int_hdu.header['BZERO'] == 32768, 'Should keep BZERO.'
+        assert int_hdu.header['BLANK'] == 0, 'Should keep BLANK for integer data.'
+        assert 'DATASUM' not in int_hdu.header, 'Should remove DATASUM.'
+        assert (int_hdu.header['NAXIS1'], int_hdu.header['NAXIS2']) == (4, 3), 'Wrong NAXISn.'
+        np.testing.assert_array_equal(int_hdu.data, int_data, 'Wrong integer data.')
+
+        float_hdu = result_hdu_list[2]
+        assert float_hdu.header['BITPIX'] == -32, 'Wrong BITPIX.'
+        assert 'BLANK' not in float_hdu.header, 'Should drop BLANK for floating point data.'
+        np.testing.assert_array_equal(float_hdu.data, float_data, 'Wrong floating point data.')
+
+        np.testing.assert_array_equal(result_hdu_list['TABLE'].data['X'], [1.5, 2.5], 'Wrong table data.')
+        np.testing.assert_array_equal(result_hdu_list[4].data, [1, 0], 'Wrong promoted data.')
+
+
+def test_append():
+    output = io.BytesIO()
+    output.write(b' ' * 2880)
+
+    test_subject = FITSOutputWriter(output)
+    test_subject.write_hdu(fits.Header(), np.zeros(3, dtype=np.float64))
+    assert output.getvalue()[2880:].startswith(b"XTENSION= 'IMAGE   '"), 'Should append an extension.'
+
+    with pytest.raises(ValueError):
+        test_subject.write_hdu(fits.Header(), np.zeros(3, dtype=np.complex64))
+
+
+def test_copy_data():
+    input_file = test_context.random_test_file_name_path(file_extension='bin')
+    with open(input_file, 'wb') as f:
+        f.write(bytes(bytearray(range(256))) * 100)
+
+    for mode in ['wb', 'ab+']:
+        output_file = test_context.random_test_file_name_path(file_extension='bin')
+        with open(input_file, 'rb') as input_stream, open(output_file, mode) as output:
+            test_subject = FITSOutputWriter(output)
+            test_subject.begin_hdu(b'H' * 2880)
+            test_subject.copy_data(input_stream, 1000, 5000)
+            test_subject.end_hdu()
+            assert test_subject.bytes_written == 2880 * 3, 'Wrong byte count.'
+
+        with open(output_file, 'rb') as f:
+            result = f.read()
+        os.remove(output_file)
+
+        assert result[2880:7880] == (bytes(bytearray(range(256))) * 100)[1000:6000], \
+            'Wrong data copied through {}.'.format(mode)
+        assert result[7880:] == b'\0' * (2880 * 3 - 7880), 'Should pad with zeros.'
+
+    os.remove(input_file)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import gzip
+import io
+import os
+import numpy as np
+import pytest
+import context as test_context
+
+from opencadc_cutout.gzip_index_reader import GzipIndex, GzipIndexCache, GzipIndexReader, is_gzip, CHECKPOINT_BYTES
+
+
+pytest.main(args=['-s', os.path.abspath(__file__)])
+
+
+def _get_data():
+    # Mildly compressible, so that checkpoints fall in the middle of deflate blocks.
+    return np.random.RandomState(7).randint(0, 16, size=300000).astype(np.uint8).tobytes()
+
+
+def test_random_access():
+    data = _get_data()
+    index = GzipIndex(spacing=10000)
+    test_subject = GzipIndexReader(io.BytesIO(gzip.compress(data)), index)
+
+    assert test_subject.read(100) == data[:100], 'Wrong first bytes.'
+
+    test_subject.seek(250000)
+    assert test_subject.read(5000) == data[250000:255000], 'Wrong bytes after seek forward.'
+    checkpoint_count = len(index)
+    assert checkpoint_count > 20, 'Checkpoints should be added while decompressing.'
+
+    for offset in [123456, 7, 254000, 60001]:
+        test_subject.seek(offset)
+        assert test_subject.tell() == offset, 'Wrong position.'
+        assert test_subject.read(20) == data[offset:offset + 20], 'Wrong bytes at {}.'.format(offset)
+
+    assert len(index) == checkpoint_count, 'Indexed part should not be checkpointed again.'
+    assert index.get_checkpoint(123456).uncompressed_offset <= 123456, 'Wrong checkpoint.'
+    assert 123456 - index.get_checkpoint(123456).uncompressed_offset < 20000, 'Checkpoint too far back.'
+
+    assert test_subject.seek(-10, io.SEEK_END) == len(data) - 10, 'Wrong size.'
+    assert test_subject.read(100) == data[-10:], 'Wrong last bytes.'
+    assert test_subject.read(100) == b'', 'Should be at the end.'
+
+    # A new reader with the same index starts from the checkpoints.
+    test_subject = GzipIndexReader(io.BytesIO(gzip.compress(data)), index)
+    test_subject.seek(290000)
+    buf = bytearray(1000)
+    assert test_subject.readinto(buf) == 1000, 'Wrong read count.'
+    assert bytes(buf) == data[290000:291000], 'Wrong bytes from shared index.'
+
+
+def test_multiple_members():
+    data = _get_data()
+    compressed = gzip.compress(data[:100000]) + gzip.compress(data[100000:]) + b'\0' * 100
+    test_subject = GzipIndexReader(io.BytesIO(compressed), GzipIndex(spacing=30000))
+
+    test_subject.seek(99990)
+    assert test_subject.read(20) == data[99990:100010], 'Wrong bytes across members.'
+    test_subject.seek(50)
+    assert test_subject.read(10) == data[50:60], 'Wrong bytes in first member.'
+    test_subject.seek(0, io.SEEK_END)
+    assert test_subject.tell() == len(data), 'Padding should be ignored.'
+
+
+def test_truncated():
+    compressed = gzip.compress(_get_data())
+    test_subject = GzipIndexReader(io.BytesIO(compressed[:len(compressed) // 2]))
+
+    with pytest.raises(IOError):
+        test_subject.seek(0, io.SEEK_END)
+
+
+def test_cache():
+    test_file = test_context.random_test_file_name_path()
+    with gzip.open(test_file, 'wb') as gzip_file:
+        gzip_file.write(_get_data())
+
+    test_subject = GzipIndexCache()
+    with open(test_file, 'rb') as input_stream:
+        assert is_gzip(input_stream), 'Should be gzip.'
+        assert input_stream.tell() == 0, 'Should not move.'
+        index = test_subject.get_index(input_stream)
+        assert test_subject.get_index(input_stream) is index, 'Should be cached.'
+
+    # Indexes are dropped by the size of their checkpoints, except for the one asked for.
+    other_file = test_context.random_test_file_name_path()
+    with gzip.open(other_file, 'wb') as gzip_file:
+        gzip_file.write(_get_data())
+
+    test_subject = GzipIndexCache(spacing=4096, max_bytes=3 * CHECKPOINT_BYTES)
+    with open(test_file, 'rb') as input_stream:
+        index = test_subject.get_index(input_stream)
+        GzipIndexReader(input_stream, index).read()
+        assert index.nbytes > test_subject.max_bytes, 'Should have grown past the cache size.'
+        assert test_subject.get_index(input_stream) is index, 'Should keep the index asked for.'
+
+    with open(other_file, 'rb') as input_stream:
+        test_subject.get_index(input_stream)
+
+    with open(test_file, 'rb') as input_stream:
+        assert test_subject.get_index(input_stream) is not index, 'Should have dropped the largest index.'
+
+    assert test_subject.get_index(io.BytesIO()) is not index, 'Anonymous streams are not cached.'
+    assert not is_gzip(io.BytesIO(b'SIMPLE  =')), 'Should not be gzip.'
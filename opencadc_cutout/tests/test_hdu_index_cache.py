@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import os
+import pytest
+import tempfile
+import time
+import context as test_context
+
+from astropy.io import fits
+
+from opencadc_cutout.file_helpers.fits.fits_file_helper import FITSHelper
+from opencadc_cutout.file_helpers.fits.fits_header_scanner import FITSHeaderScanner
+from opencadc_cutout.file_helpers.fits.hdu_index_cache import HDUIndexCache
+
+
+pytest.main(args=['-s', os.path.abspath(__file__)])
+
+
+def _create_mef_file():
+    mef_file = test_context.random_test_file_name_path()
+    hdu1 = fits.ImageHDU(data=np.arange(10000, dtype=np.int32).reshape(100, 100), name='SCI', ver=1)
+    hdu2 = fits.ImageHDU(data=np.arange(5000, dtype=np.float32).reshape(50, 100), name='SCI', ver=2)
+    fits.HDUList([fits.PrimaryHDU(), hdu1, hdu2]).writeto(mef_file, overwrite=True)
+    return mef_file
+
+
+def test_get_put():
+    mef_file = _create_mef_file()
+    test_subject = HDUIndexCache(tempfile.mkdtemp())
+
+    with open(mef_file, 'rb') as input_stream:
+        key = test_subject.get_file_key(input_stream)
+        expected = FITSHeaderScanner(input_stream).get_index()
+
+    assert key is not None, 'Should have a key.'
+    assert test_subject.get(key) is None, 'Should not be cached yet.'
+
+    test_subject.put(key, expected)
+    result = test_subject.get(key)
+    assert test_subject.hits == 1 and test_subject.misses == 1, 'Wrong hit and miss counts.'
+    assert len(result) == len(expected), 'Wrong entry count.'
+
+    for expected_entry, result_entry in zip(expected, result):
+        assert expected_entry.to_dict() == result_entry.to_dict(), 'Entries do not match.'
+        assert expected_entry.naxis == result_entry.naxis, 'Wrong NAXIS.'
+
+    # Corrupt index files are cache misses, and are replaced.
+    for corrupt_bytes in [b'\xff\xfe not UTF-8 \xe9', b'{"key": "', b'[]', b'{"entries": [{}]}']:
+        with open(test_subject._get_path(key), 'wb') as index_file:
+            index_file.write(corrupt_bytes)
+        misses = test_subject.misses
+        assert test_subject.get(key) is None, 'Corrupt index should not be used.'
+        assert test_subject.misses == misses + 1, 'Corrupt index should be a miss.'
+
+    test_subject.put(key, expected)
+    assert len(test_subject.get(key)) == len(expected), 'Should replace the corrupt index.'
+
+    # Modifying the file changes the key.
+    with open(mef_file, 'ab') as output_stream:
+        output_stream.write(b'\0' * 2880)
+
+    with open(mef_file, 'rb') as input_stream:
+        assert test_subject.get_file_key(input_stream) != key, 'Key should change with the file.'
+
+
+def test_evict():
+    mef_file = _create_mef_file()
+    cache_dir = tempfile.mkdtemp()
+
+    with open(mef_file, 'rb') as input_stream:
+        index = FITSHeaderScanner(input_stream).get_index()
+
+    test_subject = HDUIndexCache(cache_dir)
+    test_subject.put('a', index)
+    entry_size = sum(os.path.getsize(os.path.join(cache_dir, f)) for f in os.listdir(cache_dir))
+
+    test_subject = HDUIndexCache(cache_dir, max_size=entry_size * 2)
+    past = time.time() - 100
+    os.utime(test_subject._get_path('a'), (past, past))
+    test_subject.put('b', index)
+    os.utime(test_subject._get_path('b'), (past + 10, past + 10))
+    # Using 'a' makes 'b' the least recently used.
+    assert test_subject.get('a') is not None, 'Should be cached.'
+    test_subject.put('c', index)
+
+    assert test_subject.get('b') is None, 'Least recently used should be evicted.'
+    assert test_subject.get('a') is not None, 'Should still be cached.'
+    assert test_subject.get('c') is not None, 'Should still be cached.'
+
+
+def test_fits_helper_cache():
+    mef_file = _create_mef_file()
+    test_subject = HDUIndexCache(tempfile.mkdtemp())
+    outputs = []
+
+    for _ in range(2):
+        output_file = test_context.random_test_file_name_path()
+        with open(mef_file, 'rb') as input_stream, open(output_file, 'ab+') as output_writer:
+            FITSHelper(input_stream, output_writer, index_cache=test_subject).cutout('[SCI,2][10:20,5:15][1][3:9,1:99]')
+        outputs.append(output_file)
+
+    assert test_subject.misses == 1 and test_subject.hits == 1, 'Second cutout should use the cache.'
+
+    with fits.open(outputs[0]) as expected_hdu_list, fits.open(outputs[1]) as result_hdu_list:
+        assert len(expected_hdu_list) == 3, 'Wrong HDU count.'
+        for expected_hdu, result_hdu in zip(expected_hdu_list, result_hdu_list):
+            assert expected_hdu.header == result_hdu.header, 'Headers do not match.'
+            np.testing.assert_array_equal(expected_hdu.data, result_hdu.data, 'Arrays do not match.')
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import os
+import re
+import threading
+import numpy as np
+import pytest
+import context as test_context
+
+from astropy.io import fits
+
+from opencadc_cutout.file_helpers.fits.fits_file_helper import FITSHelper
+from opencadc_cutout.http_range_reader import HTTPConnectionPool, HTTPRangeReader
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+pytest.main(args=['-s', os.path.abspath(__file__)])
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the files in the server's ``files`` dict, honouring single byte ranges, with keep-alive.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.connections.add(id(self.connection))
+        content = self.server.files.get(self.path)
+
+        if content is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if match is None:
+            self.send_response(200)
+            body = content
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), len(content) - 1)
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(len(content)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(content)))
+            body = content[start:end + 1]
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    http_server = HTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+    http_server.files = {}
+    http_server.connections = set()
+    thread = threading.Thread(target=http_server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield http_server
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def _get_url(server, path):
+    return 'http://127.0.0.1:{}{}'.format(server.server_address[1], path)
+
+
+def test_read_seek(server):
+    data = bytes(bytearray(range(256))) * 400
+    server.files['/data.bin'] = data
+    connection_pool = HTTPConnectionPool()
+    test_subject = HTTPRangeReader(_get_url(server, '/data.bin'), block_size=1000, cache_size=5000,
+                                   max_read_ahead=4, connection_pool=connection_pool)
+
+    assert test_subject.seekable(), 'Should be seekable.'
+    assert test_subject.read(10) == data[:10], 'Wrong first bytes.'
+    assert test_subject.get_size() == len(data), 'Wrong size.'
+
+    # Within the cached block.
+    request_count = test_subject.request_count
+    assert test_subject.read(10) == data[10:20], 'Wrong cached bytes.'
+    assert test_subject.request_count == request_count, 'Should be served from the cache.'
+
+    # Spanning several blocks, in one request.
+    test_subject.seek(52500)
+    assert test_subject.read(3000) == data[52500:55500], 'Wrong bytes across blocks.'
+    assert test_subject.request_count == request_count + 1, 'Missing blocks should be fetched together.'
+
+    # Sequential reads fetch ahead.
+    request_count = test_subject.request_count
+    for offset in range(55500, 65500, 500):
+        assert test_subject.read(500) == data[offset:offset + 500], 'Wrong sequential bytes.'
+    assert test_subject.request_count - request_count < 5, 'Sequential reads should read ahead.'
+
+    test_subject.seek(-5, io.SEEK_END)
+    assert test_subject.read(100) == data[-5:], 'Wrong last bytes.'
+    assert test_subject.read(100) == b'', 'Should be at the end.'
+
+    test_subject.seek(len(data) + 100)
+    assert test_subject.read(10) == b'', 'Should be past the end.'
+
+    # Reads larger than the cache are served from the blocks they fetched.
+    small_cache = HTTPRangeReader(_get_url(server, '/data.bin'), block_size=1024, cache_size=2048,
+                                  connection_pool=connection_pool)
+    small_cache.seek(100)
+    assert small_cache.read(5000) == data[100:5100], 'Wrong bytes past the cache size.'
+    request_count = small_cache.request_count
+    assert small_cache.read(5000) == data[5100:10100], 'Wrong sequential bytes past the cache size.'
+    assert small_cache.request_count == request_count + 1, 'Should fetch the missing blocks together.'
+
+    assert len(server.connections) == 1, 'Connection should be kept alive.'
+    connection_pool.clear()
+
+
+def test_errors(server):
+    with pytest.raises(IOError):
+        HTTPRangeReader(_get_url(server, '/missing.fits'), connection_pool=HTTPConnectionPool()).read(10)
+
+    with pytest.raises(ValueError):
+        HTTPRangeReader('ftp://127.0.0.1/data.bin').read(10)
+
+
+def test_cutout(server):
+    cube_file = test_context.random_test_file_name_path()
+    fits.HDUList([fits.PrimaryHDU(),
+                  fits.ImageHDU(data=np.arange(200 * 100 * 100, dtype=np.float32).reshape(200, 100, 100))]
+                 ).writeto(cube_file, overwrite=True)
+
+    with open(cube_file, 'rb') as input_stream:
+        server.files['/cube.fits'] = input_stream.read()
+
+    cutout_dimensions_str = '[1][10:40,5:20,150:151]'
+    expected_file = test_context.random_test_file_name_path()
+    with open(cube_file, 'rb') as input_stream, open(expected_file, 'ab+') as output_writer:
+        FITSHelper(input_stream, output_writer).cutout(cutout_dimensions_str)
+
+    result_file = test_context.random_test_file_name_path()
+    test_subject = HTTPRangeReader(_get_url(server, '/cube.fits'), block_size=64 * 1024,
+                                   connection_pool=HTTPConnectionPool())
+    with open(result_file, 'ab+') as output_writer:
+        FITSHelper(test_subject, output_writer).cutout(cutout_dimensions_str)
+
+    assert test_subject.bytes_transferred < len(server.files['/cube.fits']) / 10, 'Should transfer little of the file.'
+
+    with fits.open(expected_file) as expected_hdu_list, fits.open(result_file) as result_hdu_list:
+        assert len(expected_hdu_list) == len(result_hdu_list), 'Wrong HDU count.'
+        for expected_hdu, result_hdu in zip(expected_hdu_list, result_hdu_list):
+            assert expected_hdu.header == result_hdu.header, 'Headers do not match.'
+            np.testing.assert_array_equal(expected_hdu.data, result_hdu.data, 'Arrays do not match.')
@@ -186,3 +186,43 @@ def test_mef_cutout():
             hdu1.data, expected1, 'Arrays 1 do not match.')
         np.testing.assert_array_equal(
             hdu2.data, expected2, 'Arrays 2 do not match.')
+
+
+def test_mef_cutout_batch():
+    test_subject = OpenCADCCutout()
+    target_file_name = _create_mef_file()
+    cutout_region_strs = ['[2][20:35,40:50][3]', '[1][10:20,10:20]', '[3][2:51,2:41]', '[1][300:800,810:1000]']
+    cutout_file_name_paths = []
+
+    output_writers = []
+    for _ in cutout_region_strs:
+        cutout_file_name_paths.append(test_context.random_test_file_name_path())
+        output_writers.append(open(cutout_file_name_paths[-1], 'ab+'))
+
+    with open(target_file_name, 'rb') as input_reader:
+        counts = test_subject.cutout_batch(input_reader, list(zip(cutout_region_strs, output_writers)), 'FITS')
+
+    for output_writer in output_writers:
+        output_writer.close()
+
+    assert counts == [2, 1, 1, 0], 'Wrong cutout counts.'
+
+    for cutout_region_str, cutout_file_name_path in zip(cutout_region_strs[:-1], cutout_file_name_paths):
+        expected_file_name_path = test_context.random_test_file_name_path()
+        with open(expected_file_name_path, 'ab+') as output_writer, open(target_file_name, 'rb') as input_reader:
+            test_subject.cutout(input_reader, output_writer, cutout_region_str, 'FITS')
+
+        with fits.open(expected_file_name_path) as expected_hdu_list, \
+                fits.open(cutout_file_name_path) as result_hdu_list:
+            assert len(expected_hdu_list) == len(result_hdu_list), 'Wrong HDU count.'
+            for expected_hdu, result_hdu in zip(expected_hdu_list, result_hdu_list):
+                assert expected_hdu.header == result_hdu.header, 'Headers do not match.'
+                np.testing.assert_array_equal(expected_hdu.data, result_hdu.data, 'Arrays do not match.')
+
+    results = []
+    with open(target_file_name, 'rb') as input_reader:
+        test_subject.cutout_batch(input_reader, ['[1][10:20,10:20]', '[2][5:7,7:9]'], 'FITS',
+                                  sink=lambda idx, header, data: results.append((idx, header, data)))
+
+    assert [idx for idx, _, _ in results] == [0, 1], 'Wrong sink calls.'
+    np.testing.assert_array_equal(results[1][2], np.arange(20000).reshape(200, 100)[6:9, 4:7], 'Wrong sink data.')
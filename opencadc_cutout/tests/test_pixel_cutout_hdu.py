@@ -107,6 +107,19 @@ def test_get_ranges():
     ranges = test_subject.get_ranges()
     assert ranges == ((10, 20), (30, 30)), 'Wrong ranges output.'
 
+def test_get_steps():
+    test_subject = PixelCutoutHDU([(1,200), (305,600)])
+    assert test_subject.get_steps() == (1, 1), 'Wrong default steps.'
+    assert not test_subject.has_steps(), 'Should not have steps.'
+
+    test_subject = PixelCutoutHDU([(1,200,4), (30)])
+    assert test_subject.get_steps() == (4, 1), 'Wrong steps.'
+    assert test_subject.get_ranges() == ((1, 200), (30, 30)), 'Wrong ranges output.'
+    assert test_subject.has_steps(), 'Should have steps.'
+
+    with pytest.raises(ValueError):
+        PixelCutoutHDU([(1,200,0)])
+
 def test_get_position():
     test_subject = PixelCutoutHDU([(1,200), (305,360), (400,1000)])
     position = test_subject.get_position()
@@ -101,3 +101,12 @@ def test_parse():
   result = test_subject.parse('[0][500:600,700:1200,6:10]')
   assert result[0].get_extension() == 0, 'Wrong extension.'
   assert result[0].dimension_ranges == [(500,600),(700,1200),(6,10)], 'Wrong ranges.'
+
+  result = test_subject.parse('[SCI,2][1:4000:4,1:4000:4]')
+  assert result[0].get_extension() == ('SCI', 2), 'Wrong extension.'
+  assert result[0].dimension_ranges == [(1,4000,4),(1,4000,4)], 'Wrong stepped ranges.'
+  assert result[0].get_steps() == (4, 4), 'Wrong steps.'
+
+  for bad_range in ['[1:40:0]', '[1:40:]', '[1:40:2:2]']:
+    with pytest.raises(PixelRangeInputParserError):
+      test_subject.parse(bad_range)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import os
+import pytest
+
+from opencadc_cutout.file_helpers.fits.read_planner import ReadPlanner
+
+
+pytest.main(args=['-s', os.path.abspath(__file__)])
+
+
+def test_plan_merge():
+    test_subject = ReadPlanner(gap_threshold=10)
+    # Three rows of 20 bytes, 5 bytes apart, then one far away.
+    offsets = [100, 125, 150, 1000]
+    result = test_subject.plan(offsets, 20, [0, 20, 40, 60])
+
+    assert len(result.blocks) == 2, 'Wrong block count.'
+    assert result.blocks[0].offset == 100, 'Wrong first offset.'
+    assert result.blocks[0].length == 70, 'Wrong first length.'
+    np.testing.assert_array_equal(result.blocks[0].span_offsets, [0, 25, 50], 'Wrong span offsets.')
+    assert result.blocks[1].offset == 1000, 'Wrong second offset.'
+    assert result.bytes_used == 80, 'Wrong bytes used.'
+    assert result.bytes_read == 90, 'Wrong bytes read.'
+    assert test_subject.bytes_read == 90, 'Wrong total bytes read.'
+
+    # No merging of gaps.
+    result = ReadPlanner(gap_threshold=0).plan(offsets, 20, [0, 20, 40, 60])
+    assert len(result.blocks) == 4, 'Wrong block count.'
+    assert result.bytes_read == result.bytes_used, 'Should not read gaps.'
+
+
+def test_plan_unordered():
+    test_subject = ReadPlanner(gap_threshold=0)
+    result = test_subject.plan([40, 0, 20], 20, [40, 0, 20])
+
+    assert len(result.blocks) == 1, 'Contiguous spans should be one block.'
+    assert result.blocks[0].is_direct(), 'Should read directly into the output.'
+
+    result = test_subject.plan([40, 0, 20], 20, [0, 20, 40])
+    assert len(result.blocks) == 1, 'Contiguous spans should be one block.'
+    assert not result.blocks[0].is_direct(), 'Out of order output needs scattering.'
+
+
+def test_plan_max_block_size():
+    test_subject = ReadPlanner(gap_threshold=100, max_block_size=50)
+    result = test_subject.plan([0, 20, 40, 60, 80], 20, np.arange(5) * 20)
+
+    assert [b.offset for b in result.blocks] == [0, 40, 80], 'Wrong block offsets.'
+    assert [b.length for b in result.blocks] == [40, 40, 20], 'Wrong block lengths.'
+
+
+def test_plan_empty():
+    result = ReadPlanner().plan([], 20, [])
+    assert result.blocks == [], 'Should be empty.'
+    assert result.bytes_read == 0, 'Nothing to read.'
+
+    with pytest.raises(ValueError):
+        ReadPlanner(gap_threshold=-1)
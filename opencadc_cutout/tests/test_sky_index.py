@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import numpy as np
+import os
+import pytest
+import tempfile
+import context as test_context
+
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from opencadc_cutout.sky_index import SkyIndex, _get_cells
+from opencadc_cutout.sky_region import CircleRegion, PolygonRegion
+
+
+pytest.main(args=['-s', os.path.abspath(__file__)])
+
+
+def _create_tile(path, crval1, crval2):
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcs.wcs.crpix = [50.5, 50.5]
+    wcs.wcs.crval = [crval1, crval2]
+    wcs.wcs.cdelt = [-0.01, 0.01]
+    hdu = fits.PrimaryHDU(data=np.arange(10000, dtype=np.float32).reshape(100, 100), header=wcs.to_header())
+    fits.HDUList([hdu, fits.ImageHDU(data=np.zeros((10, 10), dtype=np.float32))]).writeto(path)
+
+
+def _create_tiles():
+    tile_dir = tempfile.mkdtemp(dir=os.path.dirname(test_context.random_test_file_name_path()))
+    os.makedirs(os.path.join(tile_dir, 'a'))
+    os.makedirs(os.path.join(tile_dir, 'b'))
+    _create_tile(os.path.join(tile_dir, 'a', 'tile.fits'), 0.2, 10.0)
+    _create_tile(os.path.join(tile_dir, 'b', 'tile.fits'), 358.9, 10.0)
+    _create_tile(os.path.join(tile_dir, 'far.fits'), 180.0, -45.0)
+    with open(os.path.join(tile_dir, 'notes.txt'), 'w') as notes:
+        notes.write('Not a FITS file.')
+    return tile_dir
+
+
+def test_get_cells():
+    assert _get_cells(10.0, 0.0, 0.1, 1.0) == {(90, 9), (90, 10), (89, 9), (89, 10)}, 'Wrong cells.'
+    assert {column for _, column in _get_cells(0.1, 50.0, 0.5, 1.0)} == {359, 0}, 'Should wrap around RA 0.'
+    assert len({column for _, column in _get_cells(0.0, 89.8, 0.5, 1.0)}) == 360, 'Should span all RA at a pole.'
+
+
+def test_query():
+    tile_dir = _create_tiles()
+    test_subject = SkyIndex()
+
+    assert test_subject.scan(tile_dir) == 3, 'Should read every FITS file.'
+    assert len(test_subject) == 3, 'Wrong file count.'
+    assert test_subject.scan(tile_dir) == 0, 'Should not read unchanged files again.'
+
+    tile_a = os.path.join(tile_dir, 'a', 'tile.fits')
+    tile_b = os.path.join(tile_dir, 'b', 'tile.fits')
+    assert test_subject.query(CircleRegion(0.2, 10.0, 0.1)) == [(tile_a, [0])], 'Wrong overlap.'
+    assert test_subject.query(CircleRegion(359.6, 10.0, 0.1)) == [(tile_a, [0]), (tile_b, [0])], \
+        'Should match across RA 0.'
+    assert test_subject.query(PolygonRegion([(90.0, 0.0), (91.0, 0.0), (91.0, 1.0)])) == [], 'Should match nothing.'
+
+    index_path = os.path.join(tile_dir, 'tiles.skyidx')
+    test_subject.save(index_path)
+    loaded = SkyIndex.load(index_path)
+    assert loaded.query(CircleRegion(180.0, -45.0, 0.1)) == [(os.path.join(tile_dir, 'far.fits'), [0])], \
+        'Wrong overlap after loading.'
+
+    os.remove(tile_b)
+    _create_tile(os.path.join(tile_dir, 'c.fits'), 100.0, 0.0)
+    assert loaded.scan(tile_dir) == 1, 'Should only read the new file.'
+    assert loaded.query(CircleRegion(359.6, 10.0, 0.1)) == [(tile_a, [0])], 'Should drop removed files.'
+
+
+def test_cutout():
+    tile_dir = _create_tiles()
+    test_subject = SkyIndex()
+    test_subject.scan(tile_dir)
+    output_dir = os.path.join(tile_dir, 'output')
+
+    results = test_subject.cutout('CIRCLE 359.55 10.0 0.3', output_dir, max_workers=2)
+    assert [path for path, _ in results] == [os.path.join(tile_dir, 'a', 'tile.fits'),
+                                             os.path.join(tile_dir, 'b', 'tile.fits')], 'Wrong files cut out.'
+    assert len(set(output_path for _, output_path in results)) == 2, 'Outputs should not collide.'
+
+    for _, output_path in results:
+        with fits.open(output_path) as hdu_list:
+            assert len(hdu_list) == 1 and hdu_list[0].data.shape[0] < 100, 'Should only cut out the region.'
+
+    # Overlaps the enclosing circle of the footprint of b/tile.fits, but not the footprint itself.
+    results = test_subject.cutout('CIRCLE 359.6 10.0 0.1', output_dir)
+    assert [path for path, _ in results] == [os.path.join(tile_dir, 'a', 'tile.fits')], 'Wrong files cut out.'
+
+
+def test_mosaic():
+    tile_dir = _create_tiles()
+    test_subject = SkyIndex()
+    test_subject.scan(tile_dir)
+
+    output_stream = io.BytesIO()
+    assert test_subject.mosaic('CIRCLE 180.0 -45.0 0.1', output_stream) == 1, 'Should use the one tile.'
+    output_stream.seek(0)
+    with fits.open(output_stream) as hdu_list:
+        assert hdu_list[0].data.shape == (23, 23), 'Wrong mosaic shape.'
+
+    # The tiles on either side of RA 0 don't share a grid.
+    with pytest.raises(ValueError):
+        test_subject.mosaic('CIRCLE 359.55 10.0 0.3', io.BytesIO())
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import pytest
+import os
+import numpy as np
+
+from opencadc_cutout.sky_region import CircleRegion, PolygonRegion, SpectralBand, get_separation
+from opencadc_cutout.sky_region_parser import SkyRegionParser, SkyRegionParserError
+
+pytest.main(args=['-s', os.path.abspath(__file__)])
+
+
+def test_parse():
+    test_subject = SkyRegionParser()
+
+    assert test_subject.is_sky_region('circle 1 2 3'), 'Should be a sky region.'
+    assert not test_subject.is_sky_region('[9][500:600]'), 'Should not be a sky region.'
+
+    for bogus in ['BOGUS 78 9', 'CIRCLE 1 2', 'CIRCLE 1 2 -3', 'CIRCLE 1 95 3', 'CIRCLE a b c', 'POLYGON 1 2 3 4',
+                  'POLYGON 1 2 3 4 5']:
+        with pytest.raises(SkyRegionParserError):
+            test_subject.parse(bogus)
+
+    result = test_subject.parse(' CIRCLE=12.5 -34.0 0.5 ')
+    assert isinstance(result, CircleRegion), 'Wrong region.'
+    assert (result.ra, result.dec, result.radius) == (12.5, -34.0, 0.5), 'Wrong circle.'
+
+    result = test_subject.parse('POLYGON 359.0 10.0 1.0 10.0 1.0 12.0 359.0 12.0')
+    assert isinstance(result, PolygonRegion), 'Wrong region.'
+    np.testing.assert_array_equal(result.ra, [359.0, 1.0, 1.0, 359.0], 'Wrong vertices.')
+    np.testing.assert_array_equal(result.dec, [10.0, 10.0, 12.0, 12.0], 'Wrong vertices.')
+
+
+def test_parse_band():
+    test_subject = SkyRegionParser()
+
+    assert test_subject.is_sky_region('BAND 0.2 0.3'), 'Should be a band.'
+
+    for bogus in ['BAND 0.2', 'BAND 0.2 0.3 0.4', 'BAND -0.2 0.3', 'BAND 0.2 0.3 nm']:
+        with pytest.raises(SkyRegionParserError):
+            test_subject.parse(bogus)
+
+    result = test_subject.parse('BAND 0.3 0.2')
+    assert isinstance(result, SpectralBand), 'Wrong band.'
+    assert (result.lower, result.upper) == (0.2, 0.3), 'Wrong band interval.'
+
+    result = test_subject.parse('BAND 1.0e9 2.0e9 Hz')
+    np.testing.assert_allclose([result.lower, result.upper], [0.149896229, 0.299792458], err_msg='Wrong band.')
+
+    result = test_subject.parse_cutout('CIRCLE 12.5 -34.0 0.5 BAND 0.2 0.3 m')
+    assert isinstance(result.region, CircleRegion), 'Wrong region.'
+    assert (result.band.lower, result.band.upper) == (0.2, 0.3), 'Wrong band.'
+
+    result = test_subject.parse_cutout('BAND=0.2 0.3')
+    assert result.region is None and isinstance(result.band, SpectralBand), 'Should only be a band.'
+
+    for bogus in ['0.2 BAND 0.2 0.3', 'BAND 0.2 0.3 BAND 0.4 0.5', 'CIRCLE 1 2 3 CIRCLE 1 2 3']:
+        with pytest.raises(SkyRegionParserError):
+            test_subject.parse_cutout(bogus)
+
+
+def test_boundary():
+    circle = CircleRegion(359.9, -89.5, 0.7)
+    ra, dec = circle.get_boundary()
+    np.testing.assert_allclose(get_separation(circle.ra, circle.dec, ra, dec), 0.7, err_msg='Wrong circle boundary.')
+
+    # Across RA 0, the bounding circle is centred between the vertices.
+    polygon = PolygonRegion([(359.0, 10.0), (1.0, 10.0), (1.0, 12.0), (359.0, 12.0)])
+    ra, dec, radius = polygon.get_bounding_circle()
+    assert get_separation(ra, dec, 0.0, 11.0) < 0.01, 'Wrong bounding circle centre.'
+    assert 1.4 < radius < 1.42, 'Wrong bounding circle radius.'
+
+    ra, dec = polygon.get_boundary()
+    assert np.all((ra <= 1.0 + 1e-9) | (ra >= 359.0 - 1e-9)), 'Edges should not go the long way around.'
+    assert np.all((dec >= 10.0) & (dec <= 12.01)), 'Edges should stay near the polygon.'
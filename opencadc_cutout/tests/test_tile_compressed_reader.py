@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2018.                            (c) 2018.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU AfferoF
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  $Revision: 1 $
+#
+# ***********************************************************************
+#
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import numpy as np
+import os
+import pytest
+import context as test_context
+
+from astropy.io import fits
+
+from opencadc_cutout.cutoutnd import StreamedCutout
+from opencadc_cutout.file_helpers.fits.fits_file_helper import FITSHelper
+from opencadc_cutout.file_helpers.fits.fits_header_scanner import FITSHeaderScanner
+from opencadc_cutout.file_helpers.fits.tile_compressed_reader import (
+    TileCompressedReader, TILE_COMPRESSION_SUPPORTED)
+from opencadc_cutout.forward_only_reader import ForwardOnlyReader
+
+
+pytest.main(args=['-s', os.path.abspath(__file__)])
+pytestmark = pytest.mark.skipif(not TILE_COMPRESSION_SUPPORTED,
+                                reason='Tile compression not supported by this Astropy.')
+
+
+def _create_compressed_file(data, **kwargs):
+    compressed_file = test_context.random_test_file_name_path()
+    hdu = fits.CompImageHDU(data=data, name='SCI', **kwargs)
+    fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(compressed_file, overwrite=True)
+    return compressed_file
+
+
+def _open_reader(input_stream, max_workers=4, **kwargs):
+    entry = FITSHeaderScanner(input_stream).get_index()[1]
+    assert entry.is_compressed_image(), 'Should be compressed.'
+    return TileCompressedReader(input_stream, entry.get_header(), entry.data_offset, max_workers=max_workers,
+                                **kwargs)
+
+
+def _expected(compressed_file):
+    with fits.open(compressed_file, do_not_scale_image_data=True) as hdu_list:
+        return hdu_list[1].data.copy()
+
+
+def test_getitem():
+    data = np.arange(3 * 90 * 70, dtype=np.int32).reshape(3, 90, 70)
+
+    for compression_type in ['RICE_1', 'GZIP_1', 'GZIP_2']:
+        compressed_file = _create_compressed_file(data, compression_type=compression_type, tile_shape=(1, 16, 32))
+        expected = _expected(compressed_file)
+
+        for max_workers in (1, 4):
+            with open(compressed_file, 'rb') as input_stream:
+                test_subject = _open_reader(input_stream, max_workers)
+                assert test_subject.shape == (3, 90, 70), 'Wrong shape.'
+
+                slices = (slice(1, 3), slice(20, 61), slice(5, 40))
+                np.testing.assert_array_equal(test_subject[slices], expected[slices], 'Sub array does not match.')
+                # Tiles (1, 2..3, 0..1) of a (3, 6, 3) tile grid.
+                assert len(test_subject.get_tiles(slices)) == 2 * 3 * 2, 'Wrong tile count.'
+
+                slices = (slice(0, 3, 2), slice(3, 90, 7), slice(1, 70, 5))
+                np.testing.assert_array_equal(test_subject[slices], expected[slices],
+                                              'Stepped sub array does not match.')
+                # Rows 3 to 87 by 40 only select tiles 0, 2 and 5 of the rows of tiles.
+                assert len(test_subject.get_tiles((slice(0, 1), slice(3, 90, 40)))) == 3 * 3, \
+                    'Stepped tile count wrong.'
+                np.testing.assert_array_equal(test_subject[...], expected, 'Whole array does not match.')
+
+
+
+def test_hcompress():
+    # The HCOMPRESS decoder isn't thread-safe, so its tiles are decompressed one at a time whatever the workers.
+    data = np.arange(1000 * 1000, dtype=np.int32).reshape(1000, 1000) % 5000
+    compressed_file = _create_compressed_file(data, compression_type='HCOMPRESS_1', tile_shape=(50, 50))
+    expected = _expected(compressed_file)
+
+    with open(compressed_file, 'rb') as input_stream:
+        test_subject = _open_reader(input_stream, max_workers=4)
+        slices = (slice(120, 480), slice(30, 370))
+        assert len(test_subject.get_tiles(slices)) > 1, 'Should span several tiles.'
+        np.testing.assert_array_equal(test_subject[slices], expected[slices], 'Sub array does not match.')
+
+def test_quantized():
+    rng = np.random.RandomState(7)
+    data = rng.normal(size=(64, 80)).astype(np.float32)
+    data[3, 4] = np.nan
+    compressed_file = _create_compressed_file(data, compression_type='RICE_1', tile_shape=(10, 80),
+                                              quantize_method=1)
+    expected = _expected(compressed_file)
+
+    with open(compressed_file, 'rb') as input_stream:
+        test_subject = _open_reader(input_stream)
+        slices = (slice(0, 33), slice(2, 50))
+        np.testing.assert_array_equal(test_subject[slices], expected[slices], 'Sub array does not match.')
+
+
+def test_tile_cache():
+    data = np.arange(6 * 40 * 50, dtype=np.int16).reshape(6, 40, 50)
+    # Each tile is two planes, so every other chunk of one plane starts from cached tiles.
+    compressed_file = _create_compressed_file(data, compression_type='RICE_1', tile_shape=(2, 20, 50))
+    tile_bytes = 2 * 20 * 50 * 2
+
+    with open(compressed_file, 'rb') as input_stream:
+        test_subject = _open_reader(input_stream, max_cache_bytes=tile_bytes)
+        streamed_cutout = StreamedCutout(test_subject, (slice(0, 6), slice(0, 40), slice(0, 50)), 50 * 40 * 2)
+        chunks = []
+        for chunk in streamed_cutout.iter_chunks():
+            chunks.append(chunk)
+            # Only the two tiles of the last chunk are kept, rather than every tile read so far.
+            assert len(test_subject._tile_cache) == 2, 'Wrong cached tile count.'
+            assert test_subject._tile_cache.nbytes == 2 * tile_bytes, 'Wrong cached bytes.'
+        assert len(chunks) == 6, 'Wrong chunk count.'
+        np.testing.assert_array_equal(np.concatenate(chunks), data, 'Streamed cutout does not match.')
+
+        # Tiles cached from the last read are reused.
+        first_tile = test_subject._tile_cache.get(5)
+        np.testing.assert_array_equal(test_subject[5:6, 20:40], data[5:6, 20:40], 'Cached tile does not match.')
+        assert test_subject._tile_cache.get(5) is first_tile, 'Should reuse the cached tile.'
+
+
+def _cutout(input_stream, cutout_dimensions_str, **kwargs):
+    output_file = test_context.random_test_file_name_path()
+    with open(output_file, 'ab+') as output_writer:
+        FITSHelper(input_stream, output_writer, **kwargs).cutout(cutout_dimensions_str)
+    return output_file
+
+
+def test_cutout():
+    data = np.arange(200 * 150, dtype=np.int16).reshape(200, 150)
+    compressed_file = _create_compressed_file(data, compression_type='RICE_1', tile_shape=(25, 150))
+    uncompressed_file = test_context.random_test_file_name_path()
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data=data, name='SCI')]).writeto(uncompressed_file)
+    cutout_dimensions_str = '[SCI][20:71,101:160][1][5:9,3:7]'
+
+    with open(compressed_file, 'rb') as input_stream:
+        result_file = _cutout(ForwardOnlyReader(io.BytesIO(input_stream.read())), cutout_dimensions_str)
+
+    with open(uncompressed_file, 'rb') as input_stream:
+        expected_file = _cutout(input_stream, cutout_dimensions_str)
+
+    with fits.open(expected_file) as expected_hdu_list, fits.open(result_file) as result_hdu_list:
+        assert len(result_hdu_list) == 3, 'Wrong HDU count.'
+        assert result_hdu_list[1].header['XTENSION'] == 'IMAGE', 'Should be uncompressed.'
+        assert result_hdu_list[1].header.get('ZIMAGE') is None, 'Should not have compression keywords.'
+        for expected_hdu, result_hdu in zip(expected_hdu_list[1:], result_hdu_list[1:]):
+            np.testing.assert_array_equal(result_hdu.data, expected_hdu.data, 'Arrays do not match.')
+
+
+def test_streamed_cutout():
+    data = np.arange(8 * 60 * 50, dtype=np.int32).reshape(8, 60, 50)
+    compressed_file = _create_compressed_file(data, compression_type='RICE_1', tile_shape=(3, 20, 50))
+    cutout_dimensions_str = '[SCI][5:45,11:51,2:8]'
+
+    for memory_budget in (None, 10000):
+        with open(compressed_file, 'rb') as input_stream:
+            result_file = _cutout(input_stream, cutout_dimensions_str, memory_budget=memory_budget)
+
+        with fits.open(result_file) as result_hdu_list:
+            np.testing.assert_array_equal(result_hdu_list[0].data, data[1:8, 10:51, 4:45],
+                                          'Streamed cutout does not match.')
@@ -1,5 +1,7 @@
 
-__all__ = ['to_num', 'is_integer']
+import os
+
+__all__ = ['to_num', 'is_integer', 'get_file_identity']
 
 def to_num(s):
     try:
@@ -16,3 +18,23 @@ def is_integer(s):
         return True
     except ValueError:
         return False
+
+def get_file_identity(input_stream):
+    """
+    Identify the file behind the given stream by its path, size and modification time, so that a file that changes
+    gets a new identity.
+    :param input_stream: File-like object.  It must have a name and a file descriptor.
+    :return: The identity as a string, or None if the stream is not backed by a named file.
+    """
+    name = getattr(input_stream, 'name', None)
+
+    try:
+        stat = os.fstat(input_stream.fileno())
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+    if not name or not isinstance(name, str):
+        return None
+    else:
+        mtime = getattr(stat, 'st_mtime_ns', None) or int(stat.st_mtime * 1e9)
+        return '{}:{}:{}'.format(os.path.realpath(name), stat.st_size, mtime)